@@ -9,11 +9,26 @@ class SMTPSettings(BaseSettings):
     SMTP_PASSWORD: str = Field("SMTP_PASSWORD")
     SMTP_FROM: str = Field("SMTP_FROM")
     USE_SMTP: bool = Field("USE_SMTP")
+    SMTP_STARTTLS: bool = Field(env="SMTP_STARTTLS", default=True)
+    SMTP_TIMEOUT: float = Field(env="SMTP_TIMEOUT", default=10.0)
+    SMTP_POOL_SIZE: int = Field(env="SMTP_POOL_SIZE", default=4)
+    SMTP_POOL_MAX_MESSAGES: int = Field(env="SMTP_POOL_MAX_MESSAGES", default=100)
+    SMTP_POOL_IDLE_TIMEOUT: float = Field(env="SMTP_POOL_IDLE_TIMEOUT", default=30.0)
 
 
 class EmailServer(BaseSettings):
     api_key: str = Field("API_KEY")
 
 
+class DeliverySettings(BaseSettings):
+    DELIVERY_QUEUE_SIZE: int = Field(env="DELIVERY_QUEUE_SIZE", default=1000)
+    DELIVERY_WORKERS: int = Field(env="DELIVERY_WORKERS", default=4)
+    DELIVERY_MAX_ATTEMPTS: int = Field(env="DELIVERY_MAX_ATTEMPTS", default=5)
+    DELIVERY_BACKOFF_BASE: float = Field(env="DELIVERY_BACKOFF_BASE", default=1.0)
+    DELIVERY_BACKOFF_MAX: float = Field(env="DELIVERY_BACKOFF_MAX", default=60.0)
+    DELIVERY_MAX_STATUSES: int = Field(env="DELIVERY_MAX_STATUSES", default=10000)
+
+
 email_server = EmailServer()
 smtp_settings = SMTPSettings()
+delivery_settings = DeliverySettings()
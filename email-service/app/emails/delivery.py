@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import random
+import uuid
+from collections import OrderedDict
+from email.mime.text import MIMEText
+
+from ..config import delivery_settings, smtp_settings
+from ..metrics import track_stage
+from .schemas import EmailRequest
+from .smtp_pool import smtp_pool
+
+log = logging.getLogger("uvicorn")
+
+
+class DeliveryQueueFullError(Exception):
+    pass
+
+
+def build_activation_message(email_request: EmailRequest) -> str:
+    subject = "Activation Code"
+    body = f"Your Activation code is: {email_request.code}"
+
+    message = MIMEText(body, "plain")
+    message["Subject"] = subject
+    message["From"] = smtp_settings.SMTP_FROM
+    message["To"] = email_request.email
+    return message.as_string()
+
+
+def deliver_activation_email(email_request: EmailRequest):
+    print(f"Your Activation code is: {email_request.code}")
+    if smtp_settings.USE_SMTP:
+        with track_stage("send", "build_message"):
+            message = build_activation_message(email_request)
+        with track_stage("send", "deliver"):
+            smtp_pool.send(smtp_settings.SMTP_FROM, email_request.email, message)
+
+
+class DeliveryQueue:
+    """
+    In-memory queue of activation emails delivered by a pool of async workers.
+
+    Failed deliveries are put back on the queue after an exponential backoff
+    until `max_attempts` is reached. The status of the last `max_statuses`
+    messages is kept so callers can look them up by id.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        workers: int,
+        max_attempts: int,
+        backoff_base: float,
+        backoff_max: float,
+        max_statuses: int,
+    ):
+        self.max_size = max_size
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_statuses = max_statuses
+        self._queue = None
+        self._tasks = set()
+        self._statuses = OrderedDict()
+        self._busy_workers = 0
+        self._counters = {
+            "enqueued": 0,
+            "rejected": 0,
+            "sent": 0,
+            "retried": 0,
+            "failed": 0,
+        }
+
+    def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        for _ in range(self.workers):
+            self._spawn(self._worker())
+
+    async def stop(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._queue = None
+
+    def _spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _set_status(self, message_id: str, **fields):
+        status = self._statuses.setdefault(message_id, {"message_id": message_id})
+        status.update(fields)
+        self._statuses.move_to_end(message_id)
+        while len(self._statuses) > self.max_statuses:
+            self._statuses.popitem(last=False)
+
+    def enqueue(self, email_request: EmailRequest) -> str:
+        if self._queue is None or self._queue.full():
+            self._counters["rejected"] += 1
+            raise DeliveryQueueFullError("The delivery queue is full")
+        message_id = str(uuid.uuid4())
+        self._queue.put_nowait((message_id, email_request, 1))
+        self._counters["enqueued"] += 1
+        self._set_status(message_id, status="queued", attempts=0, detail=None)
+        return message_id
+
+    def get_status(self, message_id: str):
+        return self._statuses.get(message_id)
+
+    def backoff(self, attempts: int) -> float:
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _retry_later(self, message_id, email_request, attempts, delay):
+        await asyncio.sleep(delay)
+        await self._queue.put((message_id, email_request, attempts))
+
+    async def _worker(self):
+        while True:
+            message_id, email_request, attempts = await self._queue.get()
+            self._busy_workers += 1
+            self._set_status(message_id, status="sending", attempts=attempts)
+            try:
+                with track_stage("queue", "deliver"):
+                    await asyncio.to_thread(deliver_activation_email, email_request)
+            except Exception as e:
+                detail = f"Failed to send email: {str(e)}"
+                if attempts >= self.max_attempts:
+                    self._counters["failed"] += 1
+                    self._set_status(message_id, status="failed", detail=detail)
+                    log.error("Failed to deliver message %s: %s", message_id, e)
+                else:
+                    self._counters["retried"] += 1
+                    self._set_status(message_id, status="retrying", detail=detail)
+                    self._spawn(
+                        self._retry_later(
+                            message_id,
+                            email_request,
+                            attempts + 1,
+                            self.backoff(attempts),
+                        )
+                    )
+            else:
+                self._counters["sent"] += 1
+                self._set_status(message_id, status="sent", detail=None)
+            finally:
+                self._busy_workers -= 1
+                self._queue.task_done()
+
+    def stats(self) -> dict:
+        return {
+            "max_size": self.max_size,
+            "depth": self._queue.qsize() if self._queue is not None else 0,
+            "workers": self.workers,
+            "busy_workers": self._busy_workers,
+            **self._counters,
+        }
+
+
+delivery_queue = DeliveryQueue(
+    max_size=delivery_settings.DELIVERY_QUEUE_SIZE,
+    workers=delivery_settings.DELIVERY_WORKERS,
+    max_attempts=delivery_settings.DELIVERY_MAX_ATTEMPTS,
+    backoff_base=delivery_settings.DELIVERY_BACKOFF_BASE,
+    backoff_max=delivery_settings.DELIVERY_BACKOFF_MAX,
+    max_statuses=delivery_settings.DELIVERY_MAX_STATUSES,
+)
@@ -1,16 +1,33 @@
-import smtplib
-from email.mime.text import MIMEText
-
 from fastapi import APIRouter, HTTPException, Security, status
 from fastapi.security import APIKeyHeader
 
 from ..config import email_server, smtp_settings
-from .schemas import EmailRequest
+from .delivery import (
+    DeliveryQueueFullError,
+    build_activation_message,
+    deliver_activation_email,
+    delivery_queue,
+)
+from .schemas import (
+    EmailBatchRequest,
+    EmailBatchResponse,
+    EmailRequest,
+    QueuedEmailResponse,
+)
+from .smtp_pool import smtp_pool
 
 router = APIRouter(prefix="")
 header_scheme = APIKeyHeader(name="x-api-key")
 
 
+def check_api_key(api_key_header: str):
+    if api_key_header != email_server.api_key:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Forbidden, you can't send email",
+        )
+
+
 @router.post(
     "/send",
     summary="Send Activation Email",
@@ -33,34 +50,132 @@ def send_email(
     - **403 Forbidden**: If the API key is invalid.
     - **500 Internal Server Error**: If an error occurs while sending the email.
     """
-    if api_key_header != email_server.api_key:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Forbidden, you can't send email",
-        )
+    check_api_key(api_key_header)
     try:
-        if smtp_settings.USE_SMTP:
-            subject = "Activation Code"
-            body = f"Your Activation code is: {email_request.code}"
-
-            message = MIMEText(body, "plain")
-            message["Subject"] = subject
-            message["From"] = smtp_settings.SMTP_FROM
-            message["To"] = email_request.email
-            print(f"Your Activation code is: {email_request.code}")
-            with smtplib.SMTP(
-                smtp_settings.SMTP_SERVER, smtp_settings.SMTP_PORT
-            ) as server:
-                server.starttls()
-                server.login(smtp_settings.SMTP_USERNAME, smtp_settings.SMTP_PASSWORD)
-                server.sendmail(
-                    smtp_settings.SMTP_FROM, email_request.email, message.as_string()
-                )
-        else:
-            print(f"Your Activation code is: {email_request.code}")
+        deliver_activation_email(email_request)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to send email: {str(e)}",
         )
     return {"message": "Email sent successfully"}
+
+
+@router.post(
+    "/send-batch",
+    summary="Send Activation Emails in batch",
+    description="Sends several activation emails over a single SMTP session.",
+)
+def send_email_batch(
+    batch_request: EmailBatchRequest, api_key_header: str = Security(header_scheme)
+) -> EmailBatchResponse:
+    """
+    Endpoint to send activation emails to several users in one call.
+
+    **Parameters**:
+    - **batch_request (EmailBatchRequest)**: The request body containing the list of emails and activation codes.
+    - **api_key_header (str)**: API key to authenticate the request.
+
+    A failure to send one email doesn't fail the whole batch, the status of every
+    email is returned in the same order as the request items. When the SMTP server
+    can't be reached, every email of the batch is reported as failed.
+
+    **Returns**:
+    - **EmailBatchResponse**: The number of sent and failed emails and the status of each email.
+
+    **Raises**:
+    - **403 Forbidden**: If the API key is invalid.
+    """
+    check_api_key(api_key_header)
+    if smtp_settings.USE_SMTP:
+        errors = smtp_pool.send_many(
+            smtp_settings.SMTP_FROM,
+            [
+                (item.email, build_activation_message(item))
+                for item in batch_request.items
+            ],
+        )
+    else:
+        errors = [None] * len(batch_request.items)
+
+    results = [
+        {
+            "email": item.email,
+            "status": "failed" if error else "sent",
+            "detail": f"Failed to send email: {str(error)}" if error else None,
+        }
+        for item, error in zip(batch_request.items, errors)
+    ]
+    failed = sum(1 for error in errors if error)
+    return EmailBatchResponse(
+        sent=len(results) - failed, failed=failed, results=results
+    )
+
+
+@router.post(
+    "/queue",
+    status_code=status.HTTP_202_ACCEPTED,
+    summary="Queue Activation Email",
+    description="Queues an activation email to be sent in the background.",
+)
+async def queue_email(
+    email_request: EmailRequest, api_key_header: str = Security(header_scheme)
+) -> QueuedEmailResponse:
+    """
+    Endpoint to queue an activation email, the caller doesn't wait for the SMTP exchange.
+
+    **Parameters**:
+    - **email_request (EmailRequest)**: The request body containing the user's email and activation code.
+    - **api_key_header (str)**: API key to authenticate the request.
+
+    The email is delivered by a pool of background workers and retried with an
+    exponential backoff on failure. Its status can be looked up with the returned id.
+
+    **Returns**:
+    - **QueuedEmailResponse**: The id and status of the queued message.
+
+    **Raises**:
+    - **403 Forbidden**: If the API key is invalid.
+    - **503 Service Unavailable**: If the delivery queue is full.
+    """
+    check_api_key(api_key_header)
+    try:
+        message_id = delivery_queue.enqueue(email_request)
+    except DeliveryQueueFullError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="The delivery queue is full, please try again later",
+            headers={"Retry-After": "1"},
+        )
+    return delivery_queue.get_status(message_id)
+
+
+@router.get(
+    "/messages/{message_id}",
+    summary="Get Queued Email Status",
+    description="Returns the delivery status of a queued activation email.",
+)
+async def get_email_status(
+    message_id: str, api_key_header: str = Security(header_scheme)
+) -> QueuedEmailResponse:
+    """
+    Endpoint to get the delivery status of a queued email.
+
+    **Parameters**:
+    - **message_id (str)**: The id returned when the email was queued.
+    - **api_key_header (str)**: API key to authenticate the request.
+
+    **Returns**:
+    - **QueuedEmailResponse**: The status (queued, sending, retrying, sent or failed), the number of attempts and the last error.
+
+    **Raises**:
+    - **403 Forbidden**: If the API key is invalid.
+    - **404 Not Found**: If the message is unknown or its status expired.
+    """
+    check_api_key(api_key_header)
+    message_status = delivery_queue.get_status(message_id)
+    if message_status is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Message not found"
+        )
+    return message_status
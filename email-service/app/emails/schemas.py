@@ -1,6 +1,7 @@
 import re
+from typing import List, Literal, Optional
 
-from pydantic import BaseModel, EmailStr, validator
+from pydantic import BaseModel, EmailStr, conlist, validator
 
 
 class EmailRequest(BaseModel):
@@ -12,3 +13,26 @@ class EmailRequest(BaseModel):
         if not re.match(r"^\d{4}$", v):
             raise ValueError("Activation code must be exactly 4 digits")
         return v
+
+
+class EmailBatchRequest(BaseModel):
+    items: conlist(EmailRequest, min_length=1, max_length=500)
+
+
+class EmailBatchItemResult(BaseModel):
+    email: EmailStr
+    status: Literal["sent", "failed"]
+    detail: Optional[str] = None
+
+
+class EmailBatchResponse(BaseModel):
+    sent: int
+    failed: int
+    results: List[EmailBatchItemResult]
+
+
+class QueuedEmailResponse(BaseModel):
+    message_id: str
+    status: Literal["queued", "sending", "retrying", "sent", "failed"]
+    attempts: int
+    detail: Optional[str] = None
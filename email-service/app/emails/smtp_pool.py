@@ -0,0 +1,256 @@
+import smtplib
+import threading
+import time
+from collections import deque
+
+from ..config import smtp_settings
+from ..metrics import track_stage
+
+
+class SMTPPoolTimeoutError(Exception):
+    pass
+
+
+class SMTPSession:
+    def __init__(self, smtp: smtplib.SMTP):
+        self.smtp = smtp
+        self.messages_sent = 0
+        self.last_used = time.monotonic()
+
+
+class SMTPConnectionPool:
+    """
+    Pool of authenticated SMTP sessions shared by the whole app.
+
+    Sessions are opened lazily (connect, STARTTLS and login happen once per
+    session), checked with a NOOP when they stayed idle longer than
+    `idle_timeout`, reconnected when the server dropped them and retired after
+    `max_messages` messages.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        username: str = "",
+        password: str = "",
+        starttls: bool = True,
+        size: int = 4,
+        max_messages: int = 100,
+        idle_timeout: float = 30.0,
+        timeout: float = 10.0,
+    ):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.size = size
+        self.max_messages = max_messages
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+
+        self._idle = deque()
+        self._in_use = 0
+        self._lock = threading.Condition()
+        self._closed = False
+        self._counters = {
+            "connections_opened": 0,
+            "connections_closed": 0,
+            "connections_retired": 0,
+            "reconnects": 0,
+            "messages_sent": 0,
+            "messages_failed": 0,
+        }
+
+    def _connect(self) -> SMTPSession:
+        with track_stage("smtp", "connect"):
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                with track_stage("smtp", "starttls"):
+                    smtp.starttls()
+            if self.username:
+                with track_stage("smtp", "login"):
+                    smtp.login(self.username, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        with self._lock:
+            self._counters["connections_opened"] += 1
+        return SMTPSession(smtp)
+
+    def _disconnect(self, session: SMTPSession):
+        with self._lock:
+            self._counters["connections_closed"] += 1
+        try:
+            session.smtp.quit()
+        except OSError:
+            session.smtp.close()
+
+    def _is_alive(self, session: SMTPSession) -> bool:
+        if time.monotonic() - session.last_used < self.idle_timeout:
+            return True
+        try:
+            with track_stage("smtp", "noop"):
+                return session.smtp.noop()[0] == 250
+        except OSError:
+            return False
+
+    def acquire(self) -> SMTPSession:
+        deadline = time.monotonic() + self.timeout
+        with track_stage("smtp", "acquire"), self._lock:
+            while self._in_use >= self.size:
+                remaining = deadline - time.monotonic()
+                if self._closed or remaining <= 0:
+                    raise SMTPPoolTimeoutError("No SMTP session available")
+                self._lock.wait(remaining)
+            self._in_use += 1
+            session = self._idle.pop() if self._idle else None
+
+        try:
+            if session is not None and not self._is_alive(session):
+                self._disconnect(session)
+                session = None
+            return session or self._connect()
+        except Exception:
+            self._give_back(None)
+            raise
+
+    def _give_back(self, session):
+        with self._lock:
+            self._in_use -= 1
+            if session is not None and not self._closed:
+                self._idle.append(session)
+                session = None
+            self._lock.notify()
+        if session is not None:
+            self._disconnect(session)
+
+    def release(self, session: SMTPSession, broken: bool = False):
+        if broken:
+            self._disconnect(session)
+            self._give_back(None)
+            return
+        session.last_used = time.monotonic()
+        if session.messages_sent >= self.max_messages:
+            with self._lock:
+                self._counters["connections_retired"] += 1
+            self._disconnect(session)
+            self._give_back(None)
+            return
+        self._give_back(session)
+
+    def _sendmail(self, session, from_address, to_address, message) -> SMTPSession:
+        try:
+            with track_stage("smtp", "sendmail"):
+                session.smtp.sendmail(from_address, to_address, message)
+        except smtplib.SMTPServerDisconnected:
+            # The server closed an idle session, retry once on a new one.
+            session.smtp.close()
+            with self._lock:
+                self._counters["reconnects"] += 1
+            session = self._connect()
+            with track_stage("smtp", "sendmail"):
+                session.smtp.sendmail(from_address, to_address, message)
+        session.messages_sent += 1
+        return session
+
+    def send_many(self, from_address: str, messages: list) -> list:
+        """
+        Send `(to_address, message)` pairs over a single session.
+
+        Returns one entry per message: `None` when it was sent, otherwise the
+        exception raised while sending it. A failure doesn't stop the batch,
+        but when no session can be opened (the server is down, the login is
+        refused or the pool is exhausted) the remaining messages all fail with
+        that error.
+        """
+        try:
+            session = self.acquire()
+        except Exception as e:
+            return self._fail(messages, e)
+        errors = []
+        try:
+            for to_address, message in messages:
+                if session is None or session.messages_sent >= self.max_messages:
+                    if session is not None:
+                        with self._lock:
+                            self._counters["connections_retired"] += 1
+                        self._disconnect(session)
+                        session = None
+                    try:
+                        session = self._connect()
+                    except Exception as e:
+                        errors.extend(self._fail(messages[len(errors) :], e))
+                        break
+                try:
+                    session = self._sendmail(session, from_address, to_address, message)
+                except Exception as e:
+                    errors.append(e)
+                    with self._lock:
+                        self._counters["messages_failed"] += 1
+                    # The session stays usable when the server only rejected the message.
+                    rejected = isinstance(
+                        e,
+                        (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused),
+                    )
+                    if session is not None and (
+                        not rejected or session.smtp.sock is None
+                    ):
+                        self._disconnect(session)
+                        session = None
+                    continue
+                errors.append(None)
+                with self._lock:
+                    self._counters["messages_sent"] += 1
+        finally:
+            if session is None:
+                self._give_back(None)
+            else:
+                self.release(session)
+        return errors
+
+    def _fail(self, messages: list, error: Exception) -> list:
+        with self._lock:
+            self._counters["messages_failed"] += len(messages)
+        return [error] * len(messages)
+
+    def send(self, from_address: str, to_address: str, message: str):
+        error = self.send_many(from_address, [(to_address, message)])[0]
+        if error is not None:
+            raise error
+
+    def open(self):
+        with self._lock:
+            self._closed = False
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, deque()
+            self._lock.notify_all()
+        for session in idle:
+            self._disconnect(session)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": self.size,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                **self._counters,
+            }
+
+
+smtp_pool = SMTPConnectionPool(
+    host=smtp_settings.SMTP_SERVER,
+    port=smtp_settings.SMTP_PORT,
+    username=smtp_settings.SMTP_USERNAME,
+    password=smtp_settings.SMTP_PASSWORD,
+    starttls=smtp_settings.SMTP_STARTTLS,
+    size=smtp_settings.SMTP_POOL_SIZE,
+    max_messages=smtp_settings.SMTP_POOL_MAX_MESSAGES,
+    idle_timeout=smtp_settings.SMTP_POOL_IDLE_TIMEOUT,
+    timeout=smtp_settings.SMTP_TIMEOUT,
+)
@@ -2,12 +2,17 @@ import logging
 
 from fastapi import FastAPI
 
+from .config import smtp_settings
+from .emails.delivery import delivery_queue
+from .emails.smtp_pool import smtp_pool
+from .metrics import mark_process_dead, track_requests
 from .router import router
 
 
 def create_application() -> FastAPI:
     application = FastAPI(openapi_url="/email/openapi.json", docs_url="/emails/docs")
     application.include_router(router, prefix="/api/v1", tags=["emails"])
+    application.middleware("http")(track_requests)
     return application
 
 
@@ -18,8 +23,14 @@ log = logging.getLogger("uvicorn")
 @app.on_event("startup")
 async def startup_event():
     log.info("Starting up...")
+    if smtp_settings.USE_SMTP:
+        smtp_pool.open()
+    delivery_queue.start()
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     log.info("Shutting down...")
+    await delivery_queue.stop()
+    smtp_pool.close()
+    mark_process_dead()
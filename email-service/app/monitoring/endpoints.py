@@ -0,0 +1,42 @@
+from fastapi import APIRouter, Response
+
+from ..emails.delivery import delivery_queue
+from ..emails.smtp_pool import smtp_pool
+from ..metrics import render_metrics
+
+router = APIRouter(prefix="")
+
+
+@router.get(
+    "/stats",
+    summary="Service statistics",
+    description="Returns runtime statistics of the service resources.",
+)
+def get_stats() -> dict:
+    """
+    Endpoint to inspect the runtime statistics of the service.
+
+    **Returns**:
+    - The SMTP connection pool statistics (idle and in use sessions, reconnects, sent and failed messages).
+    - The delivery queue statistics (depth, busy workers, sent, retried, failed and rejected messages).
+    """
+    return {"smtp_pool": smtp_pool.stats(), "delivery_queue": delivery_queue.stats()}
+
+
+@router.get(
+    "/metrics",
+    summary="Prometheus metrics",
+    description="Returns the service metrics in the Prometheus text format.",
+)
+def get_metrics() -> Response:
+    """
+    Endpoint scraped by Prometheus.
+
+    **Returns**:
+    - The HTTP requests duration histograms per endpoint and status, request
+      validation included.
+    - The duration histograms and failure counters of each stage of the deliveries
+      (session checkout, SMTP connect, STARTTLS, login, send...).
+    """
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
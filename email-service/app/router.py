@@ -1,7 +1,9 @@
 from fastapi import APIRouter
 
 from .emails.endpoints import router as emails_router
+from .monitoring.endpoints import router as monitoring_router
 
 router = APIRouter()
 
 router.include_router(emails_router, prefix="/emails", tags=["emails"])
+router.include_router(monitoring_router, prefix="/monitoring", tags=["monitoring"])
@@ -0,0 +1,50 @@
+import socket
+
+import pytest
+from aiosmtpd.controller import Controller
+from app.config import email_server, smtp_settings
+from app.emails.smtp_pool import smtp_pool
+from app.main import app
+from fastapi.testclient import TestClient
+
+
+class RecordingHandler:
+    def __init__(self):
+        self.messages = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith("rejected"):
+            return "550 Mailbox unavailable"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return "250 Message accepted for delivery"
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_server():
+    handler = RecordingHandler()
+    controller = Controller(handler, hostname="127.0.0.1", port=get_free_port())
+    controller.start()
+    yield controller, handler
+    controller.stop()
+
+
+@pytest.fixture
+def client(smtp_server, monkeypatch):
+    controller, _ = smtp_server
+    monkeypatch.setattr(smtp_settings, "USE_SMTP", True)
+    monkeypatch.setattr(smtp_pool, "host", controller.hostname)
+    monkeypatch.setattr(smtp_pool, "port", controller.port)
+    monkeypatch.setattr(smtp_pool, "starttls", False)
+    monkeypatch.setattr(smtp_pool, "username", "")
+    with TestClient(app, headers={"x-api-key": email_server.api_key}) as client:
+        yield client
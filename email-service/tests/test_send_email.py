@@ -0,0 +1,143 @@
+import time
+
+from app.emails.delivery import delivery_queue
+from app.emails.smtp_pool import smtp_pool
+
+from .conftest import get_free_port
+
+
+def test_send_email(client, smtp_server):
+    _, handler = smtp_server
+    response = client.post(
+        "api/v1/emails/send", json={"email": "test@gmail.com", "code": "1234"}
+    )
+    assert response.status_code == 200
+    assert response.json()["message"] == "Email sent successfully"
+    assert handler.messages[0].rcpt_tos == ["test@gmail.com"]
+
+
+def test_send_email_with_an_invalid_api_key(client):
+    response = client.post(
+        "api/v1/emails/send",
+        json={"email": "test@gmail.com", "code": "1234"},
+        headers={"x-api-key": "invalid"},
+    )
+    assert response.status_code == 403
+
+
+def test_send_email_batch(client, smtp_server):
+    _, handler = smtp_server
+    items = [{"email": f"test{i}@gmail.com", "code": "1234"} for i in range(3)]
+    response = client.post("api/v1/emails/send-batch", json={"items": items})
+    response_data = response.json()
+    assert response.status_code == 200
+    assert response_data["sent"] == 3
+    assert response_data["failed"] == 0
+    assert [result["status"] for result in response_data["results"]] == ["sent"] * 3
+    assert len(handler.messages) == 3
+
+
+def test_send_email_batch_with_partial_failures(client, smtp_server):
+    _, handler = smtp_server
+    items = [
+        {"email": "test1@gmail.com", "code": "1234"},
+        {"email": "rejected@gmail.com", "code": "1234"},
+        {"email": "test2@gmail.com", "code": "1234"},
+    ]
+    response = client.post("api/v1/emails/send-batch", json={"items": items})
+    response_data = response.json()
+    assert response.status_code == 200
+    assert response_data["sent"] == 2
+    assert response_data["failed"] == 1
+    assert response_data["results"][1]["status"] == "failed"
+    assert response_data["results"][1]["detail"].startswith("Failed to send email")
+    assert len(handler.messages) == 2
+
+
+def test_send_email_batch_when_the_smtp_server_is_down(client, monkeypatch):
+    monkeypatch.setattr(smtp_pool, "port", get_free_port())
+    items = [{"email": f"test{i}@gmail.com", "code": "1234"} for i in range(3)]
+    response = client.post("api/v1/emails/send-batch", json={"items": items})
+    response_data = response.json()
+    assert response.status_code == 200
+    assert response_data["sent"] == 0
+    assert response_data["failed"] == 3
+    assert [result["status"] for result in response_data["results"]] == ["failed"] * 3
+    assert smtp_pool.stats()["in_use"] == 0
+
+
+def test_send_email_batch_with_an_invalid_code(client):
+    items = [{"email": "test@gmail.com", "code": "12345"}]
+    response = client.post("api/v1/emails/send-batch", json={"items": items})
+    assert response.status_code == 422
+
+
+def wait_for_delivery(client, message_id):
+    for _ in range(100):
+        response = client.get(f"api/v1/emails/messages/{message_id}")
+        if response.json()["status"] in ("sent", "failed"):
+            return response.json()
+        time.sleep(0.01)
+    raise AssertionError("The message wasn't delivered in time")
+
+
+def test_queue_email(client, smtp_server):
+    _, handler = smtp_server
+    response = client.post(
+        "api/v1/emails/queue", json={"email": "test@gmail.com", "code": "1234"}
+    )
+    response_data = response.json()
+    assert response.status_code == 202
+    assert response_data["status"] == "queued"
+
+    message_status = wait_for_delivery(client, response_data["message_id"])
+    assert message_status["status"] == "sent"
+    assert message_status["attempts"] == 1
+    assert handler.messages[0].rcpt_tos == ["test@gmail.com"]
+
+
+def test_queue_email_retries_then_fails(client, monkeypatch):
+    monkeypatch.setattr(delivery_queue, "max_attempts", 2)
+    monkeypatch.setattr(delivery_queue, "backoff_base", 0)
+    response = client.post(
+        "api/v1/emails/queue", json={"email": "rejected@gmail.com", "code": "1234"}
+    )
+    message_status = wait_for_delivery(client, response.json()["message_id"])
+    assert message_status["status"] == "failed"
+    assert message_status["attempts"] == 2
+    assert message_status["detail"].startswith("Failed to send email")
+    assert delivery_queue.stats()["retried"] >= 1
+
+
+def test_queue_email_when_the_queue_is_full(client, monkeypatch):
+    monkeypatch.setattr(delivery_queue._queue, "full", lambda: True)
+    response = client.post(
+        "api/v1/emails/queue", json={"email": "test@gmail.com", "code": "1234"}
+    )
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+
+def test_get_unknown_email_status(client):
+    response = client.get("api/v1/emails/messages/unknown")
+    assert response.status_code == 404
+
+
+def test_metrics_record_the_stages_of_send_email(client):
+    response = client.post(
+        "api/v1/emails/send", json={"email": "test@gmail.com", "code": "1234"}
+    )
+    assert response.status_code == 200
+
+    response = client.get("api/v1/monitoring/metrics")
+    assert response.status_code == 200
+    metrics = response.text
+    for stage in ("connect", "sendmail"):
+        assert (
+            f'email_service_stage_duration_seconds_count{{operation="smtp",stage="{stage}"}}'
+            in metrics
+        )
+    assert (
+        'email_service_http_request_duration_seconds_count{handler="send_email",method="POST",status="200"}'
+        in metrics
+    )
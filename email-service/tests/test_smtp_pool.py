@@ -0,0 +1,86 @@
+import socket
+
+import pytest
+from app.emails.smtp_pool import SMTPConnectionPool, SMTPPoolTimeoutError
+
+
+def create_pool(controller, **kwargs):
+    return SMTPConnectionPool(
+        host=controller.hostname, port=controller.port, starttls=False, **kwargs
+    )
+
+
+def test_pool_reuses_sessions(smtp_server):
+    controller, handler = smtp_server
+    pool = create_pool(controller, size=2)
+    for i in range(5):
+        pool.send(
+            "hello@dailymotion.com", f"user{i}@gmail.com", "Subject: test\n\nbody"
+        )
+    stats = pool.stats()
+    pool.close()
+
+    assert len(handler.messages) == 5
+    assert stats["messages_sent"] == 5
+    assert stats["connections_opened"] == 1
+    assert stats["idle"] == 1
+
+
+def test_pool_retires_sessions_after_max_messages(smtp_server):
+    controller, handler = smtp_server
+    pool = create_pool(controller, max_messages=2)
+    for i in range(5):
+        pool.send(
+            "hello@dailymotion.com", f"user{i}@gmail.com", "Subject: test\n\nbody"
+        )
+    stats = pool.stats()
+    pool.close()
+
+    assert len(handler.messages) == 5
+    assert stats["connections_opened"] == 3
+    assert stats["connections_retired"] == 2
+
+
+def test_pool_reconnects_dropped_sessions(smtp_server):
+    controller, handler = smtp_server
+    pool = create_pool(controller)
+    pool.send("hello@dailymotion.com", "user@gmail.com", "Subject: test\n\nbody")
+    # Simulate the server dropping the idle session.
+    session = pool.acquire()
+    session.smtp.sock.shutdown(socket.SHUT_RDWR)
+    pool.release(session)
+
+    pool.send("hello@dailymotion.com", "user@gmail.com", "Subject: test\n\nbody")
+    stats = pool.stats()
+    pool.close()
+
+    assert len(handler.messages) == 2
+    assert stats["reconnects"] == 1
+    assert stats["connections_opened"] == 2
+
+
+def test_pool_checks_idle_sessions(smtp_server):
+    controller, handler = smtp_server
+    pool = create_pool(controller, idle_timeout=0)
+    pool.send("hello@dailymotion.com", "user@gmail.com", "Subject: test\n\nbody")
+    session = pool.acquire()
+    session.smtp.sock.shutdown(socket.SHUT_RDWR)
+    pool.release(session)
+
+    pool.send("hello@dailymotion.com", "user@gmail.com", "Subject: test\n\nbody")
+    stats = pool.stats()
+    pool.close()
+
+    assert len(handler.messages) == 2
+    assert stats["reconnects"] == 0
+    assert stats["connections_opened"] == 2
+
+
+def test_pool_times_out_when_exhausted(smtp_server):
+    controller, _ = smtp_server
+    pool = create_pool(controller, size=1, timeout=0.1)
+    session = pool.acquire()
+    with pytest.raises(SMTPPoolTimeoutError):
+        pool.acquire()
+    pool.release(session)
+    pool.close()
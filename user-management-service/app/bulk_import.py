@@ -0,0 +1,321 @@
+"""
+Bulk import of users from a CSV or NDJSON file.
+
+Each record has an `email`, either a plain `password` (hashed on a pool of
+worker processes) or a bcrypt `password_hash`, and an optional `is_active`
+flag. Records are loaded in chunks: every chunk is streamed with `COPY` into a
+temporary staging table, then moved to `users` with `ON CONFLICT DO NOTHING`
+in a single transaction. Unactivated users can optionally get an activation
+code and an email outbox entry, like `POST /register` does.
+
+Emails already registered, duplicated in the file or invalid records are
+written to the `--conflicts` CSV report. The number of the last committed
+record is saved to the `--checkpoint` file so an interrupted import resumes
+where it stopped.
+
+Usage:
+    python -m app.bulk_import users.csv --checkpoint users.checkpoint --conflicts conflicts.csv
+"""
+
+import argparse
+import csv
+import functools
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from itertools import islice
+from pathlib import Path
+from typing import Iterator, Optional
+
+import psycopg
+from pydantic import ValidationError
+
+from .config import password_hashing_settings
+from .users.activation_codes import activation_code_store
+from .users.repository import ACTIVATION_CODE_TTL
+from .users.schemas import ImportedUserModel
+from .users.utils import calibrate_rounds, generate_code, hash_password
+
+log = logging.getLogger("uvicorn")
+
+
+def read_records(path: Path, file_format: Optional[str] = None) -> Iterator:
+    """
+    Yield `(record_number, fields)` pairs, record numbers start at 1.
+    """
+    file_format = file_format or (
+        "ndjson" if path.suffix in (".ndjson", ".jsonl") else "csv"
+    )
+    with path.open(newline="") as file:
+        if file_format == "csv":
+            rows = csv.DictReader(file)
+        else:
+            rows = (json.loads(line) for line in file if line.strip())
+        for number, row in enumerate(rows, start=1):
+            # Empty CSV cells are missing values.
+            yield number, {key: value for key, value in row.items() if value != ""}
+
+
+def prepare_records(records: list, rounds: int) -> tuple:
+    """
+    Validate `(record_number, fields)` pairs and hash their plain passwords
+    with a bcrypt cost of `rounds`.
+
+    Returns the `(record, email, password_hash, is_active)` rows to load and
+    the `(record, email, error)` of the invalid records.
+    """
+    rows, invalid = [], []
+    for number, fields in records:
+        try:
+            user = ImportedUserModel(**fields)
+            if (user.password is None) == (user.password_hash is None):
+                raise ValueError("Exactly one of password or password_hash is required")
+        except (ValidationError, ValueError) as e:
+            invalid.append((number, fields.get("email", ""), str(e).replace("\n", " ")))
+            continue
+        password_hash = user.password_hash or hash_password(user.password, rounds)
+        rows.append((number, user.email, password_hash, user.is_active))
+    return rows, invalid
+
+
+class BulkImporter:
+    """
+    Loads users chunk by chunk, the records of a chunk are validated and their
+    plain passwords hashed on `workers` processes (in the main process when 0)
+    before it is copied.
+
+    Passwords are hashed with the bcrypt cost of the app: `rounds`, or when 0
+    the cost calibrated within the `PASSWORD_HASHING_*` bounds.
+    """
+
+    def __init__(
+        self,
+        database_url: str,
+        chunk_size: int = 5000,
+        workers: int = 0,
+        rounds: int = password_hashing_settings.PASSWORD_HASHING_ROUNDS,
+        activation_codes: bool = False,
+        activation_code_ttl: timedelta = ACTIVATION_CODE_TTL,
+        checkpoint_path: Optional[Path] = None,
+        conflicts_path: Optional[Path] = None,
+    ):
+        self.database_url = database_url
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.rounds = rounds
+        self.activation_codes = activation_codes
+        self.activation_code_ttl = activation_code_ttl
+        self.checkpoint_path = checkpoint_path
+        self.conflicts_path = conflicts_path
+        self.summary = {"records": 0, "imported": 0, "conflicts": 0, "invalid": 0}
+
+    def load_checkpoint(self) -> int:
+        if self.checkpoint_path is None or not self.checkpoint_path.exists():
+            return 0
+        return json.loads(self.checkpoint_path.read_text())["record"]
+
+    def save_checkpoint(self, record: int):
+        if self.checkpoint_path is None:
+            return
+        temporary_path = self.checkpoint_path.with_suffix(".tmp")
+        temporary_path.write_text(json.dumps({"record": record}))
+        os.replace(temporary_path, self.checkpoint_path)
+
+    def prepare(self, chunk: list, executor) -> tuple:
+        if executor is None:
+            return prepare_records(chunk, self.rounds)
+        size = max(1, -(-len(chunk) // (self.workers * 4)))
+        rows, invalid = [], []
+        for prepared in executor.map(
+            functools.partial(prepare_records, rounds=self.rounds),
+            (chunk[i : i + size] for i in range(0, len(chunk), size)),
+        ):
+            rows.extend(prepared[0])
+            invalid.extend(prepared[1])
+        return rows, invalid
+
+    def load_chunk(self, connection, rows: list) -> list:
+        """
+        Load one chunk of `(record, email, password_hash, is_active)` rows and
+        return the `(record, email)` of the rows that were not imported.
+        """
+        with connection.transaction():
+            with connection.cursor() as cursor:
+                with cursor.copy(
+                    "COPY import_users (record, email, password_hash, is_active, code) FROM STDIN"
+                ) as copy:
+                    for row in rows:
+                        copy.write_row((*row, generate_code()))
+                cursor.execute(
+                    """
+                    WITH first_records AS (
+                        SELECT DISTINCT ON (email) * FROM import_users
+                        ORDER BY email, record
+                    ), inserted AS (
+                        INSERT INTO users (email, password_hash, is_active)
+                        SELECT email, password_hash, is_active FROM first_records
+                        ORDER BY record
+                        ON CONFLICT (email) DO NOTHING
+                        RETURNING id, email
+                    ), imported AS (
+                        SELECT inserted.id, first_records.*
+                        FROM inserted JOIN first_records USING (email)
+                    ), activation_code AS (
+                        INSERT INTO activation_codes (user_id, code, expires_at)
+                        SELECT id, code, now() + %(ttl)s FROM imported
+                        WHERE %(activation_codes)s AND NOT is_active
+                    ), outbox AS (
+                        INSERT INTO email_outbox (email, code)
+                        SELECT email, code FROM imported
+                        WHERE %(activation_codes)s AND NOT is_active
+                    )
+                    SELECT record, email FROM import_users
+                    WHERE record NOT IN (SELECT record FROM imported)
+                    ORDER BY record;
+                    """,
+                    {
+                        "ttl": self.activation_code_ttl,
+                        "activation_codes": self.activation_codes,
+                    },
+                )
+                return cursor.fetchall()
+
+    def calibrate(self):
+        self.rounds, hash_seconds = calibrate_rounds(
+            password_hashing_settings.PASSWORD_HASHING_TARGET_SECONDS,
+            password_hashing_settings.PASSWORD_HASHING_MIN_ROUNDS,
+            password_hashing_settings.PASSWORD_HASHING_MAX_ROUNDS,
+        )
+        log.info(
+            "Calibrated the bcrypt cost to %d rounds (%.3fs per hash)",
+            self.rounds,
+            hash_seconds[self.rounds],
+        )
+
+    def run(self, records: Iterator) -> dict:
+        started = time.perf_counter()
+        if not self.rounds:
+            self.calibrate()
+        resume_after = self.load_checkpoint()
+        executor = None
+        if self.workers:
+            executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        conflicts_file = (
+            open(self.conflicts_path, "a", newline="")
+            if self.conflicts_path is not None
+            else open(os.devnull, "w")
+        )
+        report = csv.writer(conflicts_file)
+        try:
+            with psycopg.connect(self.database_url) as connection:
+                connection.execute(
+                    """
+                    CREATE TEMPORARY TABLE import_users (
+                        record BIGINT NOT NULL,
+                        email VARCHAR(255) NOT NULL,
+                        password_hash VARCHAR(255) NOT NULL,
+                        is_active BOOLEAN NOT NULL,
+                        code VARCHAR(4) NOT NULL
+                    ) ON COMMIT DELETE ROWS;
+                    """
+                )
+                connection.commit()
+                records = (record for record in records if record[0] > resume_after)
+                while chunk := list(islice(records, self.chunk_size)):
+                    self.summary["records"] += len(chunk)
+                    rows, invalid = self.prepare(chunk, executor)
+                    for number, email, error in invalid:
+                        report.writerow([number, email, "invalid", error])
+                    self.summary["invalid"] += len(invalid)
+                    conflicts = self.load_chunk(connection, rows) if rows else []
+                    for number, email in conflicts:
+                        report.writerow(
+                            [number, email, "conflict", "Email already registered"]
+                        )
+                    self.summary["conflicts"] += len(conflicts)
+                    self.summary["imported"] += len(rows) - len(conflicts)
+                    conflicts_file.flush()
+                    self.save_checkpoint(chunk[-1][0])
+                    log.info("Imported up to record %d", chunk[-1][0])
+        finally:
+            conflicts_file.close()
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+        elapsed = time.perf_counter() - started
+        self.summary["elapsed_seconds"] = round(elapsed, 3)
+        self.summary["records_per_second"] = round(self.summary["records"] / elapsed, 1)
+        return self.summary
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("source", type=Path)
+    parser.add_argument("--format", choices=["csv", "ndjson"], default=None)
+    parser.add_argument("--dsn", default=None, help="Defaults to the app database.")
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Password hashing processes, 0 hashes in the main process.",
+    )
+    parser.add_argument(
+        "--rounds",
+        type=int,
+        default=password_hashing_settings.PASSWORD_HASHING_ROUNDS,
+        help="bcrypt cost of the plain passwords, 0 calibrates it like the app.",
+    )
+    parser.add_argument(
+        "--activation-codes",
+        action="store_true",
+        help="Create an activation code and send it to the unactivated users.",
+    )
+    parser.add_argument(
+        "--activation-code-ttl",
+        type=float,
+        default=ACTIVATION_CODE_TTL.total_seconds(),
+        help="Activation codes lifetime in seconds.",
+    )
+    parser.add_argument("--checkpoint", type=Path, default=None)
+    parser.add_argument("--conflicts", type=Path, default=None)
+    args = parser.parse_args()
+    if args.activation_codes and activation_code_store.backend != "postgres":
+        parser.error(
+            "--activation-codes needs the codes to be stored in Postgres "
+            "(ACTIVATION_CODE_STORE=postgres)"
+        )
+    if args.dsn is None:
+        from .postgres import postgres
+
+        if postgres.ring is not None:
+            parser.error(
+                "The users are sharded, import them in one shard with --dsn "
+                "and move them to their shard with python -m app.reshard"
+            )
+        args.dsn = postgres.database_url
+
+    logging.basicConfig(level=logging.INFO)
+    importer = BulkImporter(
+        args.dsn,
+        chunk_size=args.chunk_size,
+        workers=args.workers,
+        rounds=args.rounds,
+        activation_codes=args.activation_codes,
+        activation_code_ttl=timedelta(seconds=args.activation_code_ttl),
+        checkpoint_path=args.checkpoint,
+        conflicts_path=args.conflicts,
+    )
+    print(json.dumps(importer.run(read_records(args.source, args.format))))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,5 @@
+import os
+
 from pydantic import Field
 from pydantic_settings import BaseSettings
 
@@ -6,13 +8,199 @@ class PostgresSettings(BaseSettings):
     POSTGRES_USER: str = Field(env="POSTGRES_USER")
     POSTGRES_PASSWORD: str = Field(env="POSTGRES_PASSWORD")
     POSTGRES_DB: str = Field(env="POSTGRES_DB")
+    POSTGRES_HOST: str = Field(env="POSTGRES_HOST", default="postgres-db")
     POSTGRES_PORT: str = Field(env="POSTGRES_PORT", default="5432")
+    POSTGRES_POOL_MIN_SIZE: int = Field(env="POSTGRES_POOL_MIN_SIZE", default=1)
+    POSTGRES_POOL_MAX_SIZE: int = Field(env="POSTGRES_POOL_MAX_SIZE", default=10)
+    POSTGRES_POOL_TIMEOUT: float = Field(env="POSTGRES_POOL_TIMEOUT", default=5.0)
+    POSTGRES_POOL_MAX_LIFETIME: float = Field(
+        env="POSTGRES_POOL_MAX_LIFETIME", default=1800.0
+    )
+    POSTGRES_POOL_MAX_IDLE: float = Field(env="POSTGRES_POOL_MAX_IDLE", default=600.0)
+    # Disable behind poolers that don't support protocol level prepared statements.
+    POSTGRES_PREPARED_STATEMENTS: bool = Field(
+        env="POSTGRES_PREPARED_STATEMENTS", default=True
+    )
+    # Comma separated `name=url` shards, the users aren't sharded when empty.
+    POSTGRES_SHARDS: str = Field(env="POSTGRES_SHARDS", default="")
+    POSTGRES_SHARD_VNODES: int = Field(env="POSTGRES_SHARD_VNODES", default=128)
+    # Comma separated URLs of the read replicas, reads go to the primary when empty.
+    POSTGRES_REPLICA_URLS: str = Field(env="POSTGRES_REPLICA_URLS", default="")
+    POSTGRES_REPLICA_MAX_LAG: float = Field(env="POSTGRES_REPLICA_MAX_LAG", default=1.0)
+    POSTGRES_REPLICA_CHECK_INTERVAL: float = Field(
+        env="POSTGRES_REPLICA_CHECK_INTERVAL", default=2.0
+    )
+    POSTGRES_REPLICA_POOL_TIMEOUT: float = Field(
+        env="POSTGRES_REPLICA_POOL_TIMEOUT", default=0.5
+    )
 
 
 class EmailServiceSettings(BaseSettings):
     API_KEY: str = Field(env="API_KEY")
     EMAIL_SERVICE_URL: str = Field(env="EMAIL_SERVICE_URL")
+    EMAIL_SERVICE_MAX_CONNECTIONS: int = Field(
+        env="EMAIL_SERVICE_MAX_CONNECTIONS", default=20
+    )
+    EMAIL_SERVICE_MAX_KEEPALIVE_CONNECTIONS: int = Field(
+        env="EMAIL_SERVICE_MAX_KEEPALIVE_CONNECTIONS", default=10
+    )
+    EMAIL_SERVICE_KEEPALIVE_EXPIRY: float = Field(
+        env="EMAIL_SERVICE_KEEPALIVE_EXPIRY", default=30.0
+    )
+    EMAIL_SERVICE_CONNECT_TIMEOUT: float = Field(
+        env="EMAIL_SERVICE_CONNECT_TIMEOUT", default=2.0
+    )
+    EMAIL_SERVICE_READ_TIMEOUT: float = Field(
+        env="EMAIL_SERVICE_READ_TIMEOUT", default=5.0
+    )
+    EMAIL_SERVICE_MAX_RETRIES: int = Field(env="EMAIL_SERVICE_MAX_RETRIES", default=2)
+    EMAIL_SERVICE_RETRY_BACKOFF: float = Field(
+        env="EMAIL_SERVICE_RETRY_BACKOFF", default=0.2
+    )
+    EMAIL_SERVICE_BREAKER_FAILURE_THRESHOLD: int = Field(
+        env="EMAIL_SERVICE_BREAKER_FAILURE_THRESHOLD", default=5
+    )
+    EMAIL_SERVICE_BREAKER_RESET_TIMEOUT: float = Field(
+        env="EMAIL_SERVICE_BREAKER_RESET_TIMEOUT", default=30.0
+    )
+
+
+class PasswordHashingSettings(BaseSettings):
+    PASSWORD_HASHING_WORKERS: int = Field(
+        env="PASSWORD_HASHING_WORKERS", default=os.cpu_count() or 1
+    )
+    PASSWORD_HASHING_QUEUE_SIZE: int = Field(
+        env="PASSWORD_HASHING_QUEUE_SIZE", default=64
+    )
+    # Fixed bcrypt cost, 0 calibrates it at startup within the bounds below.
+    PASSWORD_HASHING_ROUNDS: int = Field(env="PASSWORD_HASHING_ROUNDS", default=0)
+    PASSWORD_HASHING_TARGET_SECONDS: float = Field(
+        env="PASSWORD_HASHING_TARGET_SECONDS", default=0.25
+    )
+    PASSWORD_HASHING_MIN_ROUNDS: int = Field(
+        env="PASSWORD_HASHING_MIN_ROUNDS", default=10
+    )
+    PASSWORD_HASHING_MAX_ROUNDS: int = Field(
+        env="PASSWORD_HASHING_MAX_ROUNDS", default=14
+    )
+
+
+class OutboxSettings(BaseSettings):
+    OUTBOX_DISPATCHER_ENABLED: bool = Field(
+        env="OUTBOX_DISPATCHER_ENABLED", default=True
+    )
+    OUTBOX_BATCH_SIZE: int = Field(env="OUTBOX_BATCH_SIZE", default=100)
+    OUTBOX_POLL_INTERVAL: float = Field(env="OUTBOX_POLL_INTERVAL", default=1.0)
+    OUTBOX_MAX_ATTEMPTS: int = Field(env="OUTBOX_MAX_ATTEMPTS", default=8)
+    OUTBOX_BACKOFF_BASE: float = Field(env="OUTBOX_BACKOFF_BASE", default=2.0)
+    OUTBOX_BACKOFF_MAX: float = Field(env="OUTBOX_BACKOFF_MAX", default=300.0)
+    # Seconds a claimed batch is hidden from the other dispatchers, it must
+    # outlast the email service requests with their retries.
+    OUTBOX_LEASE: float = Field(env="OUTBOX_LEASE", default=60.0)
+
+
+class SweeperSettings(BaseSettings):
+    SWEEPER_ENABLED: bool = Field(env="SWEEPER_ENABLED", default=True)
+    SWEEPER_INTERVAL: float = Field(env="SWEEPER_INTERVAL", default=60.0)
+    SWEEPER_BATCH_SIZE: int = Field(env="SWEEPER_BATCH_SIZE", default=1000)
+    # Expired codes are kept a while so late activations are reported as expired.
+    SWEEPER_EXPIRED_CODE_GRACE: float = Field(
+        env="SWEEPER_EXPIRED_CODE_GRACE", default=3600.0
+    )
+    SWEEPER_UNACTIVATED_USER_RETENTION: float = Field(
+        env="SWEEPER_UNACTIVATED_USER_RETENTION", default=7 * 24 * 3600.0
+    )
+    SWEEPER_SENT_EMAIL_RETENTION: float = Field(
+        env="SWEEPER_SENT_EMAIL_RETENTION", default=7 * 24 * 3600.0
+    )
+
+
+class EmailFilterSettings(BaseSettings):
+    EMAIL_FILTER_ENABLED: bool = Field(env="EMAIL_FILTER_ENABLED", default=False)
+    EMAIL_FILTER_CAPACITY: int = Field(env="EMAIL_FILTER_CAPACITY", default=1_000_000)
+    EMAIL_FILTER_FALSE_POSITIVE_RATE: float = Field(
+        env="EMAIL_FILTER_FALSE_POSITIVE_RATE", default=0.01
+    )
+    EMAIL_FILTER_SHARED_MEMORY_NAME: str = Field(
+        env="EMAIL_FILTER_SHARED_MEMORY_NAME", default="user-management-email-filter"
+    )
+
+
+class AdmissionSettings(BaseSettings):
+    ADMISSION_MAX_TRACKED_KEYS: int = Field(
+        env="ADMISSION_MAX_TRACKED_KEYS", default=100_000
+    )
+    ADMISSION_REGISTER_MAX_CONCURRENCY: int = Field(
+        env="ADMISSION_REGISTER_MAX_CONCURRENCY", default=64
+    )
+    ADMISSION_REGISTER_IP_RATE: float = Field(
+        env="ADMISSION_REGISTER_IP_RATE", default=5.0
+    )
+    ADMISSION_REGISTER_IP_BURST: int = Field(
+        env="ADMISSION_REGISTER_IP_BURST", default=20
+    )
+    ADMISSION_REGISTER_EMAIL_RATE: float = Field(
+        env="ADMISSION_REGISTER_EMAIL_RATE", default=0.1
+    )
+    ADMISSION_REGISTER_EMAIL_BURST: int = Field(
+        env="ADMISSION_REGISTER_EMAIL_BURST", default=3
+    )
+    ADMISSION_ACTIVATE_MAX_CONCURRENCY: int = Field(
+        env="ADMISSION_ACTIVATE_MAX_CONCURRENCY", default=64
+    )
+    ADMISSION_ACTIVATE_IP_RATE: float = Field(
+        env="ADMISSION_ACTIVATE_IP_RATE", default=5.0
+    )
+    ADMISSION_ACTIVATE_IP_BURST: int = Field(
+        env="ADMISSION_ACTIVATE_IP_BURST", default=20
+    )
+    # Also bounds how fast an activation code can be guessed.
+    ADMISSION_ACTIVATE_EMAIL_RATE: float = Field(
+        env="ADMISSION_ACTIVATE_EMAIL_RATE", default=0.1
+    )
+    ADMISSION_ACTIVATE_EMAIL_BURST: int = Field(
+        env="ADMISSION_ACTIVATE_EMAIL_BURST", default=5
+    )
+    ADMISSION_RESEND_MAX_CONCURRENCY: int = Field(
+        env="ADMISSION_RESEND_MAX_CONCURRENCY", default=64
+    )
+    ADMISSION_RESEND_IP_RATE: float = Field(env="ADMISSION_RESEND_IP_RATE", default=5.0)
+    ADMISSION_RESEND_IP_BURST: int = Field(env="ADMISSION_RESEND_IP_BURST", default=20)
+    ADMISSION_RESEND_EMAIL_RATE: float = Field(
+        env="ADMISSION_RESEND_EMAIL_RATE", default=0.1
+    )
+    ADMISSION_RESEND_EMAIL_BURST: int = Field(
+        env="ADMISSION_RESEND_EMAIL_BURST", default=5
+    )
+
+
+class IdempotencySettings(BaseSettings):
+    IDEMPOTENCY_KEY_TTL: float = Field(env="IDEMPOTENCY_KEY_TTL", default=86400.0)
+
+
+class ActivationCodeSettings(BaseSettings):
+    # "postgres", "memory" (single worker only) or "redis".
+    ACTIVATION_CODE_STORE: str = Field(env="ACTIVATION_CODE_STORE", default="postgres")
+    ACTIVATION_CODE_STORE_URL: str = Field(
+        env="ACTIVATION_CODE_STORE_URL", default="redis://localhost:6379/0"
+    )
+    ACTIVATION_CODE_TTL: float = Field(env="ACTIVATION_CODE_TTL", default=60.0)
+    # Seconds after the last activation email before another one can be sent.
+    ACTIVATION_CODE_RESEND_COOLDOWN: float = Field(
+        env="ACTIVATION_CODE_RESEND_COOLDOWN", default=30.0
+    )
+    # A code is sent again when it is still valid for at least these seconds.
+    ACTIVATION_CODE_REUSE_MIN_VALIDITY: float = Field(
+        env="ACTIVATION_CODE_REUSE_MIN_VALIDITY", default=20.0
+    )
 
 
 postgres_settings = PostgresSettings()
 email_service_settings = EmailServiceSettings()
+password_hashing_settings = PasswordHashingSettings()
+outbox_settings = OutboxSettings()
+sweeper_settings = SweeperSettings()
+email_filter_settings = EmailFilterSettings()
+admission_settings = AdmissionSettings()
+idempotency_settings = IdempotencySettings()
+activation_code_settings = ActivationCodeSettings()
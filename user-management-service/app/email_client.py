@@ -0,0 +1,218 @@
+import asyncio
+import time
+
+import httpx
+
+from .config import email_service_settings
+from .metrics import track_stage
+
+RETRYABLE_STATUS_CODES = {502, 503, 504}
+
+
+class EmailServiceError(Exception):
+    pass
+
+
+class EmailServiceUnavailableError(EmailServiceError):
+    pass
+
+
+class EmailServiceBusyError(EmailServiceUnavailableError):
+    """
+    No connection to the email service freed up in time. This is backpressure
+    from the client itself, it says nothing about the email service health.
+    """
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing dependency for `reset_timeout` seconds after
+    `failure_threshold` consecutive failures, then lets a single probe through
+    (half open) to decide whether to close the circuit again.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._counters = {"opened": 0, "rejected": 0}
+
+    def is_open(self) -> bool:
+        return (
+            self.state == "open"
+            and time.monotonic() - self._opened_at < self.reset_timeout
+        )
+
+    def allow(self) -> bool:
+        if self.state == "open":
+            if self.is_open():
+                self._counters["rejected"] += 1
+                return False
+            self.state = "half_open"
+        if self.state == "half_open":
+            if self._probing:
+                self._counters["rejected"] += 1
+                return False
+            self._probing = True
+        return True
+
+    def record_success(self):
+        self.state = "closed"
+        self._failures = 0
+        self._probing = False
+
+    def release_probe(self):
+        """
+        Let another probe through when this one ended without an outcome (e.g.
+        the request was cancelled), the circuit stays half open.
+        """
+        self._probing = False
+
+    def record_failure(self):
+        self._failures += 1
+        self._probing = False
+        if self.state == "half_open" or self._failures >= self.failure_threshold:
+            if self.state != "open":
+                self._counters["opened"] += 1
+            self.state = "open"
+            self._opened_at = time.monotonic()
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self._failures,
+            **self._counters,
+        }
+
+
+class EmailServiceClient:
+    """
+    Keep-alive HTTP client to the email service shared by the whole app.
+
+    Requests that never reached the email service (connection errors) or that
+    it refused to handle (502, 503, 504) are retried up to `max_retries`
+    times. Calls are short-circuited while the circuit breaker is open.
+
+    At most `max_connections` calls are in flight, the others wait for their
+    turn without a deadline rather than on the connection pool, whose wait is
+    bounded by the connect timeout. A pool wait that still times out is raised
+    as `EmailServiceBusyError` and isn't counted as a failure of the service.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        api_key: str,
+        max_connections: int,
+        max_keepalive_connections: int,
+        keepalive_expiry: float,
+        connect_timeout: float,
+        read_timeout: float,
+        max_retries: int,
+        retry_backoff: float,
+        breaker: CircuitBreaker,
+        transport=None,
+    ):
+        self.url = url
+        self.api_key = api_key
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(
+            read_timeout, connect=connect_timeout, pool=connect_timeout
+        )
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.breaker = breaker
+        self.transport = transport
+        self._client = None
+        self._slots = asyncio.Semaphore(max_connections)
+        self._counters = {"requests": 0, "retries": 0, "failures": 0, "busy": 0}
+
+    def start(self):
+        self._client = httpx.AsyncClient(
+            limits=self.limits,
+            timeout=self.timeout,
+            headers={"x-api-key": self.api_key},
+            transport=self.transport,
+        )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _post(self, payload: dict) -> httpx.Response:
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self._counters["retries"] += 1
+                await asyncio.sleep(self.retry_backoff * 2 ** (attempt - 1))
+            try:
+                with track_stage("email_service", "request"):
+                    response = await self._client.post(self.url, json=payload)
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                if attempt == self.max_retries:
+                    raise
+                continue
+            if (
+                response.status_code not in RETRYABLE_STATUS_CODES
+                or attempt == self.max_retries
+            ):
+                return response
+
+    async def send_activation_email(self, email: str, code: str):
+        if not self.breaker.allow():
+            raise EmailServiceUnavailableError("The email service circuit is open")
+        self._counters["requests"] += 1
+        try:
+            async with self._slots:
+                response = await self._post({"email": email, "code": code})
+        except httpx.PoolTimeout as e:
+            self._counters["busy"] += 1
+            raise EmailServiceBusyError(f"{type(e).__name__}: {e}")
+        except httpx.HTTPError as e:
+            self._counters["failures"] += 1
+            self.breaker.record_failure()
+            raise EmailServiceError(f"{type(e).__name__}: {e}")
+        finally:
+            # Cancellations and unexpected errors don't record an outcome.
+            self.breaker.release_probe()
+        if response.status_code >= 500:
+            self._counters["failures"] += 1
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        if response.status_code != 200:
+            raise EmailServiceError(
+                f"Email service responded with {response.status_code}"
+            )
+
+    def stats(self) -> dict:
+        return {
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            **self._counters,
+            "circuit_breaker": self.breaker.stats(),
+        }
+
+
+email_service_client = EmailServiceClient(
+    url=email_service_settings.EMAIL_SERVICE_URL,
+    api_key=email_service_settings.API_KEY,
+    max_connections=email_service_settings.EMAIL_SERVICE_MAX_CONNECTIONS,
+    max_keepalive_connections=email_service_settings.EMAIL_SERVICE_MAX_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry=email_service_settings.EMAIL_SERVICE_KEEPALIVE_EXPIRY,
+    connect_timeout=email_service_settings.EMAIL_SERVICE_CONNECT_TIMEOUT,
+    read_timeout=email_service_settings.EMAIL_SERVICE_READ_TIMEOUT,
+    max_retries=email_service_settings.EMAIL_SERVICE_MAX_RETRIES,
+    retry_backoff=email_service_settings.EMAIL_SERVICE_RETRY_BACKOFF,
+    breaker=CircuitBreaker(
+        failure_threshold=email_service_settings.EMAIL_SERVICE_BREAKER_FAILURE_THRESHOLD,
+        reset_timeout=email_service_settings.EMAIL_SERVICE_BREAKER_RESET_TIMEOUT,
+    ),
+)
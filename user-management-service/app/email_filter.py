@@ -0,0 +1,191 @@
+import fcntl
+import hashlib
+import logging
+import math
+import os
+import tempfile
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+
+from .config import email_filter_settings
+
+log = logging.getLogger("uvicorn")
+
+# The first byte of the segment tells whether the filter is fully built.
+HEADER_SIZE = 8
+# Emails added per lock acquisition while building the filter.
+BUILD_BATCH_SIZE = 1000
+
+
+class EmailFilter:
+    """
+    Bloom filter of the registered emails, used to skip the existence check of
+    `register_user` for emails that were definitely never registered.
+
+    The filter lives in a named shared memory segment so all the uvicorn
+    workers of a host share it: the first worker creates and builds it from
+    the `users` table, the others attach to it. Only the creating worker
+    unlinks the segment. The bits are set under a lock file shared by the
+    workers, as setting a bit rewrites its whole byte. It is sized for `capacity`
+    emails at the given `false_positive_rate`, that is
+    `-capacity * ln(rate) / ln(2)^2` bits (about 1.2MB for a million emails at
+    1%). Until it is built, or once the capacity is exceeded, it only gets less
+    selective: every email is a possible hit and goes to the database.
+
+    Emails registered by other hosts or imported in bulk are missing from it,
+    so a miss only means that the email is *probably* new, which is enough to
+    skip a check that the insert repeats anyway (`ON CONFLICT DO NOTHING`).
+    """
+
+    def __init__(self, name: str, capacity: int, false_positive_rate: float):
+        self.name = name
+        self.capacity = capacity
+        self.false_positive_rate = false_positive_rate
+        self.size_bits = math.ceil(
+            -capacity * math.log(false_positive_rate) / math.log(2) ** 2
+        )
+        self.hashes = max(1, round(self.size_bits / capacity * math.log(2)))
+        self._memory = None
+        self._created = False
+        self._lock_file = None
+        self._counters = {
+            "added": 0,
+            "definite_misses": 0,
+            "possible_hits": 0,
+            "false_positives": 0,
+            "false_negatives": 0,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self._memory is not None
+
+    @property
+    def ready(self) -> bool:
+        return self._memory is not None and self._memory.buf[0] == 1
+
+    @property
+    def memory_bytes(self) -> int:
+        return HEADER_SIZE + math.ceil(self.size_bits / 8)
+
+    def _positions(self, email: str):
+        digest = hashlib.blake2b(email.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hashes):
+            yield (first + i * second) % self.size_bits
+
+    async def open(self, *dbs):
+        """
+        Attach to the shared filter, creating and building it from the users
+        of the `dbs` (one per shard) when this is the first worker.
+        """
+        self._lock_file = open(
+            os.path.join(tempfile.gettempdir(), f"{self.name}.lock"), "a"
+        )
+        try:
+            self._memory = shared_memory.SharedMemory(
+                name=self.name, create=True, size=self.memory_bytes
+            )
+            self._created = True
+        except FileExistsError:
+            self._memory = shared_memory.SharedMemory(name=self.name)
+            # Only the creating worker unlinks the segment, the resource
+            # tracker would unlink it when this worker exits.
+            resource_tracker.unregister(self._memory._name, "shared_memory")
+            if self._memory.size < self.memory_bytes:
+                self.close()
+                raise RuntimeError(
+                    f"The shared memory segment {self.name} is smaller than the configured filter"
+                )
+            return
+        await self.build(*dbs)
+
+    async def build(self, *dbs):
+        count = 0
+        for db in dbs:
+            async with db.transaction():
+                async with db.cursor(name="email_filter_build") as cursor:
+                    await cursor.execute("SELECT email FROM users;")
+                    while rows := await cursor.fetchmany(BUILD_BATCH_SIZE):
+                        self.add(*(row["email"] for row in rows))
+                        count += len(rows)
+        self._memory.buf[0] = 1
+        if count > self.capacity:
+            log.warning(
+                "The email filter holds %d emails for a capacity of %d, its false positive rate is higher than configured",
+                count,
+                self.capacity,
+            )
+        log.info("Built the email filter with %d emails", count)
+
+    @contextmanager
+    def _locked(self):
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def add(self, *emails: str):
+        if self._memory is None:
+            return
+        positions = [
+            position for email in emails for position in self._positions(email)
+        ]
+        buf = self._memory.buf
+        with self._locked():
+            for position in positions:
+                buf[HEADER_SIZE + (position >> 3)] |= 1 << (position & 7)
+        self._counters["added"] += len(emails)
+
+    def might_contain(self, email: str) -> bool:
+        if not self.ready:
+            return True
+        buf = self._memory.buf
+        for position in self._positions(email):
+            if not buf[HEADER_SIZE + (position >> 3)] & (1 << (position & 7)):
+                self._counters["definite_misses"] += 1
+                return False
+        self._counters["possible_hits"] += 1
+        return True
+
+    def record_false_positive(self):
+        self._counters["false_positives"] += 1
+
+    def record_false_negative(self):
+        self._counters["false_negatives"] += 1
+
+    def close(self):
+        if self._memory is None:
+            return
+        self._memory.close()
+        if self._created:
+            # The segment is rebuilt from the database by the next worker to
+            # start, the attached workers keep their mapping.
+            try:
+                self._memory.unlink()
+            except FileNotFoundError:
+                resource_tracker.unregister(self._memory._name, "shared_memory")
+        self._lock_file.close()
+        self._memory = None
+        self._created = False
+        self._lock_file = None
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "ready": self.ready,
+            "capacity": self.capacity,
+            "false_positive_rate": self.false_positive_rate,
+            "memory_bytes": self.memory_bytes,
+            "hashes": self.hashes,
+            **self._counters,
+        }
+
+
+email_filter = EmailFilter(
+    name=email_filter_settings.EMAIL_FILTER_SHARED_MEMORY_NAME,
+    capacity=email_filter_settings.EMAIL_FILTER_CAPACITY,
+    false_positive_rate=email_filter_settings.EMAIL_FILTER_FALSE_POSITIVE_RATE,
+)
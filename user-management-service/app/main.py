@@ -1,14 +1,24 @@
 import logging
+from contextlib import AsyncExitStack
 
 from fastapi import FastAPI
 
+from .config import email_filter_settings, outbox_settings, sweeper_settings
+from .email_client import email_service_client
+from .email_filter import email_filter
+from .metrics import mark_process_dead, track_requests
+from .outbox import outbox_dispatcher
 from .postgres import postgres
 from .router import router
+from .sweeper import sweeper
+from .users.activation_codes import activation_code_store
+from .users.utils import password_hasher
 
 
 def create_application() -> FastAPI:
     application = FastAPI(openapi_url="/users/openapi.json", docs_url="/users/docs")
     application.include_router(router, prefix="/api/v1", tags=["users"])
+    application.middleware("http")(track_requests)
     return application
 
 
@@ -19,9 +29,32 @@ log = logging.getLogger("uvicorn")
 @app.on_event("startup")
 async def startup_event():
     log.info("Starting up...")
-    postgres.init_database()
+    await postgres.open_pool()
+    await postgres.check_schema()
+    if email_filter_settings.EMAIL_FILTER_ENABLED:
+        async with AsyncExitStack() as stack:
+            connections = [
+                await stack.enter_async_context(pool.connection())
+                for pool in postgres.pools()
+            ]
+            await email_filter.open(*connections)
+    await activation_code_store.start()
+    await password_hasher.start()
+    email_service_client.start()
+    if outbox_settings.OUTBOX_DISPATCHER_ENABLED:
+        outbox_dispatcher.start()
+    if sweeper_settings.SWEEPER_ENABLED:
+        sweeper.start()
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     log.info("Shutting down...")
+    await sweeper.stop()
+    await outbox_dispatcher.stop()
+    await email_service_client.close()
+    password_hasher.shutdown()
+    await activation_code_store.close()
+    email_filter.close()
+    await postgres.close_pool()
+    mark_process_dead()
@@ -0,0 +1,122 @@
+"""
+Prometheus metrics of the service.
+
+Set `PROMETHEUS_MULTIPROC_DIR` to an empty directory shared by the uvicorn
+workers to aggregate the metrics of all of them, otherwise each worker only
+exposes its own.
+"""
+
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+NAMESPACE = "user_management"
+BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Duration of the HTTP requests.",
+    ["method", "handler", "status"],
+    namespace=NAMESPACE,
+    buckets=BUCKETS,
+)
+STAGE_DURATION = Histogram(
+    "stage_duration_seconds",
+    "Duration of each stage of the operations.",
+    ["operation", "stage"],
+    namespace=NAMESPACE,
+    buckets=BUCKETS,
+)
+STAGE_FAILURES = Counter(
+    "stage_failures_total",
+    "Stages that raised an exception.",
+    ["operation", "stage"],
+    namespace=NAMESPACE,
+)
+
+
+class StageTimer:
+    """
+    Records the duration of a block as a stage of an operation, and counts it
+    as failed when it raises. Works with both `with` and `async with`.
+    """
+
+    __slots__ = ("labels", "started")
+
+    def __init__(self, operation: str, stage: str):
+        self.labels = (operation, stage)
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        STAGE_DURATION.labels(*self.labels).observe(time.perf_counter() - self.started)
+        if exc_type is not None and issubclass(exc_type, Exception):
+            STAGE_FAILURES.labels(*self.labels).inc()
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        return self.__exit__(exc_type, exc, traceback)
+
+
+def track_stage(operation: str, stage: str) -> StageTimer:
+    return StageTimer(operation, stage)
+
+
+async def track_requests(request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    # Labeled with the endpoint name, the full path template isn't in the scope.
+    REQUEST_DURATION.labels(
+        request.method, route.name if route else "unmatched", response.status_code
+    ).observe(time.perf_counter() - started)
+    return response
+
+
+def is_multiprocess() -> bool:
+    return "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+
+def render_metrics() -> tuple:
+    """
+    Return the metrics in the Prometheus text format and their content type.
+    """
+    registry = REGISTRY
+    if is_multiprocess():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead():
+    if is_multiprocess():
+        multiprocess.mark_process_dead(os.getpid())
@@ -0,0 +1,104 @@
+"""
+Versioned schema migrations.
+
+Migrations are the `NNNN_<name>.sql` files of `app/migrations`, applied in
+order, each one in its own transaction, and recorded in `schema_migrations`.
+A Postgres advisory lock makes concurrent runs (several workers or replicas
+starting together) wait for each other instead of racing.
+
+Usage:
+    python -m app.migrate
+"""
+
+import logging
+import re
+from pathlib import Path
+
+import psycopg
+
+MIGRATIONS_DIR = Path(__file__).parent / "migrations"
+MIGRATION_FILE_PATTERN = re.compile(r"^(\d{4})_(\w+)\.sql$")
+# Arbitrary key identifying the migrations advisory lock.
+ADVISORY_LOCK_KEY = 4_127_001
+
+log = logging.getLogger("uvicorn")
+
+
+def load_migrations() -> list:
+    migrations = []
+    for path in sorted(MIGRATIONS_DIR.iterdir()):
+        match = MIGRATION_FILE_PATTERN.match(path.name)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), path.read_text()))
+    return migrations
+
+
+def latest_version() -> int:
+    migrations = load_migrations()
+    return migrations[-1][0] if migrations else 0
+
+
+SCHEMA_VERSION_QUERY = """
+    SELECT CASE
+        WHEN to_regclass('schema_migrations') IS NULL THEN 0
+        ELSE (SELECT coalesce(max(version), 0) FROM schema_migrations)
+    END AS version;
+"""
+
+
+def migrate(database_url: str) -> list:
+    """
+    Apply the pending migrations and return their versions.
+    """
+    applied = []
+    with psycopg.connect(database_url, autocommit=True) as connection:
+        connection.execute("SELECT pg_advisory_lock(%s);", (ADVISORY_LOCK_KEY,))
+        try:
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INT PRIMARY KEY,
+                    name VARCHAR(255) NOT NULL,
+                    applied_at TIMESTAMP NOT NULL DEFAULT now()
+                );
+                """
+            )
+            current = connection.execute(SCHEMA_VERSION_QUERY).fetchone()[0]
+            for version, name, sql in load_migrations():
+                if version <= current:
+                    continue
+                with connection.transaction():
+                    connection.execute(sql)
+                    connection.execute(
+                        "INSERT INTO schema_migrations (version, name) VALUES (%s, %s);",
+                        (version, name),
+                    )
+                log.info("Applied migration %04d_%s", version, name)
+                applied.append(version)
+        finally:
+            connection.execute("SELECT pg_advisory_unlock(%s);", (ADVISORY_LOCK_KEY,))
+    return applied
+
+
+async def check_schema_version(connection):
+    """
+    Raise when the database schema is behind the migrations shipped with the app.
+    """
+    cursor = await connection.execute(SCHEMA_VERSION_QUERY)
+    version = (await cursor.fetchone())["version"]
+    expected = latest_version()
+    if version < expected:
+        raise RuntimeError(
+            f"Database schema is at version {version}, expected {expected}. "
+            "Run `python -m app.migrate` to apply the pending migrations."
+        )
+
+
+if __name__ == "__main__":
+    from .postgres import postgres
+
+    logging.basicConfig(level=logging.INFO)
+    # Every shard has the whole schema.
+    for database_url in postgres.database_urls():
+        versions = migrate(database_url)
+        log.info("Applied %d migration(s)", len(versions))
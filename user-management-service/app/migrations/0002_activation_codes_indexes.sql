@@ -0,0 +1,7 @@
+-- Activation lookups filter on (user_id, code), the cascade delete from users
+-- uses the user_id prefix and the cleanup of expired codes uses expires_at.
+CREATE INDEX IF NOT EXISTS activation_codes_user_id_code_idx
+    ON activation_codes (user_id, code);
+
+CREATE INDEX IF NOT EXISTS activation_codes_expires_at_idx
+    ON activation_codes (expires_at);
@@ -0,0 +1,5 @@
+-- Lets the sweeper find the unactivated users past their retention.
+ALTER TABLE users ADD COLUMN IF NOT EXISTS created_at TIMESTAMP NOT NULL DEFAULT now();
+
+CREATE INDEX IF NOT EXISTS users_unactivated_created_at_idx
+    ON users (created_at) WHERE NOT is_active;
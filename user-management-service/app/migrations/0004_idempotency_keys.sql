@@ -0,0 +1,14 @@
+-- Outcome of the /register requests sent with an Idempotency-Key header,
+-- replayed to the retries until the key expires. The key is claimed and its
+-- response stored in the same transaction, so the response is never NULL once
+-- committed.
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    key VARCHAR(255) PRIMARY KEY,
+    fingerprint CHAR(64) NOT NULL,
+    status_code SMALLINT,
+    response JSONB,
+    expires_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idempotency_keys_expires_at_idx
+    ON idempotency_keys (expires_at);
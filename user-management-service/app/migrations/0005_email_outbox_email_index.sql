@@ -0,0 +1,4 @@
+-- Lets the activation code resend find the last email sent to an address for
+-- its cooldown.
+CREATE INDEX IF NOT EXISTS email_outbox_email_created_at_idx
+    ON email_outbox (email, created_at);
@@ -0,0 +1,3 @@
+-- Lets the sweeper find the sent emails past their retention.
+CREATE INDEX IF NOT EXISTS email_outbox_sent_at_idx
+    ON email_outbox (sent_at) WHERE status = 'sent';
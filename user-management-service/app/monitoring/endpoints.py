@@ -0,0 +1,74 @@
+from fastapi import APIRouter, Response
+
+from ..email_client import email_service_client
+from ..email_filter import email_filter
+from ..metrics import render_metrics
+from ..outbox import outbox_dispatcher
+from ..postgres import postgres
+from ..prepared import prepared_statements
+from ..sweeper import sweeper
+from ..users.activation_codes import activation_code_store
+from ..users.admission import activate_admission, register_admission, resend_admission
+from ..users.coalescing import resend_coalescer
+from ..users.utils import password_hasher
+
+router = APIRouter(prefix="")
+
+
+@router.get(
+    "/stats",
+    summary="Service statistics",
+    description="Returns runtime statistics of the service resources.",
+)
+async def get_stats() -> dict:
+    """
+    Endpoint to inspect the runtime statistics of the service.
+
+    **Returns**:
+    - The Postgres connection pool statistics (size, available connections, waits and timeouts), per shard when sharded.
+    - The read replicas health, lag and pool statistics, and the reads that fell back to the primary.
+    - The prepared statement executions and the stale statements prepared again.
+    - The password hasher statistics (workers, pending and rejected operations).
+    - The email outbox dispatcher counters (sent, failed and dead-lettered emails).
+    - The email service HTTP client statistics (requests, retries, failures and circuit breaker state).
+    - The sweeper counters (runs and purged activation codes and users).
+    - The email filter sizing and counters (definite misses, possible hits and false positives).
+    - The activation code store backend and its size when kept in memory.
+    - The activation code resends run and coalesced with a resend in flight.
+    - The admission control counters of each route (in flight, admitted, rate limited and shed requests).
+    """
+    return {
+        "postgres_pool": postgres.stats(),
+        "postgres_replicas": postgres.replica_stats(),
+        "prepared_statements": prepared_statements.stats(),
+        "password_hasher": password_hasher.stats(),
+        "email_outbox": outbox_dispatcher.stats(),
+        "email_service_client": email_service_client.stats(),
+        "sweeper": sweeper.stats(),
+        "email_filter": email_filter.stats(),
+        "activation_code_store": activation_code_store.stats(),
+        "resend_coalescer": resend_coalescer.stats(),
+        "admission": {
+            "register": register_admission.stats(),
+            "activate": activate_admission.stats(),
+            "resend": resend_admission.stats(),
+        },
+    }
+
+
+@router.get(
+    "/metrics",
+    summary="Prometheus metrics",
+    description="Returns the service metrics in the Prometheus text format.",
+)
+def get_metrics() -> Response:
+    """
+    Endpoint scraped by Prometheus.
+
+    **Returns**:
+    - The HTTP requests duration histograms per endpoint and status.
+    - The duration histograms and failure counters of each stage of the operations
+      (connection checkout, password hashing, queries, email service requests...).
+    """
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import random
+
+from .config import outbox_settings
+from .email_client import (
+    EmailServiceError,
+    EmailServiceUnavailableError,
+    email_service_client,
+)
+from .metrics import track_stage
+from .postgres import postgres
+
+log = logging.getLogger("uvicorn")
+
+# Entries not sent because the circuit breaker is open, they are left as is.
+SKIPPED = object()
+
+
+class OutboxDispatcher:
+    """
+    Drains the `email_outbox` table and delivers the activation emails to the
+    email service.
+
+    Entries are leased in batches with `FOR UPDATE SKIP LOCKED` so several
+    dispatchers (workers or replicas of the service) can run in parallel
+    without sending the same email twice. An entry is leased again after
+    `lease` seconds when its dispatcher died before recording the outcome.
+    Failed deliveries are retried with an exponential backoff and
+    dead-lettered after `OUTBOX_MAX_ATTEMPTS`.
+    Nothing is claimed while the email service circuit breaker is open.
+    """
+
+    def __init__(
+        self,
+        client,
+        batch_size: int,
+        poll_interval: float,
+        max_attempts: int,
+        backoff_base: float,
+        backoff_max: float,
+        lease: float,
+    ):
+        self.client = client
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.lease = lease
+        self._task = None
+        self._counters = {"sent": 0, "failed": 0, "dead_lettered": 0}
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            busy = False
+            # Each shard has its own outbox.
+            for pool in postgres.pools():
+                try:
+                    with track_stage("outbox", "dispatch_batch"):
+                        claimed = await self.dispatch_batch(pool.connection)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    log.exception("Failed to dispatch the email outbox")
+                    claimed = 0
+                busy = busy or claimed >= self.batch_size
+            if not busy:
+                await asyncio.sleep(self.poll_interval)
+
+    def backoff(self, attempts: int) -> float:
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _send(self, entry: dict):
+        try:
+            await self.client.send_activation_email(entry["email"], entry["code"])
+        except EmailServiceUnavailableError:
+            return SKIPPED
+        except EmailServiceError as e:
+            return str(e)
+        return None
+
+    async def claim(self, db) -> list:
+        """
+        Lease a batch of due outbox entries to this dispatcher and commit.
+
+        Their `next_attempt_at` is pushed `lease` seconds ahead so the other
+        dispatchers skip them while they are being sent, and they are picked
+        up again if this one dies before recording the outcome.
+        """
+        async with db.cursor() as cursor:
+            await cursor.execute(
+                """
+                UPDATE email_outbox
+                SET next_attempt_at = now() + make_interval(secs => %s)
+                WHERE id IN (
+                    SELECT id FROM email_outbox
+                    WHERE status = 'pending' AND next_attempt_at <= now()
+                    ORDER BY next_attempt_at
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, email, code, attempts;
+                """,
+                (self.lease, self.batch_size),
+            )
+            entries = await cursor.fetchall()
+        await db.commit()
+        return entries
+
+    async def dispatch_batch(self, connection) -> int:
+        """
+        Claim and deliver one batch of due outbox entries.
+
+        `connection` returns an async context manager yielding a database
+        connection, like `AsyncConnectionPool.connection`. The entries are
+        claimed in a short transaction, sent outside of any transaction and
+        their outcome is recorded in a second one, so no lock nor connection
+        is held while waiting on the email service.
+
+        Returns the number of claimed entries.
+        """
+        if self.client.breaker.is_open():
+            return 0
+        async with connection() as db:
+            entries = await self.claim(db)
+        if not entries:
+            return 0
+
+        errors = await asyncio.gather(*(self._send(entry) for entry in entries))
+        async with connection() as db:
+            await self.record(db, entries, errors)
+        return len(entries)
+
+    async def record(self, db, entries: list, errors: list):
+        """
+        Record the outcome of the delivery of the claimed `entries` and commit.
+        """
+        sent = [entry["id"] for entry, error in zip(entries, errors) if not error]
+        skipped = [
+            entry["id"] for entry, error in zip(entries, errors) if error is SKIPPED
+        ]
+        async with db.cursor() as cursor:
+            if sent:
+                await cursor.execute(
+                    "UPDATE email_outbox SET status = 'sent', sent_at = now(), attempts = attempts + 1 WHERE id = ANY(%s);",
+                    (sent,),
+                )
+                self._counters["sent"] += len(sent)
+            if skipped:
+                # Give back the lease without burning an attempt.
+                await cursor.execute(
+                    "UPDATE email_outbox SET next_attempt_at = now() WHERE id = ANY(%s) AND status = 'pending';",
+                    (skipped,),
+                )
+            for entry, error in zip(entries, errors):
+                if not error or error is SKIPPED:
+                    continue
+                attempts = entry["attempts"] + 1
+                if attempts >= self.max_attempts:
+                    self._counters["dead_lettered"] += 1
+                    log.error(
+                        "Dead-lettering email outbox entry %s: %s", entry["id"], error
+                    )
+                    await cursor.execute(
+                        "UPDATE email_outbox SET status = 'dead', attempts = %s, last_error = %s WHERE id = %s AND status = 'pending';",
+                        (attempts, error, entry["id"]),
+                    )
+                else:
+                    self._counters["failed"] += 1
+                    await cursor.execute(
+                        "UPDATE email_outbox SET attempts = %s, last_error = %s, next_attempt_at = now() + make_interval(secs => %s) WHERE id = %s AND status = 'pending';",
+                        (attempts, error, self.backoff(attempts), entry["id"]),
+                    )
+        await db.commit()
+
+    def stats(self) -> dict:
+        return {"running": self._task is not None, **self._counters}
+
+
+outbox_dispatcher = OutboxDispatcher(
+    client=email_service_client,
+    batch_size=outbox_settings.OUTBOX_BATCH_SIZE,
+    poll_interval=outbox_settings.OUTBOX_POLL_INTERVAL,
+    max_attempts=outbox_settings.OUTBOX_MAX_ATTEMPTS,
+    backoff_base=outbox_settings.OUTBOX_BACKOFF_BASE,
+    backoff_max=outbox_settings.OUTBOX_BACKOFF_MAX,
+    lease=outbox_settings.OUTBOX_LEASE,
+)
@@ -0,0 +1,70 @@
+import logging
+
+import psycopg
+from psycopg import errors
+from psycopg.pq import TransactionStatus
+
+from .config import postgres_settings
+
+log = logging.getLogger("uvicorn")
+
+
+def _is_stale(error: psycopg.Error) -> bool:
+    # The server side statement is gone (e.g. `DISCARD ALL`), or its result
+    # columns changed with the schema (e.g. `SELECT *` after a new column).
+    if isinstance(error, errors.InvalidSqlStatementName):
+        return True
+    return isinstance(error, errors.FeatureNotSupported) and (
+        "cached plan must not change result type" in str(error)
+    )
+
+
+class PreparedStatements:
+    """
+    Runs the hot queries as server side prepared statements, so Postgres parses
+    and plans them once per connection instead of on every request.
+
+    The statements are prepared on their first execution and cached by psycopg
+    on the connection, a new connection (e.g. after a reconnect or a recycle by
+    the pool) prepares them again. psycopg drops the cache on rollback and after
+    DDL sent on the connection. A statement invalidated by a schema change made
+    from another connection is prepared again and retried once, when it started
+    the transaction, otherwise the error is raised and the rollback of the
+    transaction drops the cache for the next request.
+    """
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self._executions = 0
+        self._retries = 0
+
+    async def execute(self, cursor, query: str, params=None):
+        if not self.enabled:
+            return await cursor.execute(query, params)
+        self._executions += 1
+        connection = cursor.connection
+        started_transaction = (
+            connection.info.transaction_status == TransactionStatus.IDLE
+        )
+        try:
+            return await cursor.execute(query, params, prepare=True)
+        except psycopg.Error as e:
+            if not (started_transaction and _is_stale(e)):
+                raise
+            log.warning("Prepared statement is stale, preparing it again: %s", e)
+            self._retries += 1
+            await connection.rollback()
+            # Autocommit connections have nothing to roll back, psycopg also
+            # drops its cache when it sees this command.
+            await connection.execute("DEALLOCATE ALL")
+            return await cursor.execute(query, params, prepare=True)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "executions": self._executions,
+            "stale_retries": self._retries,
+        }
+
+
+prepared_statements = PreparedStatements(postgres_settings.POSTGRES_PREPARED_STATEMENTS)
@@ -0,0 +1,291 @@
+"""
+Move the users to their shard after the shard map changed.
+
+Every user of the `--from` shards (the current `POSTGRES_SHARDS`, or the
+unsharded database) whose email belongs to another shard of the `--to` map is
+copied there with its activation codes and email outbox entries, then deleted
+from its old shard. Users are moved in batches of `--batch-size`, each
+one locked on the old shard until it is copied so concurrent activations wait
+for the move. Moved users get a new id on their new shard.
+
+The target shards are migrated first. The tool can be run again at any time:
+users already on their shard are left as is, and users copied by an
+interrupted run (same password hash and creation time on the target) are only
+deleted from their old shard. A user whose email was registered again on its
+new shard in the meantime is kept on its old shard and logged as a conflict,
+to be resolved by hand. Run it once before
+deploying the new shard map and once after, to move the users registered in
+between. `--dry-run` only counts the users to move.
+
+Usage:
+    python -m app.reshard --to "shard-0=postgresql://...,shard-1=postgresql://..." --dry-run
+"""
+
+import argparse
+import json
+import logging
+import time
+from collections import Counter
+
+import psycopg
+from psycopg.rows import dict_row
+
+from .config import activation_code_settings, postgres_settings
+from .migrate import migrate
+from .sharding import HashRing, parse_shard_map
+
+log = logging.getLogger("uvicorn")
+
+
+class Resharder:
+    def __init__(
+        self,
+        source_shards: dict,
+        target_shards: dict,
+        vnodes: int = 128,
+        batch_size: int = 1000,
+    ):
+        self.source_shards = source_shards
+        self.target_shards = target_shards
+        self.ring = HashRing(target_shards, vnodes)
+        self.batch_size = batch_size
+
+    def target_url(self, email: str) -> str:
+        return self.target_shards[self.ring.shard_for(email)]
+
+    def plan(self) -> dict:
+        """
+        Count the users to move per `source -> target` shard.
+        """
+        moves = Counter()
+        for source, url in self.source_shards.items():
+            with psycopg.connect(url) as connection:
+                with connection.cursor(name="reshard_plan") as cursor:
+                    cursor.execute("SELECT email FROM users;")
+                    for (email,) in cursor:
+                        target = self.ring.shard_for(email)
+                        if self.target_shards[target] != url:
+                            moves[f"{source} -> {target}"] += 1
+        return dict(moves)
+
+    def move_batch(self, source, targets: dict, users: list) -> dict:
+        """
+        Copy the locked `users` of the `source` connection to their target shard
+        and delete them from the source. Returns the number of users copied,
+        the number copied by an interrupted run and the number kept on the
+        source because another user has their email on the target.
+        """
+        moved = {"moved": 0, "already_moved": 0, "conflicts": 0}
+        by_target = {}
+        for user in users:
+            by_target.setdefault(self.target_url(user["email"]), []).append(user)
+        emails = [user["email"] for user in users]
+        codes = source.execute(
+            """
+            SELECT users.email, code, expires_at FROM activation_codes
+            JOIN users ON users.id = user_id
+            WHERE users.id = ANY(%s);
+            """,
+            ([user["id"] for user in users],),
+        ).fetchall()
+        # The sent entries too, the resend cooldown starts from the last one.
+        outbox = source.execute(
+            """
+            SELECT email, code, status, attempts, last_error, next_attempt_at, created_at, sent_at
+            FROM email_outbox
+            WHERE email = ANY(%s)
+            FOR UPDATE;
+            """,
+            (emails,),
+        ).fetchall()
+        removed = []
+        for url, target_users in by_target.items():
+            target = targets[url]
+            with target.transaction():
+                inserted = target.execute(
+                    """
+                    INSERT INTO users (email, password_hash, is_active, created_at)
+                    SELECT * FROM unnest(
+                        %s::varchar[], %s::varchar[], %s::boolean[], %s::timestamp[]
+                    )
+                    ON CONFLICT (email) DO NOTHING
+                    RETURNING id, email;
+                    """,
+                    (
+                        [user["email"] for user in target_users],
+                        [user["password_hash"] for user in target_users],
+                        [user["is_active"] for user in target_users],
+                        [user["created_at"] for user in target_users],
+                    ),
+                ).fetchall()
+                new_ids = {row["email"]: row["id"] for row in inserted}
+                # Users already there were copied by an interrupted run, or
+                # registered on their new shard since.
+                existing = {
+                    row["email"]: row
+                    for row in target.execute(
+                        "SELECT email, password_hash, created_at FROM users WHERE email = ANY(%s);",
+                        (
+                            [
+                                user["email"]
+                                for user in target_users
+                                if user["email"] not in new_ids
+                            ],
+                        ),
+                    ).fetchall()
+                }
+                moved_codes = [code for code in codes if code["email"] in new_ids]
+                if moved_codes:
+                    target.execute(
+                        """
+                        INSERT INTO activation_codes (user_id, code, expires_at)
+                        SELECT * FROM unnest(%s::int[], %s::varchar[], %s::timestamp[]);
+                        """,
+                        (
+                            [new_ids[code["email"]] for code in moved_codes],
+                            [code["code"] for code in moved_codes],
+                            [code["expires_at"] for code in moved_codes],
+                        ),
+                    )
+                moved_outbox = [entry for entry in outbox if entry["email"] in new_ids]
+                if moved_outbox:
+                    target.execute(
+                        """
+                        INSERT INTO email_outbox (
+                            email, code, status, attempts, last_error, next_attempt_at, created_at, sent_at
+                        )
+                        SELECT * FROM unnest(
+                            %s::varchar[], %s::varchar[], %s::varchar[], %s::int[],
+                            %s::text[], %s::timestamp[], %s::timestamp[], %s::timestamp[]
+                        );
+                        """,
+                        (
+                            [entry["email"] for entry in moved_outbox],
+                            [entry["code"] for entry in moved_outbox],
+                            [entry["status"] for entry in moved_outbox],
+                            [entry["attempts"] for entry in moved_outbox],
+                            [entry["last_error"] for entry in moved_outbox],
+                            [entry["next_attempt_at"] for entry in moved_outbox],
+                            [entry["created_at"] for entry in moved_outbox],
+                            [entry["sent_at"] for entry in moved_outbox],
+                        ),
+                    )
+            for user in target_users:
+                copy = existing.get(user["email"])
+                if user["email"] in new_ids:
+                    moved["moved"] += 1
+                elif (copy["password_hash"], copy["created_at"]) == (
+                    user["password_hash"],
+                    user["created_at"],
+                ):
+                    moved["already_moved"] += 1
+                else:
+                    log.warning(
+                        "Kept user %d (%s) on its old shard, its email is registered on its new shard",
+                        user["id"],
+                        user["email"],
+                    )
+                    moved["conflicts"] += 1
+                    continue
+                removed.append(user)
+        # The activation codes are deleted by the cascade.
+        source.execute(
+            "DELETE FROM email_outbox WHERE email = ANY(%s);",
+            ([user["email"] for user in removed],),
+        )
+        source.execute(
+            "DELETE FROM users WHERE id = ANY(%s);", ([user["id"] for user in removed],)
+        )
+        source.commit()
+        return moved
+
+    def run(self) -> dict:
+        started = time.perf_counter()
+        for url in self.target_shards.values():
+            migrate(url)
+        summary = {"scanned": 0, "moved": 0, "already_moved": 0, "conflicts": 0}
+        targets = {
+            url: psycopg.connect(url, row_factory=dict_row)
+            for url in set(self.target_shards.values())
+        }
+        try:
+            for name, url in self.source_shards.items():
+                with psycopg.connect(url, row_factory=dict_row) as source:
+                    last_id = 0
+                    while True:
+                        users = source.execute(
+                            """
+                            SELECT id, email, password_hash, is_active, created_at FROM users
+                            WHERE id > %s
+                            ORDER BY id
+                            LIMIT %s
+                            FOR UPDATE;
+                            """,
+                            (last_id, self.batch_size),
+                        ).fetchall()
+                        if not users:
+                            source.commit()
+                            break
+                        last_id = users[-1]["id"]
+                        summary["scanned"] += len(users)
+                        to_move = [
+                            user
+                            for user in users
+                            if self.target_url(user["email"]) != url
+                        ]
+                        if not to_move:
+                            source.commit()
+                            continue
+                        moved = self.move_batch(source, targets, to_move)
+                        for key, count in moved.items():
+                            summary[key] += count
+                        log.info("Moved %d users from shard %s", moved["moved"], name)
+        finally:
+            for connection in targets.values():
+                connection.close()
+        summary["elapsed_seconds"] = round(time.perf_counter() - started, 3)
+        return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--from",
+        dest="source",
+        default=None,
+        help="The current name=url shard map, defaults to POSTGRES_SHARDS.",
+    )
+    parser.add_argument("--to", required=True, help="The new name=url shard map.")
+    parser.add_argument(
+        "--vnodes", type=int, default=postgres_settings.POSTGRES_SHARD_VNODES
+    )
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    if activation_code_settings.ACTIVATION_CODE_STORE != "postgres":
+        parser.error(
+            "The activation codes are only moved with their users when they are "
+            "stored in Postgres (ACTIVATION_CODE_STORE=postgres)"
+        )
+
+    if args.source is not None:
+        source_shards = parse_shard_map(args.source)
+    else:
+        from .postgres import postgres
+
+        source_shards = postgres.shard_urls or {"default": postgres.database_url}
+
+    logging.basicConfig(level=logging.INFO)
+    resharder = Resharder(
+        source_shards,
+        parse_shard_map(args.to),
+        vnodes=args.vnodes,
+        batch_size=args.batch_size,
+    )
+    print(json.dumps(resharder.plan() if args.dry_run else resharder.run()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,15 @@
+import orjson
+from fastapi.responses import JSONResponse
+
+
+class ORJSONResponse(JSONResponse):
+    """
+    JSON response serialized with orjson.
+
+    Endpoints returning rows read from the database use it to skip the
+    validation of the response model, the routes still declare their
+    `response_model` for the OpenAPI schema.
+    """
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content)
@@ -1,7 +1,9 @@
 from fastapi import APIRouter
 
+from .monitoring.endpoints import router as monitoring_router
 from .users.endpoints import router as users_router
 
 router = APIRouter()
 
 router.include_router(users_router, prefix="/users", tags=["users"])
+router.include_router(monitoring_router, prefix="/monitoring", tags=["monitoring"])
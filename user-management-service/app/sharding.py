@@ -0,0 +1,85 @@
+"""
+Consistent hashing of the users to the Postgres shards.
+
+A user and everything attached to it (activation codes, email outbox entries
+and idempotency keys) live on the shard of its normalized email, so the
+register and activate requests only ever touch one shard.
+"""
+
+import base64
+import bisect
+import hashlib
+from typing import Optional
+
+from fastapi import Request
+from fastapi.security.utils import get_authorization_scheme_param
+
+
+def normalize_email(email: str) -> str:
+    return email.strip().lower()
+
+
+def parse_shard_map(value: str) -> dict:
+    """
+    Parse a `name=url,name=url` shard map.
+    """
+    shards = {}
+    for entry in value.split(","):
+        if not entry.strip():
+            continue
+        name, separator, url = entry.partition("=")
+        name, url = name.strip(), url.strip()
+        if not separator or not name or not url:
+            raise ValueError(f"Invalid shard map entry {entry!r}, expected name=url")
+        if name in shards:
+            raise ValueError(f"Shard {name!r} is defined twice")
+        shards[name] = url
+    return shards
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(value.encode(), digest_size=8).digest(), "big"
+    )
+
+
+class HashRing:
+    """
+    Each shard is placed `vnodes` times on the ring, an email belongs to the
+    first shard point after its hash. Adding or removing a shard only moves
+    the emails of the points it takes or leaves, about 1/N of them.
+    """
+
+    def __init__(self, names, vnodes: int = 128):
+        points = sorted(
+            (_hash(f"{name}#{i}"), name) for name in names for i in range(vnodes)
+        )
+        if not points:
+            raise ValueError("The hash ring needs at least one shard")
+        self._hashes = [point for point, _ in points]
+        self._names = [name for _, name in points]
+
+    def shard_for(self, email: str) -> str:
+        index = bisect.bisect(self._hashes, _hash(normalize_email(email)))
+        return self._names[index % len(self._names)]
+
+
+async def request_email(request: Request) -> Optional[str]:
+    """
+    The email a request is about: the HTTP Basic username of `/activate` or
+    the `email` of the `/register` body.
+    """
+    scheme, param = get_authorization_scheme_param(request.headers.get("Authorization"))
+    if scheme.lower() == "basic":
+        try:
+            username, _, _ = base64.b64decode(param).decode().partition(":")
+            return username
+        except (ValueError, UnicodeDecodeError):
+            return None
+    # The body is already read and cached by FastAPI at this point.
+    try:
+        body = await request.json()
+    except ValueError:
+        return None
+    email = body.get("email") if isinstance(body, dict) else None
+    return email if isinstance(email, str) else None
@@ -0,0 +1,186 @@
+import asyncio
+import logging
+import time
+
+from .config import sweeper_settings
+from .metrics import track_stage
+from .postgres import postgres
+
+log = logging.getLogger("uvicorn")
+
+
+class Sweeper:
+    """
+    Periodically deletes the expired activation codes and idempotency keys, the
+    users that were never activated within `unactivated_user_retention` seconds
+    and the outbox entries sent more than `sent_email_retention` seconds ago.
+
+    Rows are deleted in batches of `batch_size`, each one in its own short
+    transaction, and rows locked by a concurrent activation are skipped so the
+    sweeper never blocks the request path.
+    """
+
+    def __init__(
+        self,
+        interval: float,
+        batch_size: int,
+        expired_code_grace: float,
+        unactivated_user_retention: float,
+        sent_email_retention: float,
+    ):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.expired_code_grace = expired_code_grace
+        self.unactivated_user_retention = unactivated_user_retention
+        self.sent_email_retention = sent_email_retention
+        self._task = None
+        self._counters = {
+            "runs": 0,
+            "expired_codes_purged": 0,
+            "stale_users_purged": 0,
+            "idempotency_keys_purged": 0,
+            "sent_emails_purged": 0,
+        }
+        self._last_run_duration = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            for pool in postgres.pools():
+                try:
+                    async with pool.connection() as connection:
+                        with track_stage("sweeper", "sweep"):
+                            await self.sweep(connection)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    log.exception("Failed to sweep the expired activation data")
+            await asyncio.sleep(self.interval)
+
+    async def _delete_batches(self, db, query: str, params: tuple) -> int:
+        purged = 0
+        while True:
+            cursor = await db.execute(query, params)
+            deleted = cursor.rowcount
+            await db.commit()
+            purged += deleted
+            if deleted < self.batch_size:
+                return purged
+
+    async def purge_expired_codes(self, db) -> int:
+        purged = await self._delete_batches(
+            db,
+            """
+            DELETE FROM activation_codes WHERE id IN (
+                SELECT id FROM activation_codes
+                WHERE expires_at <= now() - make_interval(secs => %s)
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            );
+            """,
+            (self.expired_code_grace, self.batch_size),
+        )
+        self._counters["expired_codes_purged"] += purged
+        return purged
+
+    async def purge_stale_users(self, db) -> int:
+        # Their remaining activation codes are removed by the cascade.
+        purged = await self._delete_batches(
+            db,
+            """
+            DELETE FROM users WHERE id IN (
+                SELECT id FROM users
+                WHERE NOT is_active
+                    AND created_at <= now() - make_interval(secs => %s)
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            );
+            """,
+            (self.unactivated_user_retention, self.batch_size),
+        )
+        self._counters["stale_users_purged"] += purged
+        return purged
+
+    async def purge_expired_idempotency_keys(self, db) -> int:
+        purged = await self._delete_batches(
+            db,
+            """
+            DELETE FROM idempotency_keys WHERE key IN (
+                SELECT key FROM idempotency_keys
+                WHERE expires_at <= now()
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            );
+            """,
+            (self.batch_size,),
+        )
+        self._counters["idempotency_keys_purged"] += purged
+        return purged
+
+    async def purge_sent_emails(self, db) -> int:
+        # Dead-lettered entries are kept for investigation.
+        purged = await self._delete_batches(
+            db,
+            """
+            DELETE FROM email_outbox WHERE id IN (
+                SELECT id FROM email_outbox
+                WHERE status = 'sent'
+                    AND sent_at <= now() - make_interval(secs => %s)
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            );
+            """,
+            (self.sent_email_retention, self.batch_size),
+        )
+        self._counters["sent_emails_purged"] += purged
+        return purged
+
+    async def sweep(self, db) -> dict:
+        """
+        Run a full sweep and return the number of purged rows per kind.
+        """
+        started = time.monotonic()
+        purged = {
+            "expired_codes": await self.purge_expired_codes(db),
+            "stale_users": await self.purge_stale_users(db),
+            "idempotency_keys": await self.purge_expired_idempotency_keys(db),
+            "sent_emails": await self.purge_sent_emails(db),
+        }
+        self._counters["runs"] += 1
+        self._last_run_duration = time.monotonic() - started
+        if any(purged.values()):
+            log.info(
+                "Purged %d expired activation codes, %d stale users, %d expired idempotency keys and %d sent emails",
+                purged["expired_codes"],
+                purged["stale_users"],
+                purged["idempotency_keys"],
+                purged["sent_emails"],
+            )
+        return purged
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None,
+            "last_run_duration": self._last_run_duration,
+            **self._counters,
+        }
+
+
+sweeper = Sweeper(
+    interval=sweeper_settings.SWEEPER_INTERVAL,
+    batch_size=sweeper_settings.SWEEPER_BATCH_SIZE,
+    expired_code_grace=sweeper_settings.SWEEPER_EXPIRED_CODE_GRACE,
+    unactivated_user_retention=sweeper_settings.SWEEPER_UNACTIVATED_USER_RETENTION,
+    sent_email_retention=sweeper_settings.SWEEPER_SENT_EMAIL_RETENTION,
+)
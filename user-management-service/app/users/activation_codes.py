@@ -0,0 +1,380 @@
+import abc
+import heapq
+import time
+from datetime import timedelta
+from typing import Optional
+
+import redis.asyncio as redis
+
+from ..config import activation_code_settings, sweeper_settings
+from ..metrics import track_stage
+from ..prepared import prepared_statements
+
+# The user statements, run as prepared statements. The code is inserted and
+# checked in the same statement when it is kept in Postgres.
+INSERT_USER = """
+    WITH new_user AS (
+        INSERT INTO users (email, password_hash) VALUES (%(email)s, %(password_hash)s)
+        ON CONFLICT (email) DO NOTHING
+        RETURNING id, email, is_active
+    ), activation_code AS (
+        INSERT INTO activation_codes (user_id, code, expires_at)
+        SELECT id, %(code)s, now() + %(ttl)s FROM new_user
+        WHERE %(code_in_database)s
+    ), outbox AS (
+        INSERT INTO email_outbox (email, code)
+        SELECT email, %(code)s FROM new_user
+    )
+    SELECT id, email, is_active FROM new_user;
+"""
+# `checked` is set when the code was already checked by the store, `is_valid`
+# then holds the result of the check.
+ACTIVATE_USER = """
+    WITH target AS (
+        SELECT id, is_active FROM users WHERE id = %(user_id)s FOR UPDATE
+    ), matched AS (
+        SELECT %(is_valid)s::boolean AS is_valid
+        WHERE %(checked)s AND %(is_valid)s::boolean IS NOT NULL
+        UNION ALL (
+            SELECT expires_at > now() FROM activation_codes
+            WHERE NOT %(checked)s AND user_id = %(user_id)s AND code = %(code)s
+            ORDER BY expires_at DESC
+            LIMIT 1
+        )
+    ), activated AS (
+        UPDATE users SET is_active = TRUE
+        WHERE id IN (SELECT id FROM target) AND NOT is_active
+            AND EXISTS (SELECT 1 FROM matched WHERE is_valid)
+        RETURNING id, email, is_active
+    ), consumed AS (
+        DELETE FROM activation_codes WHERE user_id IN (SELECT id FROM activated)
+    )
+    SELECT
+        CASE
+            WHEN EXISTS (SELECT 1 FROM activated) THEN 'activated'
+            WHEN NOT EXISTS (SELECT 1 FROM target) THEN 'not_found'
+            WHEN (SELECT is_active FROM target) THEN 'already_active'
+            WHEN NOT EXISTS (SELECT 1 FROM matched) THEN 'invalid_code'
+            ELSE 'expired'
+        END AS result,
+        activated.id, activated.email, activated.is_active
+    FROM (SELECT 1) AS one LEFT JOIN activated ON TRUE;
+"""
+
+
+class ActivationCodeStore(abc.ABC):
+    """
+    Where the activation codes are kept until they are used or expire.
+
+    `check` returns None when the user has no such code, and whether the code
+    is still valid otherwise. Expired codes are kept `expired_grace` seconds so
+    they can be reported as expired rather than invalid. `db` is the connection
+    of the transaction of the user, only used by the Postgres store.
+
+    `insert_user` and `activate_user` run the user statements with the code
+    operations of the store around them. The code is saved before the user is
+    committed, so the email is never sent for a code that wasn't saved, and
+    consumed once the activation is committed.
+    """
+
+    backend = None
+
+    def __init__(self, ttl: float, expired_grace: float):
+        self.ttl = ttl
+        self.expired_grace = expired_grace
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    @abc.abstractmethod
+    async def save(self, user_id: int, code: str, db=None):
+        pass
+
+    @abc.abstractmethod
+    async def check(self, user_id: int, code: str, db=None) -> Optional[bool]:
+        pass
+
+    @abc.abstractmethod
+    async def consume(self, user_id: int, db=None):
+        pass
+
+    @abc.abstractmethod
+    async def valid_code(
+        self, user_id: int, min_validity: float, db=None
+    ) -> Optional[str]:
+        """
+        The code of the user valid for the longest time, when it is still valid
+        for at least `min_validity` seconds.
+        """
+
+    async def insert_user(
+        self, cursor, email: str, password_hash: str, code: str
+    ) -> Optional[dict]:
+        """
+        Insert the user and its activation email outbox entry, and save its
+        `code`. Returns None when the email is already registered.
+        """
+        await prepared_statements.execute(
+            cursor,
+            INSERT_USER,
+            {
+                "email": email,
+                "password_hash": password_hash,
+                "code": code,
+                "ttl": timedelta(seconds=self.ttl),
+                "code_in_database": False,
+            },
+        )
+        user = await cursor.fetchone()
+        if user:
+            await self.save(user["id"], code, db=cursor.connection)
+        return user
+
+    async def activate_user(self, user_id: int, code: str, db) -> dict:
+        """
+        Activate the user when its `code` is valid and commit. Returns the
+        activation `result` with the activated user.
+        """
+        is_valid = await self.check(user_id, code, db=db)
+        async with db.cursor() as cursor:
+            await prepared_statements.execute(
+                cursor,
+                ACTIVATE_USER,
+                {
+                    "user_id": user_id,
+                    "code": code,
+                    "checked": True,
+                    "is_valid": is_valid,
+                },
+            )
+            row = await cursor.fetchone()
+        await db.commit()
+        if row["result"] == "activated":
+            await self.consume(user_id, db=db)
+        return row
+
+    def stats(self) -> dict:
+        return {"backend": self.backend}
+
+
+class PostgresActivationCodeStore(ActivationCodeStore):
+    """
+    Codes in the `activation_codes` table, in the transaction of the user. They
+    are inserted with the user and checked and consumed with its activation in
+    a single statement, the expired ones are deleted by the sweeper.
+    """
+
+    backend = "postgres"
+
+    async def save(self, user_id: int, code: str, db=None):
+        await db.execute(
+            """
+            INSERT INTO activation_codes (user_id, code, expires_at)
+            VALUES (%s, %s, now() + %s);
+            """,
+            (user_id, code, timedelta(seconds=self.ttl)),
+        )
+
+    async def check(self, user_id: int, code: str, db=None) -> Optional[bool]:
+        cursor = await db.execute(
+            """
+            SELECT expires_at > now() AS is_valid FROM activation_codes
+            WHERE user_id = %s AND code = %s
+            ORDER BY expires_at DESC
+            LIMIT 1;
+            """,
+            (user_id, code),
+        )
+        row = await cursor.fetchone()
+        return row["is_valid"] if row else None
+
+    async def consume(self, user_id: int, db=None):
+        await db.execute("DELETE FROM activation_codes WHERE user_id = %s;", (user_id,))
+
+    async def valid_code(
+        self, user_id: int, min_validity: float, db=None
+    ) -> Optional[str]:
+        cursor = await db.execute(
+            """
+            SELECT code FROM activation_codes
+            WHERE user_id = %s AND expires_at > now() + %s
+            ORDER BY expires_at DESC
+            LIMIT 1;
+            """,
+            (user_id, timedelta(seconds=min_validity)),
+        )
+        row = await cursor.fetchone()
+        return row["code"] if row else None
+
+    async def insert_user(
+        self, cursor, email: str, password_hash: str, code: str
+    ) -> Optional[dict]:
+        await prepared_statements.execute(
+            cursor,
+            INSERT_USER,
+            {
+                "email": email,
+                "password_hash": password_hash,
+                "code": code,
+                "ttl": timedelta(seconds=self.ttl),
+                "code_in_database": True,
+            },
+        )
+        return await cursor.fetchone()
+
+    async def activate_user(self, user_id: int, code: str, db) -> dict:
+        async with db.cursor() as cursor:
+            await prepared_statements.execute(
+                cursor,
+                ACTIVATE_USER,
+                {"user_id": user_id, "code": code, "checked": False, "is_valid": None},
+            )
+            row = await cursor.fetchone()
+        await db.commit()
+        return row
+
+
+class MemoryActivationCodeStore(ActivationCodeStore):
+    """
+    Codes in the memory of the worker, only usable with a single worker.
+
+    Expiry is tracked with a heap ordered by purge time, each operation pops
+    the entries that are due instead of scanning all the codes.
+    """
+
+    backend = "memory"
+
+    def __init__(self, ttl: float, expired_grace: float, clock=time.monotonic):
+        super().__init__(ttl, expired_grace)
+        self.clock = clock
+        self._codes = {}
+        self._expiry = []
+
+    def _purge(self, now: float):
+        while self._expiry and self._expiry[0][0] <= now:
+            _, user_id, code = heapq.heappop(self._expiry)
+            codes = self._codes.get(user_id)
+            # Consumed users and codes saved again later are left in the heap.
+            if codes is not None and code in codes:
+                if codes[code] + self.expired_grace <= now:
+                    del codes[code]
+                    if not codes:
+                        del self._codes[user_id]
+
+    async def save(self, user_id: int, code: str, db=None):
+        now = self.clock()
+        self._purge(now)
+        expires_at = now + self.ttl
+        self._codes.setdefault(user_id, {})[code] = expires_at
+        heapq.heappush(self._expiry, (expires_at + self.expired_grace, user_id, code))
+
+    async def check(self, user_id: int, code: str, db=None) -> Optional[bool]:
+        now = self.clock()
+        self._purge(now)
+        expires_at = self._codes.get(user_id, {}).get(code)
+        if expires_at is None:
+            return None
+        return expires_at > now
+
+    async def consume(self, user_id: int, db=None):
+        self._codes.pop(user_id, None)
+
+    async def valid_code(
+        self, user_id: int, min_validity: float, db=None
+    ) -> Optional[str]:
+        now = self.clock()
+        self._purge(now)
+        codes = self._codes.get(user_id)
+        if not codes:
+            return None
+        code, expires_at = max(codes.items(), key=lambda item: item[1])
+        return code if expires_at - now >= min_validity else None
+
+    def stats(self) -> dict:
+        return {
+            **super().stats(),
+            "users": len(self._codes),
+            "pending_expirations": len(self._expiry),
+        }
+
+
+class RedisActivationCodeStore(ActivationCodeStore):
+    """
+    Codes in a Redis compatible server shared by all the workers, one hash per
+    user mapping its codes to their expiration time. The hash expires with its
+    last code, so Redis purges them without any sweep.
+    """
+
+    backend = "redis"
+
+    def __init__(self, url: str, ttl: float, expired_grace: float, client=None):
+        super().__init__(ttl, expired_grace)
+        self.url = url
+        self.client = client
+
+    async def start(self):
+        if self.client is None:
+            self.client = redis.from_url(self.url)
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    @staticmethod
+    def _key(user_id: int) -> str:
+        return f"activation_codes:{user_id}"
+
+    async def save(self, user_id: int, code: str, db=None):
+        key = self._key(user_id)
+        async with track_stage("activation_codes", "save"):
+            async with self.client.pipeline(transaction=True) as pipeline:
+                pipeline.hset(key, code, time.time() + self.ttl)
+                pipeline.expire(key, int(self.ttl + self.expired_grace) + 1)
+                await pipeline.execute()
+
+    async def check(self, user_id: int, code: str, db=None) -> Optional[bool]:
+        async with track_stage("activation_codes", "check"):
+            expires_at = await self.client.hget(self._key(user_id), code)
+        if expires_at is None:
+            return None
+        return float(expires_at) > time.time()
+
+    async def consume(self, user_id: int, db=None):
+        async with track_stage("activation_codes", "consume"):
+            await self.client.delete(self._key(user_id))
+
+    async def valid_code(
+        self, user_id: int, min_validity: float, db=None
+    ) -> Optional[str]:
+        async with track_stage("activation_codes", "valid_code"):
+            codes = await self.client.hgetall(self._key(user_id))
+        if not codes:
+            return None
+        code, expires_at = max(codes.items(), key=lambda item: float(item[1]))
+        if float(expires_at) - time.time() < min_validity:
+            return None
+        return code.decode() if isinstance(code, bytes) else code
+
+
+def create_activation_code_store(backend: str) -> ActivationCodeStore:
+    ttl = activation_code_settings.ACTIVATION_CODE_TTL
+    # The window the sweeper keeps the expired codes for in Postgres.
+    expired_grace = sweeper_settings.SWEEPER_EXPIRED_CODE_GRACE
+    if backend == "postgres":
+        return PostgresActivationCodeStore(ttl, expired_grace)
+    if backend == "memory":
+        return MemoryActivationCodeStore(ttl, expired_grace)
+    if backend == "redis":
+        return RedisActivationCodeStore(
+            activation_code_settings.ACTIVATION_CODE_STORE_URL, ttl, expired_grace
+        )
+    raise ValueError(f"Unknown activation code store: {backend}")
+
+
+activation_code_store = create_activation_code_store(
+    activation_code_settings.ACTIVATION_CODE_STORE
+)
@@ -0,0 +1,150 @@
+import math
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from fastapi import HTTPException, Request, status
+
+from ..config import admission_settings
+
+
+class TokenBucketLimiter:
+    """
+    Token bucket per key (client IP or email) refilled at `rate` tokens per
+    second up to `burst` tokens. The least recently seen keys are forgotten
+    beyond `max_keys` so the memory used stays bounded.
+    """
+
+    def __init__(self, rate: float, burst: int, max_keys: int):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+
+    def acquire(self, key: str) -> Optional[float]:
+        """
+        Take a token for `key`, returns None when allowed, otherwise the number
+        of seconds until a token is available.
+        """
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens >= 1:
+            tokens -= 1
+            retry_after = None
+        else:
+            retry_after = (1 - tokens) / self.rate
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return retry_after
+
+
+class AdmissionControl:
+    """
+    FastAPI dependency shedding the requests a route can't serve in time.
+
+    Requests are rejected right away, before a database connection is checked
+    out or a password is hashed: with a 429 when the client IP is over its rate
+    limit, and with a 503 when `max_concurrency` requests of the route are
+    already in flight. A zero limit disables it.
+
+    The dependency yields itself so the route applies the per email rate limit
+    with `limit_email` once it knows the email can be trusted: after parsing
+    the body for `/register`, and only after verifying the credentials for
+    `/activate` and `/resend-activation-code`, so nobody can lock an account
+    out by sending requests with its email and a wrong password.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        ip_rate: float,
+        ip_burst: int,
+        email_rate: float,
+        email_burst: int,
+        max_keys: int,
+    ):
+        self.max_concurrency = max_concurrency
+        self.ip_limiter = (
+            TokenBucketLimiter(ip_rate, ip_burst, max_keys) if ip_rate else None
+        )
+        self.email_limiter = (
+            TokenBucketLimiter(email_rate, email_burst, max_keys)
+            if email_rate
+            else None
+        )
+        self._in_flight = 0
+        self._counters = {"admitted": 0, "rate_limited": 0, "shed": 0}
+
+    def _rate_limit(self, limiter, key: str):
+        if limiter is None or not key:
+            return
+        retry_after = limiter.acquire(key)
+        if retry_after is not None:
+            self._counters["rate_limited"] += 1
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests, please try again later",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+
+    def enter(self, request: Request):
+        self._rate_limit(self.ip_limiter, request.client.host if request.client else "")
+        if self.max_concurrency and self._in_flight >= self.max_concurrency:
+            self._counters["shed"] += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is busy, please try again later",
+                headers={"Retry-After": "1"},
+            )
+        self._in_flight += 1
+        self._counters["admitted"] += 1
+
+    def leave(self):
+        self._in_flight -= 1
+
+    def limit_email(self, email: str):
+        self._rate_limit(self.email_limiter, email.lower())
+
+    async def __call__(self, request: Request):
+        self.enter(request)
+        try:
+            yield self
+        finally:
+            self.leave()
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self._in_flight,
+            **self._counters,
+        }
+
+
+register_admission = AdmissionControl(
+    max_concurrency=admission_settings.ADMISSION_REGISTER_MAX_CONCURRENCY,
+    ip_rate=admission_settings.ADMISSION_REGISTER_IP_RATE,
+    ip_burst=admission_settings.ADMISSION_REGISTER_IP_BURST,
+    email_rate=admission_settings.ADMISSION_REGISTER_EMAIL_RATE,
+    email_burst=admission_settings.ADMISSION_REGISTER_EMAIL_BURST,
+    max_keys=admission_settings.ADMISSION_MAX_TRACKED_KEYS,
+)
+
+activate_admission = AdmissionControl(
+    max_concurrency=admission_settings.ADMISSION_ACTIVATE_MAX_CONCURRENCY,
+    ip_rate=admission_settings.ADMISSION_ACTIVATE_IP_RATE,
+    ip_burst=admission_settings.ADMISSION_ACTIVATE_IP_BURST,
+    email_rate=admission_settings.ADMISSION_ACTIVATE_EMAIL_RATE,
+    email_burst=admission_settings.ADMISSION_ACTIVATE_EMAIL_BURST,
+    max_keys=admission_settings.ADMISSION_MAX_TRACKED_KEYS,
+)
+
+resend_admission = AdmissionControl(
+    max_concurrency=admission_settings.ADMISSION_RESEND_MAX_CONCURRENCY,
+    ip_rate=admission_settings.ADMISSION_RESEND_IP_RATE,
+    ip_burst=admission_settings.ADMISSION_RESEND_IP_BURST,
+    email_rate=admission_settings.ADMISSION_RESEND_EMAIL_RATE,
+    email_burst=admission_settings.ADMISSION_RESEND_EMAIL_BURST,
+    max_keys=admission_settings.ADMISSION_MAX_TRACKED_KEYS,
+)
@@ -0,0 +1,50 @@
+import asyncio
+
+
+class RequestCoalescer:
+    """
+    Runs one operation per key at a time within the worker. Calls made for a
+    key while its operation is in flight wait for that operation and get its
+    result instead of running it again.
+
+    When the call running the operation is cancelled (e.g. its client went
+    away), one of the waiting calls runs it instead.
+    """
+
+    def __init__(self):
+        self._in_flight = {}
+        self._counters = {"runs": 0, "coalesced": 0}
+
+    async def run(self, key, operation):
+        while (future := self._in_flight.get(key)) is not None:
+            self._counters["coalesced"] += 1
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        self._counters["runs"] += 1
+        try:
+            result = await operation()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Marks the exception as retrieved when nobody was waiting.
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._in_flight[key]
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._in_flight), **self._counters}
+
+
+resend_coalescer = RequestCoalescer()
@@ -1,21 +1,36 @@
-from datetime import datetime, timezone
-from typing import Annotated
+import math
+from typing import Annotated, Optional
 
-import requests
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, status
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 
-from ..config import email_service_settings
+from ..email_filter import email_filter
 from ..postgres import postgres
+from ..responses import ORJSONResponse
+from .admission import activate_admission, register_admission, resend_admission
+from .coalescing import resend_coalescer
+from .idempotency import (
+    claim_idempotency_key,
+    fingerprint,
+    store_idempotent_response,
+)
 from .repository import (
     activate_user,
-    create_activation_code,
     create_user,
-    get_activation_code,
+    email_exists,
     get_user_by_email,
+    resend_activation_code,
+    update_password_hash,
+)
+from .schemas import (
+    ActivationResult,
+    ResendActivationCodeModel,
+    ResendResult,
+    UserActivationModel,
+    UserModel,
+    UserRegistrationModel,
 )
-from .schemas import UserActivationModel, UserModel, UserRegistrationModel
-from .utils import verify_password
+from .utils import password_hasher
 
 router = APIRouter(prefix="")
 security = HTTPBasic()
@@ -24,69 +39,125 @@ security = HTTPBasic()
 @router.post(
     "/register",
     summary="Register a new user",
-    description="Registers a user and sends an email containing the activation code.",
+    description="Registers a user and queues an email containing the activation code.",
+    response_model=UserModel,
 )
-def register_user(
+async def register_user(
     user: UserRegistrationModel,
+    idempotency_key: Annotated[Optional[str], Header(max_length=255)] = None,
+    admission=Depends(register_admission),
     db=Depends(postgres.get_db),
-) -> UserModel:
+) -> ORJSONResponse:
     """
     Endpoint to register a new user.
 
     **Parameters**:
     - **user (UserRegistrationModel)**: The request body containing the user's email(must be unique) and password.
+    - **Idempotency-Key (header, optional)**: A unique key chosen by the client to retry the request safely.
 
     On successful registration, the user will receive an activation code via email.
+    The user, the activation code and the email outbox entry are inserted in a single
+    statement, the email is delivered in the background so the email service is not
+    on the request path. When the email filter is enabled, emails it reports as possibly
+    registered are checked first so duplicates are rejected without hashing the password,
+    the others go straight to the insert, which rejects the duplicates the filter missed.
+    The created user is serialized as is, without validating the response model again.
+
+    When an `Idempotency-Key` is sent, the outcome of the request is stored with the
+    key in the same transaction and replayed to the retries using the same key (with an
+    `Idempotent-Replayed: true` header) without hashing the password or inserting anything
+    again. Concurrent retries wait for the first request to finish.
 
     **Returns**:
     - **UserModel**: The newly created user object.
 
     **Raises**:
     - **400 Bad Request**: If the user is already registered.
-    - **403 Forbidden**: If the API key is invalid.
-    - **500 Internal Server Error**: If an error occurs while sending the email.
+    - **422 Unprocessable Entity**: If the idempotency key was used to register another email.
+    - **429 Too Many Requests**: If the client IP or the email is over its rate limit.
+    - **503 Service Unavailable**: If the server is too busy to hash the password.
     """
+    admission.limit_email(user.email)
+    if idempotency_key is None:
+        new_user = await _register(user, db)
+        return ORJSONResponse(new_user.model_dump())
 
-    existing_user = get_user_by_email(email=user.email, db=db)
-    if existing_user:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST, detail="User already exists"
+    request_fingerprint = fingerprint(user.email)
+    stored = await claim_idempotency_key(idempotency_key, request_fingerprint, db)
+    if stored is not None:
+        await db.rollback()
+        if stored["fingerprint"] != request_fingerprint:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_CONTENT,
+                detail="Idempotency key already used for another request",
+            )
+        return ORJSONResponse(
+            stored["response"],
+            status_code=stored["status_code"],
+            headers={"Idempotent-Replayed": "true"},
         )
 
-    user = create_user(user=user, db=db)
-    activation_code = create_activation_code(user_id=user.id, db=db)
+    # Errors other than an existing user aren't stored, the transaction is rolled
+    # back and the key can be used again.
     try:
-        headers = {"x-api-key": email_service_settings.API_KEY}
-        response = requests.post(
-            email_service_settings.EMAIL_SERVICE_URL,
-            headers=headers,
-            json={"email": user.email, "code": activation_code},
-        )
-        if response.status_code != 200:
+        new_user = await _register(user, db, commit=False)
+        status_code, response = status.HTTP_200_OK, new_user.model_dump()
+    except HTTPException as e:
+        if e.status_code != status.HTTP_400_BAD_REQUEST:
+            raise
+        status_code, response = e.status_code, {"detail": e.detail}
+    await store_idempotent_response(idempotency_key, status_code, response, db)
+    await db.commit()
+    return ORJSONResponse(response, status_code=status_code)
+
+
+async def _register(user: UserRegistrationModel, db, commit: bool = True) -> UserModel:
+    checked = email_filter.enabled and email_filter.might_contain(user.email)
+    if checked:
+        if await email_exists(email=user.email, db=db):
             raise HTTPException(
-                status_code=response.status_code, detail=response.json()["detail"]
+                status_code=status.HTTP_400_BAD_REQUEST, detail="User already exists"
             )
-    except requests.exceptions.RequestException as e:
-        raise e
+        email_filter.record_false_positive()
+
+    new_user = await create_user(user=user, db=db, commit=commit)
+    email_filter.add(user.email)
+    if not new_user:
+        # Emails registered by other hosts, or a lost bit.
+        if email_filter.enabled and not checked:
+            email_filter.record_false_negative()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="User already exists"
+        )
 
-    return user
+    return new_user
 
 
 @router.post(
-    "/activate", summary="Activate a user", description="Activate a user account."
+    "/activate",
+    summary="Activate a user",
+    description="Activate a user account.",
+    response_model=UserModel,
 )
-def activate_new_user(
+async def activate_new_user(
     code: UserActivationModel,
     credentials: Annotated[HTTPBasicCredentials, Depends(security)],
+    admission=Depends(activate_admission),
+    read_db=Depends(postgres.get_read_db),
     db=Depends(postgres.get_db),
-) -> UserModel:
+) -> ORJSONResponse:
     """
     Activate a user account.
 
     - **code (EmailRequest)**: The activation code sent to the user's email
     - **credentials (HTTPBasicCredentials)**: User's email and password
 
-    On successful activation, the user's account will be marked as active.
+    On successful activation, the user's account will be marked as active and its
+    activation codes are consumed. The code and its expiration are checked against the
+    database clock in the same atomic statement that activates the account. The user is
+    looked up on a read replica when one is configured, the activation itself always
+    runs on the primary so a stale replica can't activate an account twice.
+    Passwords hashed with another bcrypt cost than the current one are hashed again.
 
     **Returns**:
     - User object.
@@ -95,8 +166,12 @@ def activate_new_user(
     - **400 Bad Request**: If the user is already active or the activation code is invalid or expired.
     - **401 UNAUTHORIZED**: If the user's credentials are invalid.
     - **404 Not Found**: If the user does not exist.
+    - **429 Too Many Requests**: If the client IP or the email is over its rate limit.
+    - **503 Service Unavailable**: If the server is too busy to verify the password.
     """
-    user = get_user_by_email(email=credentials.username, db=db, include_password=True)
+    user = await get_user_by_email(
+        email=credentials.username, db=db, include_password=True, read_db=read_db
+    )
 
     if not user:
         raise HTTPException(
@@ -109,22 +184,110 @@ def activate_new_user(
             detail="User has already activated his account",
         )
 
-    if not verify_password(credentials.password, user.password_hash):
+    is_valid, new_password_hash = await password_hasher.verify_and_update(
+        credentials.password, user.password_hash
+    )
+    if not is_valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials"
         )
+    admission.limit_email(user.email)
+    if new_password_hash is not None:
+        await update_password_hash(
+            user_id=user.id, password_hash=new_password_hash, db=db
+        )
 
-    activation_code = get_activation_code(user_id=user.id, code=code.code, db=db)
-    if not activation_code:
+    result, activated_user = await activate_user(user_id=user.id, code=code.code, db=db)
+    if result == ActivationResult.NOT_FOUND:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
+        )
+    if result == ActivationResult.ALREADY_ACTIVE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="User has already activated his account",
+        )
+    if result == ActivationResult.INVALID_CODE:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid activation code"
         )
-    if datetime.now(timezone.utc) > activation_code.expires_at.replace(
-        tzinfo=timezone.utc
-    ):
+    if result == ActivationResult.EXPIRED:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Activation code has expired",
         )
 
-    return activate_user(user_id=user.id, db=db)
+    return ORJSONResponse(activated_user.model_dump())
+
+
+@router.post(
+    "/resend-activation-code",
+    summary="Resend the activation code",
+    description="Queues the activation email again for a user that isn't active yet.",
+    response_model=ResendActivationCodeModel,
+)
+async def resend_code(
+    credentials: Annotated[HTTPBasicCredentials, Depends(security)],
+    admission=Depends(resend_admission),
+    read_db=Depends(postgres.get_read_db),
+    db=Depends(postgres.get_db),
+) -> ORJSONResponse:
+    """
+    Resend the activation code of a user whose code expired or never arrived.
+
+    - **credentials (HTTPBasicCredentials)**: User's email and password
+
+    The code of the user is sent again while it stays valid long enough to be used,
+    a new code is only created otherwise. Concurrent resends of the same user are
+    coalesced into a single email, and no email is sent within the cooldown following
+    the last activation email of the user.
+
+    **Returns**:
+    - A confirmation message.
+
+    **Raises**:
+    - **400 Bad Request**: If the user is already active.
+    - **401 UNAUTHORIZED**: If the user's credentials are invalid.
+    - **404 Not Found**: If the user does not exist.
+    - **429 Too Many Requests**: If the user is in its cooldown, or the client IP or the email is over its rate limit.
+    - **503 Service Unavailable**: If the server is too busy to verify the password.
+    """
+    user = await get_user_by_email(
+        email=credentials.username, db=db, include_password=True, read_db=read_db
+    )
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
+        )
+    if user.is_active:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="User has already activated his account",
+        )
+    if not await password_hasher.verify(credentials.password, user.password_hash):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials"
+        )
+    admission.limit_email(user.email)
+
+    # Keyed by email, user ids are only unique within a shard.
+    result, retry_after = await resend_coalescer.run(
+        user.email, lambda: resend_activation_code(user_id=user.id, db=db)
+    )
+    if result == ResendResult.NOT_FOUND:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
+        )
+    if result == ResendResult.ALREADY_ACTIVE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="User has already activated his account",
+        )
+    if result == ResendResult.COOLDOWN:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Activation code already sent, please try again later",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+
+    return ORJSONResponse({"detail": "Activation code sent"})
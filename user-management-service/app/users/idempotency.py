@@ -0,0 +1,70 @@
+import hashlib
+from typing import Optional
+
+from psycopg.types.json import Jsonb
+
+from ..config import idempotency_settings
+from ..metrics import track_stage
+
+
+def fingerprint(email: str) -> str:
+    """
+    Identify the request a key was used for. Only the email is part of it, the
+    password isn't stored in any form.
+    """
+    return hashlib.sha256(email.lower().encode()).hexdigest()
+
+
+async def claim_idempotency_key(
+    key: str, request_fingerprint: str, db
+) -> Optional[dict]:
+    """
+    Claim the key in the current transaction, or return the stored outcome of
+    the request that already used it.
+
+    Concurrent requests with the same key wait on the unique index until the
+    transaction that claimed it ends: they get its stored outcome when it
+    committed, and claim the key themselves when it rolled back. Expired keys
+    are claimed again.
+    """
+    async with track_stage("register", "idempotency_claim"), db.cursor() as cursor:
+        while True:
+            await cursor.execute(
+                """
+                INSERT INTO idempotency_keys (key, fingerprint, expires_at)
+                VALUES (%(key)s, %(fingerprint)s, now() + make_interval(secs => %(ttl)s))
+                ON CONFLICT (key) DO UPDATE SET
+                    fingerprint = EXCLUDED.fingerprint,
+                    status_code = NULL,
+                    response = NULL,
+                    expires_at = EXCLUDED.expires_at
+                WHERE idempotency_keys.expires_at <= now()
+                RETURNING key;
+                """,
+                {
+                    "key": key,
+                    "fingerprint": request_fingerprint,
+                    "ttl": idempotency_settings.IDEMPOTENCY_KEY_TTL,
+                },
+            )
+            if await cursor.fetchone():
+                return None
+            await cursor.execute(
+                "SELECT fingerprint, status_code, response FROM idempotency_keys WHERE key = %s;",
+                (key,),
+            )
+            stored = await cursor.fetchone()
+            # Otherwise purged by the sweeper in between, claim it again.
+            if stored:
+                return stored
+
+
+async def store_idempotent_response(key: str, status_code: int, response: dict, db):
+    """
+    Store the outcome of the request that claimed the key, it is visible to the
+    retries once the transaction commits.
+    """
+    await db.execute(
+        "UPDATE idempotency_keys SET status_code = %s, response = %s WHERE key = %s;",
+        (status_code, Jsonb(response), key),
+    )
@@ -1,80 +1,191 @@
-from datetime import datetime, timedelta, timezone
-from typing import Optional
+import logging
+from datetime import timedelta
+from typing import Optional, Tuple
 
+import psycopg
+from psycopg_pool import PoolTimeout
+
+from ..config import activation_code_settings
+from ..metrics import track_stage
+from ..postgres import postgres
+from ..prepared import prepared_statements
+from .activation_codes import activation_code_store
 from .schemas import (
-    ActivationCodeModel,
+    ActivationResult,
+    ResendResult,
     UserModel,
     UserRegistrationModel,
     UserWithPasswordModal,
 )
-from .utils import generate_code, hash_password
+from .utils import generate_code, password_hasher
 
+log = logging.getLogger("uvicorn")
 
-def get_user_by_email(email: str, db, include_password: bool = False):
-    with db.cursor() as cursor:
-        if include_password:
-            cursor.execute("SELECT * FROM users WHERE email = %s;", (email,))
-        else:
-            cursor.execute(
-                "SELECT id, email, is_active FROM users WHERE email = %s;",
-                (email,),
-            )
-        user = cursor.fetchone()
+ACTIVATION_CODE_TTL = timedelta(seconds=activation_code_settings.ACTIVATION_CODE_TTL)
+RESEND_COOLDOWN = timedelta(
+    seconds=activation_code_settings.ACTIVATION_CODE_RESEND_COOLDOWN
+)
+REUSE_MIN_VALIDITY = timedelta(
+    seconds=activation_code_settings.ACTIVATION_CODE_REUSE_MIN_VALIDITY
+)
+
+
+# The user lookups, run as prepared statements.
+SELECT_USER = "SELECT id, email, is_active FROM users WHERE email = %s;"
+SELECT_USER_WITH_PASSWORD = "SELECT * FROM users WHERE email = %s;"
+EMAIL_EXISTS = "SELECT 1 FROM users WHERE email = %s;"
+
+
+async def _select_user_by_email(email: str, db, include_password: bool):
+    async with track_stage("users", "lookup"), db.cursor() as cursor:
+        await prepared_statements.execute(
+            cursor,
+            SELECT_USER_WITH_PASSWORD if include_password else SELECT_USER,
+            (email,),
+        )
+        user = await cursor.fetchone()
         if user:
+            # Rows read from the database are trusted, they aren't validated again.
             return (
-                UserModel(**user)
+                UserModel.model_construct(**user)
                 if not include_password
-                else UserWithPasswordModal(**user)
+                else UserWithPasswordModal.model_construct(**user)
             )
         return None
 
 
-def create_user(user: UserRegistrationModel, db) -> Optional[UserModel]:
-    password_hash = hash_password(user.password)
-    with db.cursor() as cursor:
-        cursor.execute(
-            "INSERT INTO users (email, password_hash) VALUES (%s, %s) RETURNING id, email, is_active",
-            (user.email, password_hash),
+async def get_user_by_email(
+    email: str, db, include_password: bool = False, read_db=None
+):
+    """
+    Look the user up on the `read_db` replica connection when given, and on
+    the primary `db` when the replica fails or doesn't have the user yet (e.g.
+    activating right after registering, before the replica caught up).
+    """
+    if read_db is None:
+        return await _select_user_by_email(email, db, include_password)
+    try:
+        user = await _select_user_by_email(email, read_db, include_password)
+        if user:
+            return user
+    except (PoolTimeout, psycopg.Error):
+        # Including the queries canceled by a recovery conflict on the replica.
+        log.warning("Read replica failed, reading from the primary", exc_info=True)
+        postgres.record_replica_fallback()
+        return await _select_user_by_email(email, db, include_password)
+    user = await _select_user_by_email(email, db, include_password)
+    if user:
+        postgres.record_replica_miss()
+    return user
+
+
+async def email_exists(email: str, db) -> bool:
+    async with track_stage("register", "email_check"), db.cursor() as cursor:
+        await prepared_statements.execute(cursor, EMAIL_EXISTS, (email,))
+        return await cursor.fetchone() is not None
+
+
+async def create_user(
+    user: UserRegistrationModel, db, commit: bool = True
+) -> Optional[UserModel]:
+    """
+    Insert the user, its activation code and the activation email outbox entry,
+    in a single statement when the codes are kept in Postgres. With
+    `commit=False` the transaction is left open for the caller to commit.
+
+    Returns None when the email is already registered.
+    """
+    password_hash = await password_hasher.hash(user.password)
+    async with track_stage("register", "insert"), db.cursor() as cursor:
+        user = await activation_code_store.insert_user(
+            cursor, user.email, password_hash, generate_code()
         )
-        user = cursor.fetchone()
-        db.commit()
+        if commit:
+            await db.commit()
         if user:
-            return UserModel(**user)
+            return UserModel.model_construct(**user)
         return None
 
 
-def create_activation_code(user_id: int, db) -> str:
-    code = generate_code()
-    expires_at = datetime.now(timezone.utc) + timedelta(minutes=1)
-    with db.cursor() as cursor:
-        cursor.execute(
-            "INSERT INTO activation_codes (user_id, code, expires_at) VALUES (%s, %s, %s);",
-            (user_id, code, expires_at),
+async def update_password_hash(user_id: int, password_hash: str, db):
+    async with track_stage("activate", "rehash"):
+        await db.execute(
+            "UPDATE users SET password_hash = %s WHERE id = %s;",
+            (password_hash, user_id),
         )
-        db.commit()
-    return code
+        await db.commit()
 
 
-def get_activation_code(user_id: int, code: str, db) -> Optional[ActivationCodeModel]:
-    with db.cursor() as cursor:
-        cursor.execute(
-            "SELECT * FROM activation_codes WHERE user_id = %s AND code = %s;",
-            (user_id, code),
-        )
-        code = cursor.fetchone()
-        if code:
-            return ActivationCodeModel(**code)
-        return None
+async def activate_user(
+    user_id: int, code: str, db
+) -> Tuple[ActivationResult, Optional[UserModel]]:
+    """
+    Check the activation code, activate the user and consume its codes. When
+    the codes are kept in Postgres, this is a single atomic statement checking
+    the code against the database clock.
+
+    The user row is locked so concurrent attempts are serialized, only one of
+    them activates the account and the others get `ALREADY_ACTIVE`.
+    """
+    async with track_stage("activate", "update"):
+        row = await activation_code_store.activate_user(user_id, code, db)
+    result = ActivationResult(row.pop("result"))
+    if result == ActivationResult.ACTIVATED:
+        return result, UserModel.model_construct(**row)
+    return result, None
 
 
-def activate_user(user_id: int, db) -> Optional[UserModel]:
-    with db.cursor() as cursor:
-        cursor.execute(
-            "UPDATE users SET is_active = TRUE WHERE id = %s RETURNING id, email, is_active;",
+async def resend_activation_code(
+    user_id: int, db
+) -> Tuple[ResendResult, Optional[float]]:
+    """
+    Queue the activation email again, with the code of the user still valid for
+    at least `REUSE_MIN_VALIDITY` or a new one.
+
+    The user row is locked so concurrent resends are serialized. Nothing is sent
+    within `RESEND_COOLDOWN` of the last activation email, the seconds left are
+    returned with `COOLDOWN`.
+    """
+    async with track_stage("resend", "lock"), db.cursor() as cursor:
+        await cursor.execute(
+            "SELECT id, email, is_active FROM users WHERE id = %s FOR UPDATE;",
             (user_id,),
         )
-        user = cursor.fetchone()
-        db.commit()
-        if user:
-            return UserModel(**user)
-        return None
+        user = await cursor.fetchone()
+        # Committed rather than rolled back, which would drop the prepared statements.
+        if user is None:
+            await db.commit()
+            return ResendResult.NOT_FOUND, None
+        if user["is_active"]:
+            await db.commit()
+            return ResendResult.ALREADY_ACTIVE, None
+        # A separate statement, so it sees what a resend that held the lock wrote.
+        await cursor.execute(
+            """
+            SELECT
+                extract(epoch FROM (
+                    SELECT max(created_at) FROM email_outbox WHERE email = %(email)s
+                ) + %(cooldown)s - now()) AS cooldown_remaining;
+            """,
+            {"email": user["email"], "cooldown": RESEND_COOLDOWN},
+        )
+        state = await cursor.fetchone()
+    if state["cooldown_remaining"] is not None and state["cooldown_remaining"] > 0:
+        await db.commit()
+        return ResendResult.COOLDOWN, float(state["cooldown_remaining"])
+
+    code = await activation_code_store.valid_code(
+        user_id, REUSE_MIN_VALIDITY.total_seconds(), db=db
+    )
+    reused = code is not None
+    if not reused:
+        code = generate_code()
+    async with track_stage("resend", "insert"):
+        await db.execute(
+            "INSERT INTO email_outbox (email, code) VALUES (%s, %s);",
+            (user["email"], code),
+        )
+        if not reused:
+            await activation_code_store.save(user_id, code, db=db)
+        await db.commit()
+    return (ResendResult.REUSED if reused else ResendResult.SENT), None
@@ -1,5 +1,6 @@
 import re
-from datetime import datetime
+from enum import Enum
+from typing import Optional
 
 from pydantic import BaseModel, EmailStr, validator
 from pydantic.types import constr
@@ -33,11 +34,34 @@ class UserActivationModel(BaseModel):
         return v
 
 
-class ActivationCodeModel(BaseModel):
-    id: int
-    user_id: int
-    code: str
-    expires_at: datetime
+class ActivationResult(str, Enum):
+    ACTIVATED = "activated"
+    NOT_FOUND = "not_found"
+    ALREADY_ACTIVE = "already_active"
+    INVALID_CODE = "invalid_code"
+    EXPIRED = "expired"
 
-    class Config:
-        orm_mode = True
+
+class ResendResult(str, Enum):
+    SENT = "sent"
+    REUSED = "reused"
+    NOT_FOUND = "not_found"
+    ALREADY_ACTIVE = "already_active"
+    COOLDOWN = "cooldown"
+
+
+class ResendActivationCodeModel(BaseModel):
+    detail: str
+
+
+class ImportedUserModel(BaseModel):
+    email: EmailStr
+    password: Optional[constr(min_length=8)] = None
+    password_hash: Optional[str] = None
+    is_active: bool = False
+
+    @validator("password_hash")
+    def password_hash_must_be_bcrypt(cls, v):
+        if v is not None and not re.match(r"^\$2[aby]\$\d{2}\$[./A-Za-z0-9]{53}$", v):
+            raise ValueError("Password hash must be a bcrypt hash")
+        return v
@@ -1,17 +1,219 @@
+import asyncio
+import functools
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
 from random import randint
+from typing import Optional, Tuple
 
+from fastapi import HTTPException, status
 from passlib.context import CryptContext
 
+from ..config import password_hashing_settings
+from ..metrics import track_stage
+
+log = logging.getLogger("uvicorn")
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+@functools.lru_cache
+def bcrypt_context(rounds: int) -> CryptContext:
+    # Hashes with another cost need an update, whether it is lower or higher.
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__default_rounds=rounds,
+        bcrypt__min_rounds=rounds,
+        bcrypt__max_rounds=rounds,
+    )
+
+
+def hash_password(password: str, rounds: Optional[int] = None) -> str:
+    context = pwd_context if rounds is None else bcrypt_context(rounds)
+    return context.hash(password)
 
 
 def verify_password(plain_password, hashed_password) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 
+def verify_and_update_password(
+    plain_password, hashed_password, rounds: int
+) -> Tuple[bool, Optional[str]]:
+    """
+    Verify the password and return a new hash when the stored one doesn't use
+    `rounds`.
+    """
+    return bcrypt_context(rounds).verify_and_update(plain_password, hashed_password)
+
+
+def measure_hash_seconds(rounds: int, samples: int = 2) -> float:
+    context = bcrypt_context(rounds)
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        context.hash("calibration-password")
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def calibrate_rounds(
+    target_seconds: float, min_rounds: int, max_rounds: int
+) -> Tuple[int, dict]:
+    """
+    Pick the highest bcrypt cost hashing within `target_seconds`, between
+    `min_rounds` and `max_rounds`.
+
+    The time is measured at `min_rounds` and doubled for each extra round, then
+    measured again at the chosen cost. Returns the cost and the measured hash
+    times per cost.
+    """
+    timings = {min_rounds: measure_hash_seconds(min_rounds)}
+    rounds = min_rounds
+    while (
+        rounds < max_rounds
+        and timings[min_rounds] * 2 ** (rounds + 1 - min_rounds) <= target_seconds
+    ):
+        rounds += 1
+    if rounds != min_rounds:
+        timings[rounds] = measure_hash_seconds(rounds, samples=1)
+        # The extrapolation was too optimistic.
+        while rounds > min_rounds and timings[rounds] > target_seconds:
+            rounds -= 1
+            timings.setdefault(rounds, measure_hash_seconds(rounds, samples=1))
+    return rounds, timings
+
+
 def generate_code() -> str:
     return str(randint(1000, 9999))
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt hashing and verification on a pool of worker processes so
+    that the event loop is never blocked by CPU bound work.
+
+    At most `workers + queue_size` operations are in flight, additional calls
+    are rejected right away with a 503 instead of piling up.
+
+    The bcrypt cost is `rounds` when set, otherwise it is calibrated on a worker
+    when starting: the highest cost hashing within `target_seconds`, between
+    `min_rounds` and `max_rounds`.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        queue_size: int,
+        rounds: int = 0,
+        target_seconds: float = 0.25,
+        min_rounds: int = 10,
+        max_rounds: int = 14,
+    ):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.configured_rounds = rounds
+        self.target_seconds = target_seconds
+        self.min_rounds = min_rounds
+        self.max_rounds = max_rounds
+        self.rounds = rounds or min_rounds
+        self.hash_seconds = {}
+        self._executor = None
+        self._pending = 0
+        self._completed = 0
+        self._rejected = 0
+
+    async def start(self):
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+        )
+        if self.configured_rounds:
+            self.rounds = self.configured_rounds
+            return
+        loop = asyncio.get_running_loop()
+        self.rounds, self.hash_seconds = await loop.run_in_executor(
+            self._executor,
+            calibrate_rounds,
+            self.target_seconds,
+            self.min_rounds,
+            self.max_rounds,
+        )
+        log.info(
+            "Calibrated the bcrypt cost to %d rounds (%.3fs per hash)",
+            self.rounds,
+            self.hash_seconds[self.rounds],
+        )
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    async def _run(self, function, *args):
+        if self._executor is None:
+            # Hashing inline would block the event loop for the whole hash.
+            raise RuntimeError("The password hasher isn't started")
+        if self._pending >= self.workers + self.queue_size:
+            self._rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is busy, please try again later",
+                headers={"Retry-After": "1"},
+            )
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, function, *args)
+        finally:
+            self._pending -= 1
+            self._completed += 1
+
+    async def hash(self, password: str) -> str:
+        with track_stage("password", "hash"):
+            return await self._run(hash_password, password, self.rounds)
+
+    async def verify(self, plain_password, hashed_password) -> bool:
+        with track_stage("password", "verify"):
+            return await self._run(verify_password, plain_password, hashed_password)
+
+    async def verify_and_update(
+        self, plain_password, hashed_password
+    ) -> Tuple[bool, Optional[str]]:
+        """
+        Verify the password and return a new hash when the stored one doesn't
+        use the current cost.
+        """
+        with track_stage("password", "verify"):
+            return await self._run(
+                verify_and_update_password,
+                plain_password,
+                hashed_password,
+                self.rounds,
+            )
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "rounds": self.rounds,
+            "calibrated": not self.configured_rounds,
+            "hash_seconds": {
+                rounds: round(seconds, 4)
+                for rounds, seconds in self.hash_seconds.items()
+            },
+            "pending": self._pending,
+            "completed": self._completed,
+            "rejected": self._rejected,
+        }
+
+
+password_hasher = PasswordHasher(
+    workers=password_hashing_settings.PASSWORD_HASHING_WORKERS,
+    queue_size=password_hashing_settings.PASSWORD_HASHING_QUEUE_SIZE,
+    rounds=password_hashing_settings.PASSWORD_HASHING_ROUNDS,
+    target_seconds=password_hashing_settings.PASSWORD_HASHING_TARGET_SECONDS,
+    min_rounds=password_hashing_settings.PASSWORD_HASHING_MIN_ROUNDS,
+    max_rounds=password_hashing_settings.PASSWORD_HASHING_MAX_ROUNDS,
+)
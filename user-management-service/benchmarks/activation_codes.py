@@ -0,0 +1,131 @@
+"""
+Compare the activation throughput of the activation code stores.
+
+For each backend, `--users` unactivated users are inserted with an activation
+code saved in the store, then activated by `--concurrency` concurrent tasks
+with `activate_user` on a pool of `--pool-size` connections. The passwords
+aren't verified, only the code check, the activation and the code consumption
+are measured.
+
+The Redis store uses `--redis-url`, or a fakeredis TCP server started in this
+process when it isn't given (it then competes with the benchmark for the CPU,
+use a real server to compare the backends).
+
+Usage:
+    python -m benchmarks.activation_codes --users 5000 --concurrency 50
+"""
+
+import argparse
+import asyncio
+import statistics
+import threading
+import time
+import uuid
+
+from fakeredis import TcpFakeServer
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+from app.users import repository
+from app.users.activation_codes import (
+    MemoryActivationCodeStore,
+    PostgresActivationCodeStore,
+    RedisActivationCodeStore,
+)
+from app.users.schemas import ActivationResult
+
+
+async def insert_users(pool, store, prefix: str, count: int) -> list:
+    async with pool.connection() as connection:
+        cursor = await connection.execute(
+            """
+            INSERT INTO users (email, password_hash)
+            SELECT %(prefix)s || i || '@example.com', 'hash'
+            FROM generate_series(1, %(count)s) AS i
+            RETURNING id;
+            """,
+            {"prefix": prefix, "count": count},
+        )
+        user_ids = [row["id"] for row in await cursor.fetchall()]
+        for user_id in user_ids:
+            await store.save(user_id, "1234", db=connection)
+        return user_ids
+
+
+async def run(name: str, store, args) -> dict:
+    repository.activation_code_store = store
+    prefix = f"activation-bench-{uuid.uuid4().hex[:8]}-"
+    async with AsyncConnectionPool(
+        args.dsn,
+        min_size=args.pool_size,
+        max_size=args.pool_size,
+        kwargs={"row_factory": dict_row},
+    ) as pool:
+        await store.start()
+        try:
+            user_ids = await insert_users(pool, store, prefix, args.users)
+
+            queue = iter(user_ids)
+            latencies = []
+
+            async def worker():
+                for user_id in queue:
+                    started = time.perf_counter()
+                    async with pool.connection() as connection:
+                        result, _ = await repository.activate_user(
+                            user_id=user_id, code="1234", db=connection
+                        )
+                    latencies.append(time.perf_counter() - started)
+                    assert result == ActivationResult.ACTIVATED, result
+
+            started = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+            elapsed = time.perf_counter() - started
+        finally:
+            await store.close()
+            async with pool.connection() as connection:
+                await connection.execute(
+                    "DELETE FROM users WHERE email LIKE %s;", (prefix + "%",)
+                )
+
+    latencies.sort()
+    result = {
+        "store": name,
+        "activations": len(latencies),
+        "throughput_aps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+    }
+    print(result)
+    return result
+
+
+def main():
+    from app.postgres import postgres
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--dsn", default=postgres.database_url)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--pool-size", type=int, default=10)
+    parser.add_argument("--redis-url", default=None)
+    args = parser.parse_args()
+
+    redis_url = args.redis_url
+    if redis_url is None:
+        server = TcpFakeServer(("127.0.0.1", 0), server_type="redis")
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        host, port = server.server_address
+        redis_url = f"redis://{host}:{port}/0"
+
+    stores = {
+        "postgres": PostgresActivationCodeStore(ttl=3600, expired_grace=0),
+        "memory": MemoryActivationCodeStore(ttl=3600, expired_grace=0),
+        "redis": RedisActivationCodeStore(redis_url, ttl=3600, expired_grace=0),
+    }
+    for name, store in stores.items():
+        asyncio.run(run(name, store, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Simulate `/register` under overload with and without admission control.
+
+The route is modeled as `--workers` password hashing processes taking
+`--service-time` milliseconds per request, so its capacity is
+`workers / service_time`. Requests arrive at a constant rate of `overload`
+times that capacity for `--duration` seconds and clients give up after
+`--deadline` milliseconds. Goodput counts the requests answered successfully
+within the deadline.
+
+Without admission control every request waits for a worker, the queue grows
+for as long as the overload lasts and nearly every request misses its
+deadline. With a concurrency limit the requests over it are rejected right
+away with a 503 and the admitted ones keep a bounded latency.
+
+Usage:
+    python -m benchmarks.admission --overloads 1 2 3 5
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from types import SimpleNamespace
+
+from app.users.admission import AdmissionControl
+from fastapi import HTTPException
+
+# No client IP, only the concurrency limit applies.
+REQUEST = SimpleNamespace(client=None)
+
+
+async def simulate(args, overload: float, max_concurrency: int) -> dict:
+    admission = AdmissionControl(
+        max_concurrency=max_concurrency,
+        ip_rate=0,
+        ip_burst=0,
+        email_rate=0,
+        email_burst=0,
+        max_keys=1,
+    )
+    workers = asyncio.Semaphore(args.workers)
+    service_time = args.service_time / 1000
+    deadline = args.deadline / 1000
+    latencies, rejected = [], 0
+
+    async def request():
+        nonlocal rejected
+        started = time.perf_counter()
+        try:
+            admission.enter(REQUEST)
+        except HTTPException:
+            rejected += 1
+            return
+        try:
+            async with workers:
+                await asyncio.sleep(service_time)
+        finally:
+            admission.leave()
+        latencies.append(time.perf_counter() - started)
+
+    rate = overload * args.workers / service_time
+    total = int(rate * args.duration)
+    started = time.perf_counter()
+    tasks = []
+    for i in range(total):
+        delay = started + i / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(request()))
+    await asyncio.gather(*tasks)
+
+    on_time = [latency for latency in latencies if latency <= deadline]
+    latencies.sort()
+    result = {
+        "overload": overload,
+        "admission_control": bool(max_concurrency),
+        "requests": total,
+        "rejected": rejected,
+        "goodput_rps": round(len(on_time) / args.duration, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1) if latencies else None,
+        "p99_ms": (
+            round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 1)
+            if latencies
+            else None
+        ),
+    }
+    print(result)
+    return result
+
+
+async def run(args):
+    for overload in args.overloads:
+        await simulate(args, overload, max_concurrency=0)
+        await simulate(args, overload, max_concurrency=args.max_concurrency)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--overloads", type=float, nargs="+", default=[1, 2, 3, 5])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--service-time", type=float, default=50.0)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--deadline", type=float, default=1000.0)
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=8,
+        help="Admission control concurrency limit, the workers plus a short queue.",
+    )
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
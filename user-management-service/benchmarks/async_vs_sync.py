@@ -0,0 +1,110 @@
+"""
+Compare the blocking request path (psycopg in a worker thread pool) with the
+asyncio request path (async psycopg pool on the event loop).
+
+Each simulated request looks a user up by email and then waits for the email
+service for `--email-latency` milliseconds, like `register_user` does.
+
+Usage:
+    python -m benchmarks.async_vs_sync --requests 2000 --concurrency 500
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool, ConnectionPool
+
+QUERY = "SELECT id, email, is_active FROM users WHERE email = %s;"
+
+
+def report(name: str, latencies: list, elapsed: float) -> dict:
+    latencies = sorted(latencies)
+    result = {
+        "path": name,
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+    }
+    print(result)
+    return result
+
+
+def run_sync(args) -> dict:
+    pool = ConnectionPool(
+        args.dsn,
+        min_size=args.pool_size,
+        max_size=args.pool_size,
+        kwargs={"row_factory": dict_row},
+    )
+    pool.wait()
+
+    def request(index: int) -> float:
+        started = time.perf_counter()
+        with pool.connection() as connection:
+            connection.execute(QUERY, (f"bench-{index}@example.com",)).fetchone()
+        time.sleep(args.email_latency / 1000)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    # Starlette runs sync endpoints on a 40 threads pool by default.
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        latencies = list(executor.map(request, range(args.requests)))
+    elapsed = time.perf_counter() - started
+    pool.close()
+    return report("sync", latencies, elapsed)
+
+
+async def run_async(args) -> dict:
+    pool = AsyncConnectionPool(
+        args.dsn,
+        min_size=args.pool_size,
+        max_size=args.pool_size,
+        kwargs={"row_factory": dict_row},
+        open=False,
+    )
+    await pool.open(wait=True)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def request(index: int) -> float:
+        async with semaphore:
+            started = time.perf_counter()
+            async with pool.connection() as connection:
+                cursor = await connection.execute(
+                    QUERY, (f"bench-{index}@example.com",)
+                )
+                await cursor.fetchone()
+            await asyncio.sleep(args.email_latency / 1000)
+            return time.perf_counter() - started
+
+    started = time.perf_counter()
+    latencies = await asyncio.gather(*(request(i) for i in range(args.requests)))
+    elapsed = time.perf_counter() - started
+    await pool.close()
+    return report("async", latencies, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--dsn", default=None, help="Defaults to the app database.")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=500)
+    parser.add_argument("--threads", type=int, default=40)
+    parser.add_argument("--pool-size", type=int, default=10)
+    parser.add_argument("--email-latency", type=float, default=50.0)
+    args = parser.parse_args()
+    if args.dsn is None:
+        from app.postgres import postgres
+
+        args.dsn = postgres.database_url
+
+    run_sync(args)
+    asyncio.run(run_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Compare importing users one `INSERT` transaction at a time, like
+`register_user` does, with the chunked `COPY` bulk import.
+
+Records carry a pre-hashed password unless `--plain-passwords` is set. They
+are validated (and their passwords hashed) on `--workers` processes by the
+bulk import and inline by the row by row import. The imported users are
+deleted afterwards.
+
+Usage:
+    python -m benchmarks.bulk_import --records 20000 --chunk-size 5000
+"""
+
+import argparse
+import time
+
+import psycopg
+from app.bulk_import import BulkImporter, prepare_records
+from app.users.utils import hash_password
+
+EMAIL_PREFIX = "bench-import-"
+
+
+def make_records(args, password_hash: str) -> list:
+    field = "password" if args.plain_passwords else "password_hash"
+    value = "benchmark" if args.plain_passwords else password_hash
+    return [
+        (number, {"email": f"{EMAIL_PREFIX}{number}@example.com", field: value})
+        for number in range(1, args.records + 1)
+    ]
+
+
+def cleanup(dsn: str):
+    with psycopg.connect(dsn) as connection:
+        connection.execute(
+            "DELETE FROM email_outbox WHERE email LIKE %s;", (f"{EMAIL_PREFIX}%",)
+        )
+        connection.execute(
+            "DELETE FROM users WHERE email LIKE %s;", (f"{EMAIL_PREFIX}%",)
+        )
+
+
+def report(name: str, records: int, elapsed: float) -> dict:
+    result = {
+        "path": name,
+        "records": records,
+        "elapsed_seconds": round(elapsed, 3),
+        "records_per_second": round(records / elapsed, 1),
+    }
+    print(result)
+    return result
+
+
+def run_row_by_row(args, records: list) -> dict:
+    started = time.perf_counter()
+    with psycopg.connect(args.dsn) as connection:
+        for record in records:
+            # Validated and hashed one at a time, like `POST /register`.
+            rows, _ = prepare_records([record], args.rounds)
+            connection.execute(
+                "INSERT INTO users (email, password_hash) VALUES (%s, %s) ON CONFLICT (email) DO NOTHING;",
+                rows[0][1:3],
+            )
+            connection.commit()
+    elapsed = time.perf_counter() - started
+    cleanup(args.dsn)
+    return report("row_by_row", len(records), elapsed)
+
+
+def run_copy(args, records: list) -> dict:
+    importer = BulkImporter(
+        args.dsn, chunk_size=args.chunk_size, workers=args.workers, rounds=args.rounds
+    )
+    summary = importer.run(iter(records))
+    cleanup(args.dsn)
+    return report("copy", summary["imported"], summary["elapsed_seconds"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--dsn", default=None, help="Defaults to the app database.")
+    parser.add_argument("--records", type=int, default=20000)
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--plain-passwords", action="store_true")
+    parser.add_argument("--rounds", type=int, default=10, help="bcrypt cost")
+    args = parser.parse_args()
+    if args.dsn is None:
+        from app.postgres import postgres
+
+        args.dsn = postgres.database_url
+
+    records = make_records(args, hash_password("benchmark", args.rounds))
+    cleanup(args.dsn)
+    run_row_by_row(args, records)
+    run_copy(args, records)
+
+
+if __name__ == "__main__":
+    main()
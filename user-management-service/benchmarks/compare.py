@@ -0,0 +1,73 @@
+"""
+Compare two load test results saved by `benchmarks.load_test`.
+
+Prints the throughput and latency percentiles of each phase side by side and
+exits with status 1 when the candidate throughput dropped, or one of its
+latency percentiles grew, by more than `--threshold` percent.
+
+Usage:
+    python -m benchmarks.compare benchmarks/results/baseline.json benchmarks/results/candidate.json
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+# Metric name and whether higher values are better.
+METRICS = (
+    ("throughput_rps", True),
+    ("p50_ms", False),
+    ("p95_ms", False),
+    ("p99_ms", False),
+)
+
+
+def compare(baseline: dict, candidate: dict, threshold: float) -> list:
+    """
+    Print the comparison and return the regressions.
+    """
+    regressions = []
+    for key, value in candidate.get("config", {}).items():
+        if baseline.get("config", {}).get(key) != value:
+            print(f"Warning: {key} differs, {baseline['config'].get(key)} != {value}")
+    baseline_phases = {phase["phase"]: phase for phase in baseline["phases"]}
+    print(
+        f"{'phase':<10} {'metric':<16} {'baseline':>10} {'candidate':>10} {'change':>8}"
+    )
+    for phase in candidate["phases"]:
+        reference = baseline_phases.get(phase["phase"])
+        if reference is None:
+            continue
+        for metric, higher_is_better in METRICS:
+            before, after = reference.get(metric), phase.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before * 100
+            regressed = (-change if higher_is_better else change) > threshold
+            if regressed:
+                regressions.append((phase["phase"], metric, change))
+            print(
+                f"{phase['phase']:<10} {metric:<16} {before:>10} {after:>10} "
+                f"{change:>+7.1f}%{'  <- regression' if regressed else ''}"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("baseline", type=Path)
+    parser.add_argument("candidate", type=Path)
+    parser.add_argument("--threshold", type=float, default=10.0)
+    args = parser.parse_args()
+
+    regressions = compare(
+        json.loads(args.baseline.read_text()),
+        json.loads(args.candidate.read_text()),
+        args.threshold,
+    )
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
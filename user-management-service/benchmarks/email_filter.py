@@ -0,0 +1,107 @@
+"""
+Count the database queries and the bcrypt hashes the email filter saves on a
+registration workload.
+
+The filter is filled with `--registered` emails, then `--requests`
+registrations are simulated, `--duplicates` of them for already registered
+emails. Three strategies are compared:
+- `always_check`: check the email before hashing the password on every request.
+- `filter_off`: hash and insert right away, duplicates are caught by the insert.
+- `filter_on`: check only the emails the filter reports as possibly registered,
+  the others are hashed and inserted right away.
+Every strategy inserts the new emails, the duplicates are only inserted (and
+rejected by the insert) when they aren't checked first.
+
+Usage:
+    python -m benchmarks.email_filter --registered 1000000 --requests 100000 --duplicates 0.05
+"""
+
+import argparse
+import random
+import tempfile
+import time
+import uuid
+from multiprocessing import shared_memory
+
+from app.email_filter import EmailFilter
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--registered", type=int, default=1_000_000)
+    parser.add_argument("--requests", type=int, default=100_000)
+    parser.add_argument("--duplicates", type=float, default=0.05)
+    parser.add_argument("--capacity", type=int, default=1_000_000)
+    parser.add_argument("--false-positive-rate", type=float, default=0.01)
+    args = parser.parse_args()
+
+    email_filter = EmailFilter(
+        name=f"email-filter-bench-{uuid.uuid4().hex[:8]}",
+        capacity=args.capacity,
+        false_positive_rate=args.false_positive_rate,
+    )
+    # Skip the build from the database, the emails are added below.
+    email_filter._memory = shared_memory.SharedMemory(
+        name=email_filter.name, create=True, size=email_filter.memory_bytes
+    )
+    email_filter._created = True
+    email_filter._lock_file = tempfile.TemporaryFile()
+    try:
+        started = time.perf_counter()
+        email_filter.add(
+            *(f"registered-{i}@example.com" for i in range(args.registered))
+        )
+        build_seconds = time.perf_counter() - started
+        email_filter._memory.buf[0] = 1
+
+        requests = []
+        for i in range(args.requests):
+            if random.random() < args.duplicates:
+                email = f"registered-{random.randrange(args.registered)}@example.com"
+                requests.append((email, True))
+            else:
+                requests.append((f"new-{i}@example.com", False))
+
+        started = time.perf_counter()
+        possible_hits = [email_filter.might_contain(email) for email, _ in requests]
+        lookup_seconds = time.perf_counter() - started
+    finally:
+        email_filter.close()
+
+    duplicates = sum(1 for _, registered in requests if registered)
+    new = len(requests) - duplicates
+    false_positives = sum(
+        1
+        for hit, (_, registered) in zip(possible_hits, requests)
+        if hit and not registered
+    )
+    checks = sum(possible_hits)
+    print(
+        {
+            "memory_bytes": email_filter.memory_bytes,
+            "hashes": email_filter.hashes,
+            "build_seconds": round(build_seconds, 3),
+            "lookup_us": round(lookup_seconds / len(requests) * 1e6, 2),
+            "false_positive_rate": round(false_positives / new, 4) if new else 0,
+        }
+    )
+    for strategy, checks, inserts in (
+        ("always_check", len(requests), new),
+        ("filter_off", 0, len(requests)),
+        ("filter_on", checks, new),
+    ):
+        print(
+            {
+                "strategy": strategy,
+                "existence_checks": checks,
+                "inserts": inserts,
+                "queries_per_registration": round(
+                    (checks + inserts) / len(requests), 3
+                ),
+                "bcrypt_hashes": inserts,
+            }
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+"""
+End to end load test of `/register` and `/activate`.
+
+By default the user management service and a stand-in email service
+(`benchmarks.stub_email_service`) are started as subprocesses against the
+Postgres database configured by the usual `POSTGRES_*` env variables. Pass
+`--url` to load an already running service instead, `--stub-url` must then
+point to the stub it sends its emails to.
+
+`--users` accounts are registered, then the registered ones are activated
+with the code read back from the stub. Requests are sent by `--concurrency`
+clients back to back, or at a constant `--rate` of requests per second. The
+throughput and latency percentiles of each phase are printed and saved as
+JSON in `--output` so runs can be compared with
+`python -m benchmarks.compare`.
+
+The rate limits of the admission control are disabled in the spawned service
+since all the requests come from the same IP.
+
+Usage:
+    python -m benchmarks.load_test --users 500 --concurrency 50 --email-latency 50
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+
+RESULTS_DIR = Path(__file__).parent / "results"
+PASSWORD = "benchmark-password"
+
+
+def percentile(latencies: list, percent: float) -> float:
+    index = max(0, min(len(latencies) - 1, round(len(latencies) * percent / 100) - 1))
+    return round(latencies[index] * 1000, 2)
+
+
+def summarize(phase: str, results: list, elapsed: float) -> dict:
+    latencies = sorted(latency for _, latency in results)
+    statuses = Counter(str(status_code) for status_code, _ in results)
+    ok = sum(1 for status_code, _ in results if status_code == 200)
+    summary = {
+        "phase": phase,
+        "requests": len(results),
+        "ok": ok,
+        "statuses": dict(statuses),
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(ok / elapsed, 1) if elapsed else 0,
+        "p50_ms": percentile(latencies, 50) if latencies else None,
+        "p95_ms": percentile(latencies, 95) if latencies else None,
+        "p99_ms": percentile(latencies, 99) if latencies else None,
+        "mean_ms": (
+            round(statistics.fmean(latencies) * 1000, 2) if latencies else None
+        ),
+    }
+    print(summary)
+    return summary
+
+
+async def drive(args, requests: list) -> tuple:
+    """
+    Run the `requests` coroutine factories at the configured concurrency or
+    rate, return their `(status_code, latency)` and the elapsed time.
+    """
+    results = []
+
+    async def timed(request):
+        started = time.perf_counter()
+        try:
+            status_code = await request()
+        except httpx.HTTPError as e:
+            status_code = type(e).__name__
+        results.append((status_code, time.perf_counter() - started))
+
+    started = time.perf_counter()
+    if args.rate:
+        tasks = []
+        for i, request in enumerate(requests):
+            delay = started + i / args.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(timed(request)))
+        await asyncio.gather(*tasks)
+    else:
+        queue = iter(requests)
+
+        async def client():
+            for request in queue:
+                await timed(request)
+
+        await asyncio.gather(*(client() for _ in range(args.concurrency)))
+    return results, time.perf_counter() - started
+
+
+async def get_code(stub: httpx.AsyncClient, email: str, timeout: float) -> str:
+    # The activation emails are delivered in the background by the outbox.
+    deadline = time.monotonic() + timeout
+    while True:
+        response = await stub.get(f"/codes/{email}")
+        if response.status_code == 200:
+            return response.json()["code"]
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"No activation code received for {email}")
+        await asyncio.sleep(0.1)
+
+
+async def run(args) -> list:
+    run_id = uuid.uuid4().hex[:8]
+    emails = [f"load-{run_id}-{i}@example.com" for i in range(args.users)]
+    limits = httpx.Limits(max_connections=max(args.concurrency, 100))
+    async with httpx.AsyncClient(
+        base_url=args.url, limits=limits, timeout=args.timeout
+    ) as client, httpx.AsyncClient(base_url=args.stub_url) as stub:
+
+        registered = []
+
+        def register(email):
+            async def request():
+                response = await client.post(
+                    "/api/v1/users/register",
+                    json={"email": email, "password": PASSWORD},
+                )
+                if response.status_code == 200:
+                    registered.append(email)
+                return response.status_code
+
+            return request
+
+        results, elapsed = await drive(args, [register(email) for email in emails])
+        phases = [summarize("register", results, elapsed)]
+
+        # Only the accounts registered successfully can be activated.
+        codes = dict(
+            zip(
+                registered,
+                await asyncio.gather(
+                    *(get_code(stub, email, args.code_timeout) for email in registered)
+                ),
+            )
+        )
+
+        def activate(email):
+            async def request():
+                response = await client.post(
+                    "/api/v1/users/activate",
+                    json={"code": codes[email]},
+                    auth=(email, PASSWORD),
+                )
+                return response.status_code
+
+            return request
+
+        results, elapsed = await drive(args, [activate(email) for email in registered])
+        phases.append(summarize("activate", results, elapsed))
+    return phases
+
+
+def wait_until_ready(url: str, process: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{process.args} exited with {process.returncode}")
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise TimeoutError(f"{url} is not ready after {timeout} seconds")
+
+
+def spawn_services(args) -> list:
+    stub = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.stub_email_service",
+            "--port",
+            str(args.stub_port),
+            "--latency",
+            str(args.email_latency),
+            "--jitter",
+            str(args.email_jitter),
+            "--failure-rate",
+            str(args.email_failure_rate),
+        ]
+    )
+    env = {
+        **os.environ,
+        "EMAIL_SERVICE_URL": f"{args.stub_url}/api/v1/emails/send",
+        "API_KEY": os.environ.get("API_KEY", "benchmark"),
+        "ADMISSION_REGISTER_IP_RATE": "0",
+        "ADMISSION_REGISTER_EMAIL_RATE": "0",
+        "ADMISSION_ACTIVATE_IP_RATE": "0",
+        "ADMISSION_ACTIVATE_EMAIL_RATE": "0",
+    }
+    service = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "app.main:app",
+            "--port",
+            str(args.port),
+            "--workers",
+            str(args.workers),
+            "--log-level",
+            "warning",
+        ],
+        env=env,
+    )
+    processes = [stub, service]
+    try:
+        wait_until_ready(f"{args.stub_url}/health", stub)
+        wait_until_ready(f"{args.url}/api/v1/monitoring/stats", service)
+    except Exception:
+        stop_services(processes)
+        raise
+    return processes
+
+
+def stop_services(processes: list):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument(
+        "--rate", type=float, default=None, help="Requests per second, open loop."
+    )
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--code-timeout", type=float, default=60.0)
+    parser.add_argument("--url", default=None, help="Load a running service.")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--stub-url", default=None)
+    parser.add_argument("--stub-port", type=int, default=8101)
+    parser.add_argument("--email-latency", type=float, default=50.0)
+    parser.add_argument("--email-jitter", type=float, default=0.0)
+    parser.add_argument("--email-failure-rate", type=float, default=0.0)
+    parser.add_argument("--output", type=Path, default=None)
+    args = parser.parse_args()
+    args.stub_url = args.stub_url or f"http://127.0.0.1:{args.stub_port}"
+
+    processes = []
+    if args.url is None:
+        args.url = f"http://127.0.0.1:{args.port}"
+        processes = spawn_services(args)
+    try:
+        phases = asyncio.run(run(args))
+    finally:
+        stop_services(processes)
+
+    started_at = datetime.now(timezone.utc)
+    result = {
+        "started_at": started_at.isoformat(),
+        "commit": git_commit(),
+        "config": {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("output", "url", "stub_url")
+        },
+        "phases": phases,
+    }
+    output = args.output or RESULTS_DIR / f"{started_at:%Y%m%dT%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, indent=2))
+    print(f"Results saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Compare the per query latency of the repository hot queries sent as plain SQL
+and as prepared statements.
+
+Each query runs `--iterations` times in a row on a single connection, the
+lookups against `--users` users inserted first. The inserts and activations
+commit after each execution, only the execution itself is timed. psycopg's
+automatic preparation is disabled for the plain SQL run.
+
+Usage:
+    python -m benchmarks.prepared_statements --iterations 2000
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+
+import psycopg
+from psycopg.rows import dict_row
+
+from app.prepared import PreparedStatements
+from app.users import activation_codes, repository
+
+
+async def timed(statements, db, query: str, params_list: list, commit: bool) -> list:
+    latencies = []
+    async with db.cursor() as cursor:
+        for params in params_list:
+            started = time.perf_counter()
+            await statements.execute(cursor, query, params)
+            await cursor.fetchall()
+            latencies.append(time.perf_counter() - started)
+            if commit:
+                await db.commit()
+    await db.commit()
+    return latencies
+
+
+async def run(prepared: bool, args) -> dict:
+    statements = PreparedStatements(enabled=prepared)
+    prefix = f"prepared-bench-{uuid.uuid4().hex[:8]}-"
+    emails = [f"{prefix}{i}@example.com" for i in range(args.iterations)]
+    lookups = [(emails[i % args.users],) for i in range(args.iterations)]
+    async with await psycopg.AsyncConnection.connect(
+        args.dsn, row_factory=dict_row
+    ) as db:
+        if not prepared:
+            db.prepare_threshold = None
+        try:
+            inserted = await timed(
+                statements,
+                db,
+                activation_codes.INSERT_USER,
+                [
+                    {
+                        "email": email,
+                        "password_hash": "hash",
+                        "code": "1234",
+                        "ttl": repository.ACTIVATION_CODE_TTL,
+                        "code_in_database": True,
+                    }
+                    for email in emails
+                ],
+                commit=True,
+            )
+            results = {
+                "insert": inserted,
+                "lookup": await timed(
+                    statements, db, repository.SELECT_USER, lookups, commit=False
+                ),
+                "lookup_with_password": await timed(
+                    statements,
+                    db,
+                    repository.SELECT_USER_WITH_PASSWORD,
+                    lookups,
+                    commit=False,
+                ),
+                "email_exists": await timed(
+                    statements, db, repository.EMAIL_EXISTS, lookups, commit=False
+                ),
+            }
+            cursor = await db.execute(
+                "SELECT id FROM users WHERE email LIKE %s;", (prefix + "%",)
+            )
+            user_ids = [row["id"] for row in await cursor.fetchall()]
+            results["activate"] = await timed(
+                statements,
+                db,
+                activation_codes.ACTIVATE_USER,
+                [
+                    {
+                        "user_id": user_id,
+                        "code": "1234",
+                        "checked": False,
+                        "is_valid": None,
+                    }
+                    for user_id in user_ids
+                ],
+                commit=True,
+            )
+        finally:
+            await db.rollback()
+            await db.execute("DELETE FROM users WHERE email LIKE %s;", (prefix + "%",))
+            await db.execute(
+                "DELETE FROM email_outbox WHERE email LIKE %s;", (prefix + "%",)
+            )
+            await db.commit()
+    return {
+        query: {
+            "mean_us": round(statistics.mean(latencies) * 1e6, 1),
+            "p50_us": round(statistics.median(latencies) * 1e6, 1),
+        }
+        for query, latencies in results.items()
+    }
+
+
+def main():
+    from app.postgres import postgres
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--dsn", default=postgres.database_url)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=1000)
+    args = parser.parse_args()
+
+    plain = asyncio.run(run(prepared=False, args=args))
+    prepared = asyncio.run(run(prepared=True, args=args))
+    print(f"{'query':<22}{'plain p50 us':>14}{'prepared p50 us':>17}{'gain':>8}")
+    for query in plain:
+        before, after = plain[query]["p50_us"], prepared[query]["p50_us"]
+        gain = (before - after) / before * 100
+        print(f"{query:<22}{before:>14}{after:>17}{gain:>7.1f}%")
+
+
+if __name__ == "__main__":
+    main()
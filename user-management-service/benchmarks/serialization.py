@@ -0,0 +1,82 @@
+"""
+Compare the CPU time per request of returning a user through the validated
+path (`UserModel(**row)` validated and serialized again by FastAPI against the
+response model) and the fast path (`UserModel.model_construct(**row)` returned
+in an `ORJSONResponse`).
+
+The rows are served from memory through the ASGI transport so only the
+framework and serialization work is measured.
+
+Usage:
+    python -m benchmarks.serialization --requests 20000
+"""
+
+import argparse
+import asyncio
+import time
+
+import httpx
+from fastapi import FastAPI
+
+from app.responses import ORJSONResponse
+from app.users.schemas import UserModel
+
+ROW = {"id": 42, "email": "benchmark@example.com", "is_active": True}
+
+
+def build_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/validated")
+    async def validated() -> UserModel:
+        return UserModel(**ROW)
+
+    @app.get("/fast", response_model=UserModel)
+    async def fast() -> ORJSONResponse:
+        return ORJSONResponse(UserModel.model_construct(**ROW).model_dump())
+
+    return app
+
+
+async def run(path: str, args) -> dict:
+    transport = httpx.ASGITransport(app=build_app())
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench"
+    ) as client:
+        for _ in range(args.warmup):
+            await client.get(path)
+        started, cpu_started = time.perf_counter(), time.process_time()
+        for _ in range(args.requests):
+            response = await client.get(path)
+            assert response.json() == ROW
+        elapsed = time.perf_counter() - started
+        cpu = time.process_time() - cpu_started
+    return {
+        "path": path.strip("/"),
+        "requests": args.requests,
+        "cpu_us_per_request": round(cpu / args.requests * 1e6, 1),
+        "throughput_rps": round(args.requests / elapsed, 1),
+    }
+
+
+def report(result: dict) -> dict:
+    print(result)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--warmup", type=int, default=1000)
+    args = parser.parse_args()
+
+    validated = report(asyncio.run(run("/validated", args)))
+    fast = report(asyncio.run(run("/fast", args)))
+    print(
+        "CPU per request reduced by "
+        f"{1 - fast['cpu_us_per_request'] / validated['cpu_us_per_request']:.1%}"
+    )
+
+
+if __name__ == "__main__":
+    main()
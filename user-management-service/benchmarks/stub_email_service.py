@@ -0,0 +1,71 @@
+"""
+Stand-in for the email service used by the load tests.
+
+It answers `POST /api/v1/emails/send` after `--latency` milliseconds (plus up
+to `--jitter` milliseconds), fails a `--failure-rate` share of the requests
+with a 503 and keeps the last activation code sent to each email so the load
+driver can activate the accounts.
+
+Usage:
+    python -m benchmarks.stub_email_service --port 8101 --latency 50
+"""
+
+import argparse
+import asyncio
+import random
+
+import uvicorn
+from fastapi import FastAPI, HTTPException, status
+from pydantic import BaseModel
+
+app = FastAPI()
+app.state.latency = 0.0
+app.state.jitter = 0.0
+app.state.failure_rate = 0.0
+codes = {}
+
+
+class EmailRequest(BaseModel):
+    email: str
+    code: str
+
+
+@app.post("/api/v1/emails/send")
+async def send_email(email_request: EmailRequest):
+    await asyncio.sleep(
+        (app.state.latency + random.uniform(0, app.state.jitter)) / 1000
+    )
+    if random.random() < app.state.failure_rate:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+    codes[email_request.email] = email_request.code
+    return {"message": "Email sent successfully"}
+
+
+@app.get("/codes/{email}")
+async def get_code(email: str):
+    if email not in codes:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    return {"code": codes[email]}
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8101)
+    parser.add_argument("--latency", type=float, default=50.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    app.state.latency = args.latency
+    app.state.jitter = args.jitter
+    app.state.failure_rate = args.failure_rate
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
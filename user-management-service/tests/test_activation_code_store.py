@@ -0,0 +1,143 @@
+import asyncio
+
+import psycopg
+import pytest
+from app.users import repository
+from app.users.activation_codes import (
+    MemoryActivationCodeStore,
+    PostgresActivationCodeStore,
+    RedisActivationCodeStore,
+)
+from fakeredis import FakeAsyncRedis
+from psycopg.rows import dict_row
+
+from .conftest import mock_postgres
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_memory_store_expires_codes_with_a_heap():
+    clock = Clock()
+    store = MemoryActivationCodeStore(ttl=60, expired_grace=3600, clock=clock)
+
+    async def scenario():
+        await store.save(1, "1234")
+        await store.save(2, "5678")
+        assert await store.check(1, "1234") is True
+        assert await store.check(1, "0000") is None
+        clock.now = 61
+        assert await store.check(1, "1234") is False
+        clock.now = 3661
+        assert await store.check(1, "1234") is None
+        assert store.stats()["users"] == 0
+        assert store.stats()["pending_expirations"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_memory_store_keeps_codes_saved_again():
+    clock = Clock()
+    store = MemoryActivationCodeStore(ttl=60, expired_grace=0, clock=clock)
+
+    async def scenario():
+        await store.save(1, "1234")
+        clock.now = 30
+        await store.save(1, "1234")
+        clock.now = 61
+        # The first expiration is due but the code was saved again since.
+        assert await store.check(1, "1234") is True
+        await store.consume(1)
+        assert await store.check(1, "1234") is None
+
+    asyncio.run(scenario())
+
+
+def test_redis_store():
+    async def scenario():
+        store = RedisActivationCodeStore(
+            "redis://unused", ttl=60, expired_grace=3600, client=FakeAsyncRedis()
+        )
+        await store.save(1, "1234")
+        assert await store.check(1, "1234") is True
+        assert await store.check(1, "0000") is None
+        ttl = await store.client.ttl("activation_codes:1")
+        assert 3600 < ttl <= 3661
+        store.ttl = -1
+        await store.save(1, "4321")
+        assert await store.check(1, "4321") is False
+        await store.consume(1)
+        assert await store.check(1, "1234") is None
+        await store.close()
+
+    asyncio.run(scenario())
+
+
+def test_postgres_store():
+    store = PostgresActivationCodeStore(ttl=60, expired_grace=3600)
+
+    async def scenario():
+        async with await psycopg.AsyncConnection.connect(
+            mock_postgres.database_url, row_factory=dict_row
+        ) as db:
+            cursor = await db.execute(
+                "INSERT INTO users (email, password_hash) VALUES (%s, %s) RETURNING id;",
+                ("store_postgres_codes@gmail.com", "hash"),
+            )
+            user_id = (await cursor.fetchone())["id"]
+            await store.save(user_id, "1234", db=db)
+            assert await store.check(user_id, "1234", db=db) is True
+            assert await store.check(user_id, "0000", db=db) is None
+            assert await store.valid_code(user_id, 30, db=db) == "1234"
+            assert await store.valid_code(user_id, 90, db=db) is None
+            await store.consume(user_id, db=db)
+            assert await store.check(user_id, "1234", db=db) is None
+            await db.rollback()
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("store_factory", ["memory", "redis"])
+def test_register_and_activate_with_a_store(
+    client, mock_post_request, monkeypatch, store_factory
+):
+    if store_factory == "memory":
+        store = MemoryActivationCodeStore(ttl=60, expired_grace=3600)
+    else:
+        store = RedisActivationCodeStore(
+            "redis://unused", ttl=60, expired_grace=3600, client=FakeAsyncRedis()
+        )
+    monkeypatch.setattr(repository, "activation_code_store", store)
+    email = f"store_{store_factory}@gmail.com"
+    credentials = (email, "testtest")
+    response = client.post(
+        "api/v1/users/register", json={"email": email, "password": "testtest"}
+    )
+    user_id = response.json()["id"]
+    with psycopg.connect(mock_postgres.database_url) as connection:
+        code = connection.execute(
+            "SELECT code FROM email_outbox WHERE email = %s;", (email,)
+        ).fetchone()[0]
+        stored_codes = connection.execute(
+            "SELECT count(*) FROM activation_codes WHERE user_id = %s;", (user_id,)
+        ).fetchone()[0]
+    assert stored_codes == 0
+
+    wrong_code = "0000" if code != "0000" else "1111"
+    response = client.post(
+        "api/v1/users/activate", json={"code": wrong_code}, auth=credentials
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid activation code"
+
+    response = client.post(
+        "api/v1/users/activate", json={"code": code}, auth=credentials
+    )
+    assert response.status_code == 200
+    assert response.json()["is_active"] is True
+    assert asyncio.run(store.check(user_id, code)) is None
@@ -0,0 +1,106 @@
+from app.main import app
+from app.users.admission import (
+    AdmissionControl,
+    TokenBucketLimiter,
+    activate_admission,
+    register_admission,
+)
+
+
+def create_admission(**limits):
+    settings = {
+        "max_concurrency": 0,
+        "ip_rate": 0,
+        "ip_burst": 0,
+        "email_rate": 0,
+        "email_burst": 0,
+        "max_keys": 100,
+    }
+    settings.update(limits)
+    return AdmissionControl(**settings)
+
+
+def test_token_bucket_limits_each_key():
+    limiter = TokenBucketLimiter(rate=0.5, burst=2, max_keys=2)
+    assert limiter.acquire("a") is None
+    assert limiter.acquire("a") is None
+    assert 1.9 < limiter.acquire("a") <= 2
+    assert limiter.acquire("b") is None
+
+    # "a" is the least recently seen key and is forgotten.
+    limiter.acquire("c")
+    assert limiter.acquire("a") is None
+
+
+def test_register_is_rate_limited_by_email(client):
+    admission = create_admission(email_rate=0.1, email_burst=1)
+    app.dependency_overrides[register_admission] = admission
+
+    user_data = {"email": "admission_1@gmail.com", "password": "testtest"}
+    assert client.post("api/v1/users/register", json=user_data).status_code == 200
+
+    user_data["email"] = "Admission_1@gmail.com"
+    response = client.post("api/v1/users/register", json=user_data)
+    assert response.status_code == 429
+    assert 0 < int(response.headers["Retry-After"]) <= 10
+
+    user_data["email"] = "admission_2@gmail.com"
+    assert client.post("api/v1/users/register", json=user_data).status_code == 200
+    assert admission.stats()["rate_limited"] == 1
+    assert admission.stats()["in_flight"] == 0
+
+
+def test_activate_is_shed_over_the_concurrency_limit(client):
+    admission = create_admission(max_concurrency=1)
+    app.dependency_overrides[activate_admission] = admission
+
+    admission._in_flight = 1
+    response = client.post(
+        "api/v1/users/activate",
+        json={"code": "1234"},
+        auth=("admission_3@gmail.com", "testtest"),
+    )
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert admission.stats()["shed"] == 1
+
+    admission._in_flight = 0
+    response = client.post(
+        "api/v1/users/activate",
+        json={"code": "1234"},
+        auth=("admission_3@gmail.com", "testtest"),
+    )
+    assert response.status_code == 404
+    assert admission.stats()["in_flight"] == 0
+
+
+def test_activate_is_rate_limited_by_email_after_the_credentials(
+    client, mock_post_request
+):
+    credentials = ("admission_4@gmail.com", "testtest")
+    client.post(
+        "api/v1/users/register",
+        json={"email": credentials[0], "password": credentials[1]},
+    )
+    admission = create_admission(email_rate=0.1, email_burst=1)
+    app.dependency_overrides[activate_admission] = admission
+
+    # Wrong passwords don't use the bucket of the account they target.
+    for _ in range(3):
+        response = client.post(
+            "api/v1/users/activate",
+            json={"code": "0000"},
+            auth=(credentials[0], "wrong-password"),
+        )
+        assert response.status_code == 401
+
+    # 0000 is never generated, the codes are between 1000 and 9999.
+    response = client.post(
+        "api/v1/users/activate", json={"code": "0000"}, auth=credentials
+    )
+    assert response.status_code == 400
+    response = client.post(
+        "api/v1/users/activate", json={"code": "0000"}, auth=credentials
+    )
+    assert response.status_code == 429
+    assert admission.stats()["rate_limited"] == 1
@@ -0,0 +1,123 @@
+import csv
+import json
+
+import psycopg
+from app.bulk_import import BulkImporter, read_records
+from app.users.utils import hash_password, verify_password
+from psycopg.rows import dict_row
+
+from .conftest import mock_postgres
+
+PASSWORD_HASH = hash_password("testtest")
+
+
+def write_csv(path, rows):
+    with path.open("w", newline="") as file:
+        writer = csv.DictWriter(
+            file, fieldnames=["email", "password", "password_hash", "is_active"]
+        )
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def get_user(email):
+    with psycopg.connect(
+        mock_postgres.database_url, row_factory=dict_row
+    ) as connection:
+        return connection.execute(
+            "SELECT * FROM users WHERE email = %s;", (email,)
+        ).fetchone()
+
+
+def count_codes(email):
+    with psycopg.connect(mock_postgres.database_url) as connection:
+        return connection.execute(
+            """
+            SELECT
+                (SELECT count(*) FROM activation_codes JOIN users ON users.id = user_id WHERE email = %(email)s),
+                (SELECT count(*) FROM email_outbox WHERE email = %(email)s);
+            """,
+            {"email": email},
+        ).fetchone()
+
+
+def test_bulk_import_reports_conflicts_and_invalid_records(tmp_path):
+    existing = {"email": "import_existing@gmail.com", "password_hash": PASSWORD_HASH}
+    write_csv(tmp_path / "existing.csv", [existing])
+    BulkImporter(mock_postgres.database_url, rounds=4).run(
+        read_records(tmp_path / "existing.csv")
+    )
+
+    write_csv(
+        tmp_path / "users.csv",
+        [
+            {"email": "import_plain@gmail.com", "password": "testtest"},
+            {"email": "import_hashed@gmail.com", "password_hash": PASSWORD_HASH},
+            {
+                "email": "import_active@gmail.com",
+                "password_hash": PASSWORD_HASH,
+                "is_active": "true",
+            },
+            existing,
+            {"email": "import_hashed@gmail.com", "password_hash": PASSWORD_HASH},
+            {"email": "not-an-email", "password": "testtest"},
+            {"email": "import_weak@gmail.com", "password_hash": "not-a-hash"},
+        ],
+    )
+    importer = BulkImporter(
+        mock_postgres.database_url,
+        chunk_size=3,
+        rounds=4,
+        activation_codes=True,
+        conflicts_path=tmp_path / "conflicts.csv",
+    )
+    summary = importer.run(read_records(tmp_path / "users.csv"))
+
+    assert summary["records"] == 7
+    assert summary["imported"] == 3
+    assert summary["conflicts"] == 2
+    assert summary["invalid"] == 2
+    with (tmp_path / "conflicts.csv").open() as file:
+        report = sorted((int(row[0]), row[2]) for row in csv.reader(file))
+    assert report == [(4, "conflict"), (5, "conflict"), (6, "invalid"), (7, "invalid")]
+
+    plain = get_user("import_plain@gmail.com")
+    assert verify_password("testtest", plain["password_hash"])
+    assert plain["password_hash"].startswith("$2b$04$")
+    assert not plain["is_active"]
+    assert get_user("import_hashed@gmail.com")["password_hash"] == PASSWORD_HASH
+    assert get_user("import_active@gmail.com")["is_active"]
+    assert count_codes("import_plain@gmail.com") == (1, 1)
+    assert count_codes("import_active@gmail.com") == (0, 0)
+
+
+def test_bulk_import_resumes_from_checkpoint(tmp_path):
+    source = tmp_path / "users.ndjson"
+    source.write_text(
+        "\n".join(
+            json.dumps(
+                {
+                    "email": f"import_resume_{i}@gmail.com",
+                    "password_hash": PASSWORD_HASH,
+                }
+            )
+            for i in range(5)
+        )
+    )
+    checkpoint = tmp_path / "import.checkpoint"
+    checkpoint.write_text(json.dumps({"record": 3}))
+
+    importer = BulkImporter(
+        mock_postgres.database_url,
+        chunk_size=2,
+        rounds=4,
+        checkpoint_path=checkpoint,
+    )
+    summary = importer.run(read_records(source))
+
+    assert summary["records"] == 2
+    assert summary["imported"] == 2
+    assert json.loads(checkpoint.read_text()) == {"record": 5}
+    assert get_user("import_resume_2@gmail.com") is None
+    assert get_user("import_resume_3@gmail.com") is not None
+    assert get_user("import_resume_4@gmail.com") is not None
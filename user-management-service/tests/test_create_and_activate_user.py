@@ -1,10 +1,13 @@
+import asyncio
 from datetime import datetime
 
-import psycopg2
-from app.users.repository import get_user_by_email
+import psycopg
+from app.users.repository import activate_user, create_user
+from app.users.schemas import ActivationResult, UserRegistrationModel
+from app.users.utils import password_hasher
 from fastapi.security import HTTPBasicCredentials
 from freezegun import freeze_time
-from psycopg2.extras import RealDictCursor
+from psycopg.rows import dict_row
 
 from .conftest import MockPostgres
 
@@ -93,8 +96,8 @@ def test_create_and_activate_user(client, mock_post_request):
     response_data = response.json()
     assert response_data["is_active"] == False
 
-    with psycopg2.connect(
-        mock_postgres.database_url, cursor_factory=RealDictCursor
+    with psycopg.connect(
+        mock_postgres.database_url, row_factory=dict_row
     ) as connection:
         with connection.cursor() as cursor:
             cursor.execute(
@@ -125,8 +128,8 @@ def test_create_and_activate_user_with_wrong_code(client, mock_post_request):
     response_data = response.json()
     assert response_data["is_active"] == False
 
-    with psycopg2.connect(
-        mock_postgres.database_url, cursor_factory=RealDictCursor
+    with psycopg.connect(
+        mock_postgres.database_url, row_factory=dict_row
     ) as connection:
         with connection.cursor() as cursor:
             cursor.execute(
@@ -153,17 +156,18 @@ def test_activate_user_an_active_user(client, mock_post_request):
         username=user_data["email"], password=user_data["password"]
     )
 
-    with psycopg2.connect(
-        mock_postgres.database_url, cursor_factory=RealDictCursor
+    # The activation codes are consumed on activation.
+    with psycopg.connect(
+        mock_postgres.database_url, row_factory=dict_row
     ) as connection:
-        user = get_user_by_email(email=user_data["email"], db=connection)
         with connection.cursor() as cursor:
             cursor.execute(
-                "SELECT * FROM activation_codes WHERE user_id = %s;",
-                (user.id,),
+                "SELECT count(*) AS count FROM activation_codes "
+                "JOIN users ON users.id = activation_codes.user_id WHERE email = %s;",
+                (user_data["email"],),
             )
-            code = cursor.fetchone()
-    activation_code = {"code": code["code"]}
+            assert cursor.fetchone()["count"] == 0
+    activation_code = {"code": "0000"}
 
     response = client.post(
         "api/v1/users/activate",
@@ -186,22 +190,99 @@ def test_create_and_activate_user_after_code_expiration(client, mock_post_reques
     response_data = response.json()
     assert response_data["is_active"] == False
 
-    with psycopg2.connect(
-        mock_postgres.database_url, cursor_factory=RealDictCursor
+    with psycopg.connect(
+        mock_postgres.database_url, row_factory=dict_row
     ) as connection:
         with connection.cursor() as cursor:
+            # The expiration is checked against the database clock.
             cursor.execute(
-                "SELECT * FROM activation_codes WHERE user_id = %s;",
+                "UPDATE activation_codes SET expires_at = now() - interval '1 minute' "
+                "WHERE user_id = %s RETURNING code;",
                 (response_data["id"],),
             )
             code = cursor.fetchone()
     activation_code = {"code": code["code"]}
-    with freeze_time("2024-10-20 12:02:00"):
-        response = client.post(
-            "api/v1/users/activate",
-            json=activation_code,
-            auth=(credentials.username, credentials.password),
+    response = client.post(
+        "api/v1/users/activate",
+        json=activation_code,
+        auth=(credentials.username, credentials.password),
+    )
+    response_data = response.json()
+    assert response.status_code == 400
+    assert response_data["detail"] == "Activation code has expired"
+
+
+def test_concurrent_registrations_with_the_same_email():
+    async def register():
+        connection = await psycopg.AsyncConnection.connect(
+            mock_postgres.database_url, row_factory=dict_row
         )
-        response_data = response.json()
-        assert response.status_code == 400
-        assert response_data["detail"] == "Activation code has expired"
+        try:
+            user = UserRegistrationModel(
+                email="test_race@gmail.com", password="testtest"
+            )
+            return await create_user(user=user, db=connection)
+        finally:
+            await connection.close()
+
+    async def scenario():
+        await password_hasher.start()
+        try:
+            return await asyncio.gather(*(register() for _ in range(5)))
+        finally:
+            password_hasher.shutdown()
+
+    users = asyncio.run(scenario())
+    created = [user for user in users if user is not None]
+    assert len(created) == 1
+
+    with psycopg.connect(
+        mock_postgres.database_url, row_factory=dict_row
+    ) as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT count(*) AS count FROM activation_codes WHERE user_id = %s;",
+                (created[0].id,),
+            )
+            assert cursor.fetchone()["count"] == 1
+            cursor.execute(
+                "SELECT count(*) AS count FROM email_outbox WHERE email = %s;",
+                ("test_race@gmail.com",),
+            )
+            assert cursor.fetchone()["count"] == 1
+
+
+def test_concurrent_activations_with_the_same_code(client, mock_post_request):
+    user_data = {"email": "test_4@gmail.com", "password": "testtest"}
+    response = client.post("api/v1/users/register", json=user_data)
+    user_id = response.json()["id"]
+    with psycopg.connect(
+        mock_postgres.database_url, row_factory=dict_row
+    ) as connection:
+        code = connection.execute(
+            "SELECT code FROM activation_codes WHERE user_id = %s;", (user_id,)
+        ).fetchone()["code"]
+
+    async def activate():
+        connection = await psycopg.AsyncConnection.connect(
+            mock_postgres.database_url, row_factory=dict_row
+        )
+        try:
+            result, _ = await activate_user(user_id=user_id, code=code, db=connection)
+            return result
+        finally:
+            await connection.close()
+
+    async def scenario():
+        return await asyncio.gather(*(activate() for _ in range(5)))
+
+    results = asyncio.run(scenario())
+    assert results.count(ActivationResult.ACTIVATED) == 1
+    assert results.count(ActivationResult.ALREADY_ACTIVE) == 4
+
+
+def test_user_responses_are_documented_with_the_user_model(client):
+    paths = client.get("/users/openapi.json").json()["paths"]
+    for path in ("/api/v1/users/register", "/api/v1/users/activate"):
+        schema = paths[path]["post"]["responses"]["200"]["content"]["application/json"]
+        assert schema["schema"] == {"$ref": "#/components/schemas/UserModel"}
@@ -0,0 +1,110 @@
+import asyncio
+import uuid
+
+import psycopg
+from app.email_filter import HEADER_SIZE, EmailFilter
+from app.users import endpoints
+from app.users.utils import password_hasher
+from psycopg.rows import dict_row
+
+from .conftest import mock_postgres
+
+
+def create_filter(name, capacity=1000):
+    return EmailFilter(name=name, capacity=capacity, false_positive_rate=0.01)
+
+
+def open_filter(email_filter):
+    async def scenario():
+        async with await psycopg.AsyncConnection.connect(
+            mock_postgres.database_url, row_factory=dict_row
+        ) as connection:
+            await email_filter.open(connection)
+
+    asyncio.run(scenario())
+
+
+def test_email_filter_is_sized_for_the_false_positive_rate():
+    email_filter = create_filter("unused", capacity=1_000_000)
+    assert email_filter.size_bits == 9_585_059
+    assert email_filter.hashes == 7
+    assert email_filter.memory_bytes == 1_198_141
+
+
+def test_email_filter_is_built_from_users_and_shared(client):
+    user_data = {"email": "filter_1@gmail.com", "password": "testtest"}
+    assert client.post("api/v1/users/register", json=user_data).status_code == 200
+
+    name = f"email-filter-test-{uuid.uuid4().hex[:8]}"
+    email_filter = create_filter(name)
+    attached = create_filter(name)
+    open_filter(email_filter)
+    open_filter(attached)
+    try:
+        assert email_filter.ready and attached.ready
+        assert email_filter.might_contain("filter_1@gmail.com")
+        misses = [
+            not email_filter.might_contain(f"filter_new_{i}@gmail.com")
+            for i in range(100)
+        ]
+        assert sum(misses) >= 90
+
+        email_filter.add("filter_2@gmail.com")
+        assert attached.might_contain("filter_2@gmail.com")
+
+        # Only the worker that created the segment unlinks it.
+        attached.close()
+        reattached = create_filter(name)
+        open_filter(reattached)
+        assert reattached.might_contain("filter_2@gmail.com")
+        reattached.close()
+    finally:
+        attached.close()
+        email_filter.close()
+
+
+def test_register_checks_possible_duplicates_before_hashing(client, monkeypatch):
+    email_filter = create_filter(f"email-filter-test-{uuid.uuid4().hex[:8]}")
+    open_filter(email_filter)
+    monkeypatch.setattr(endpoints, "email_filter", email_filter)
+
+    async def fail_hash(password):
+        raise AssertionError("The password of a duplicate must not be hashed")
+
+    try:
+        user_data = {"email": "filter_3@gmail.com", "password": "testtest"}
+        assert client.post("api/v1/users/register", json=user_data).status_code == 200
+        assert email_filter.stats()["definite_misses"] == 1
+
+        monkeypatch.setattr(password_hasher, "hash", fail_hash)
+        response = client.post("api/v1/users/register", json=user_data)
+        assert response.status_code == 400
+        assert response.json()["detail"] == "User already exists"
+        assert email_filter.stats()["possible_hits"] == 1
+    finally:
+        email_filter.close()
+
+
+def test_definite_misses_are_only_checked_by_the_insert(client, monkeypatch):
+    user_data = {"email": "filter_4@gmail.com", "password": "testtest"}
+    assert client.post("api/v1/users/register", json=user_data).status_code == 200
+
+    # The bits of the registered user are lost.
+    email_filter = create_filter(f"email-filter-test-{uuid.uuid4().hex[:8]}")
+    open_filter(email_filter)
+    email_filter._memory.buf[HEADER_SIZE:] = bytes(
+        len(email_filter._memory.buf) - HEADER_SIZE
+    )
+    monkeypatch.setattr(endpoints, "email_filter", email_filter)
+
+    async def fail_email_exists(email, db):
+        raise AssertionError("A definite miss must not be checked before the insert")
+
+    monkeypatch.setattr(endpoints, "email_exists", fail_email_exists)
+    try:
+        response = client.post("api/v1/users/register", json=user_data)
+        assert response.status_code == 400
+        assert response.json()["detail"] == "User already exists"
+        assert email_filter.stats()["false_negatives"] == 1
+    finally:
+        email_filter.close()
@@ -0,0 +1,293 @@
+import asyncio
+import contextlib
+
+import httpx
+import psycopg
+import pytest
+from app.email_client import (
+    CircuitBreaker,
+    EmailServiceBusyError,
+    EmailServiceClient,
+    EmailServiceError,
+    EmailServiceUnavailableError,
+)
+from app.outbox import OutboxDispatcher
+from psycopg.rows import dict_row
+
+from .conftest import mock_postgres
+
+
+def create_client(handler, failure_threshold=5, max_connections=10):
+    return EmailServiceClient(
+        url="http://email-service:8001/api/v1/emails/send",
+        api_key="api-key",
+        max_connections=max_connections,
+        max_keepalive_connections=10,
+        keepalive_expiry=30,
+        connect_timeout=1,
+        read_timeout=1,
+        max_retries=2,
+        retry_backoff=0,
+        breaker=CircuitBreaker(failure_threshold=failure_threshold, reset_timeout=60),
+        transport=httpx.MockTransport(handler),
+    )
+
+
+def dispatch(status_code, max_attempts=3, handler=None):
+    async def scenario():
+        client = create_client(handler or (lambda request: httpx.Response(status_code)))
+        client.start()
+        dispatcher = OutboxDispatcher(
+            client=client,
+            batch_size=10,
+            poll_interval=0,
+            max_attempts=max_attempts,
+            backoff_base=0,
+            backoff_max=0,
+            lease=60,
+        )
+
+        @contextlib.asynccontextmanager
+        async def connection():
+            async with await psycopg.AsyncConnection.connect(
+                mock_postgres.database_url, row_factory=dict_row
+            ) as db:
+                yield db
+
+        try:
+            claimed = await dispatcher.dispatch_batch(connection)
+        finally:
+            await client.close()
+        return claimed, dispatcher.stats()
+
+    return asyncio.run(scenario())
+
+
+def clear_outbox():
+    with psycopg.connect(mock_postgres.database_url) as connection:
+        connection.execute("DELETE FROM email_outbox;")
+
+
+def get_outbox_entry(email):
+    with psycopg.connect(
+        mock_postgres.database_url, row_factory=dict_row
+    ) as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT * FROM email_outbox WHERE email = %s;", (email,))
+            return cursor.fetchone()
+
+
+def test_register_user_writes_the_activation_email_to_the_outbox(client):
+    clear_outbox()
+    user_data = {"email": "outbox_1@gmail.com", "password": "testtest"}
+    response = client.post("api/v1/users/register", json=user_data)
+    assert response.status_code == 200
+
+    entry = get_outbox_entry(user_data["email"])
+    assert entry["status"] == "pending"
+    assert entry["attempts"] == 0
+
+    claimed, stats = dispatch(status_code=200)
+    assert claimed == 1
+    assert stats["sent"] == 1
+    entry = get_outbox_entry(user_data["email"])
+    assert entry["status"] == "sent"
+    assert entry["sent_at"] is not None
+
+
+def test_failed_emails_are_retried_then_dead_lettered(client):
+    clear_outbox()
+    user_data = {"email": "outbox_2@gmail.com", "password": "testtest"}
+    client.post("api/v1/users/register", json=user_data)
+
+    _, stats = dispatch(status_code=500, max_attempts=2)
+    entry = get_outbox_entry(user_data["email"])
+    assert stats["failed"] == 1
+    assert entry["status"] == "pending"
+    assert entry["attempts"] == 1
+    assert entry["last_error"] == "Email service responded with 500"
+
+    _, stats = dispatch(status_code=500, max_attempts=2)
+    entry = get_outbox_entry(user_data["email"])
+    assert stats["dead_lettered"] == 1
+    assert entry["status"] == "dead"
+    assert entry["attempts"] == 2
+
+
+def test_emails_are_sent_outside_of_the_claim_transaction(client):
+    clear_outbox()
+    user_data = {"email": "outbox_3@gmail.com", "password": "testtest"}
+    client.post("api/v1/users/register", json=user_data)
+    during_send = []
+
+    def handler(request):
+        # Another dispatcher can neither see nor is blocked by the claimed entry.
+        with psycopg.connect(mock_postgres.database_url) as connection:
+            during_send.append(
+                connection.execute(
+                    "SELECT next_attempt_at > now() FROM email_outbox WHERE email = %s FOR UPDATE NOWAIT;",
+                    (user_data["email"],),
+                ).fetchone()[0]
+            )
+        return httpx.Response(200)
+
+    claimed, stats = dispatch(status_code=200, handler=handler)
+    assert claimed == 1
+    assert during_send == [True]
+    assert get_outbox_entry(user_data["email"])["status"] == "sent"
+
+
+def test_skipped_emails_give_back_their_lease(client):
+    clear_outbox()
+    user_data = {"email": "outbox_4@gmail.com", "password": "testtest"}
+    client.post("api/v1/users/register", json=user_data)
+
+    def handler(request):
+        raise httpx.PoolTimeout("No connection available")
+
+    claimed, _ = dispatch(status_code=200, handler=handler)
+    assert claimed == 1
+    entry = get_outbox_entry(user_data["email"])
+    assert entry["status"] == "pending"
+    assert entry["attempts"] == 0
+
+    claimed, stats = dispatch(status_code=200)
+    assert claimed == 1
+    assert stats["sent"] == 1
+
+
+def test_email_service_client_retries_unavailable_responses():
+    responses = iter([503, 503, 200])
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(next(responses))
+
+    async def scenario():
+        client = create_client(handler)
+        client.start()
+        try:
+            await client.send_activation_email("test@gmail.com", "1234")
+        finally:
+            await client.close()
+        return client.stats()
+
+    stats = asyncio.run(scenario())
+    assert len(requests) == 3
+    assert requests[0].headers["x-api-key"] == "api-key"
+    assert stats["retries"] == 2
+    assert stats["circuit_breaker"]["state"] == "closed"
+
+
+def test_email_service_client_opens_the_circuit_after_failures():
+    def handler(request):
+        raise httpx.ConnectError("Connection refused")
+
+    async def scenario():
+        client = create_client(handler, failure_threshold=2)
+        client.start()
+        errors = []
+        try:
+            for _ in range(3):
+                try:
+                    await client.send_activation_email("test@gmail.com", "1234")
+                except EmailServiceError as e:
+                    errors.append(e)
+        finally:
+            await client.close()
+        return errors, client.stats()
+
+    errors, stats = asyncio.run(scenario())
+    assert [type(error) for error in errors] == [
+        EmailServiceError,
+        EmailServiceError,
+        EmailServiceUnavailableError,
+    ]
+    assert stats["requests"] == 2
+    assert stats["circuit_breaker"]["state"] == "open"
+    assert stats["circuit_breaker"]["rejected"] == 1
+
+
+def test_email_service_client_caps_concurrent_requests():
+    in_flight = []
+    peak = []
+
+    async def handler(request):
+        in_flight.append(request)
+        peak.append(len(in_flight))
+        await asyncio.sleep(0.01)
+        in_flight.remove(request)
+        return httpx.Response(200)
+
+    async def scenario():
+        client = create_client(handler, max_connections=2)
+        client.start()
+        try:
+            await asyncio.gather(
+                *(client.send_activation_email("a@b.c", "1234") for _ in range(6))
+            )
+        finally:
+            await client.close()
+
+    asyncio.run(scenario())
+    assert len(peak) == 6
+    assert max(peak) == 2
+
+
+def test_pool_timeouts_are_not_email_service_failures():
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        raise httpx.PoolTimeout("No connection available")
+
+    async def scenario():
+        client = create_client(handler, failure_threshold=1)
+        client.start()
+        try:
+            with pytest.raises(EmailServiceBusyError):
+                await client.send_activation_email("test@gmail.com", "1234")
+        finally:
+            await client.close()
+        return client.stats()
+
+    stats = asyncio.run(scenario())
+    assert len(requests) == 1
+    assert stats["busy"] == 1
+    assert stats["failures"] == 0
+    assert stats["circuit_breaker"]["state"] == "closed"
+
+
+def test_circuit_breaker_lets_a_single_probe_through_when_half_open():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.allow() is True
+    assert breaker.state == "half_open"
+    assert breaker.allow() is False
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow() is True
+
+
+def test_cancelled_probe_lets_the_next_request_probe():
+    async def handler(request):
+        await asyncio.sleep(10)
+
+    async def scenario():
+        client = create_client(handler, failure_threshold=1)
+        client.breaker.reset_timeout = 0
+        client.breaker.record_failure()
+        client.start()
+        probe = asyncio.create_task(client.send_activation_email("a@b.c", "1234"))
+        await asyncio.sleep(0.01)
+        assert client.breaker.state == "half_open"
+        probe.cancel()
+        await asyncio.gather(probe, return_exceptions=True)
+        await client.close()
+        return client.breaker
+
+    breaker = asyncio.run(scenario())
+    assert breaker.state == "half_open"
+    assert breaker.allow() is True
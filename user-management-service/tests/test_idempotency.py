@@ -0,0 +1,104 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg
+from app.users.utils import password_hasher
+from fastapi import HTTPException
+
+from .conftest import mock_postgres
+
+
+def count(query, params=()):
+    with psycopg.connect(mock_postgres.database_url) as connection:
+        return connection.execute(query, params).fetchone()[0]
+
+
+def register(client, email, key):
+    return client.post(
+        "api/v1/users/register",
+        json={"email": email, "password": "testtest"},
+        headers={"Idempotency-Key": key},
+    )
+
+
+def test_retry_replays_the_stored_response(client, mock_post_request, monkeypatch):
+    first = register(client, "idempotent@gmail.com", "key-1")
+
+    async def fail_hash(password):
+        raise AssertionError("The password must not be hashed again")
+
+    monkeypatch.setattr(password_hasher, "hash", fail_hash)
+    retry = register(client, "idempotent@gmail.com", "key-1")
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.json() == first.json()
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert "Idempotent-Replayed" not in first.headers
+    assert (
+        count(
+            "SELECT count(*) FROM email_outbox WHERE email = %s;",
+            ("idempotent@gmail.com",),
+        )
+        == 1
+    )
+
+
+def test_existing_user_outcome_is_replayed(client, mock_post_request):
+    register(client, "idempotent_existing@gmail.com", "key-2")
+
+    first = register(client, "idempotent_existing@gmail.com", "key-3")
+    retry = register(client, "idempotent_existing@gmail.com", "key-3")
+
+    assert first.status_code == retry.status_code == 400
+    assert retry.json() == {"detail": "User already exists"}
+    assert retry.headers["Idempotent-Replayed"] == "true"
+
+
+def test_key_reused_for_another_email_is_rejected(client, mock_post_request):
+    register(client, "idempotent_first@gmail.com", "key-4")
+
+    response = register(client, "idempotent_second@gmail.com", "key-4")
+
+    assert response.status_code == 422
+    assert (
+        count(
+            "SELECT count(*) FROM users WHERE email = %s;",
+            ("idempotent_second@gmail.com",),
+        )
+        == 0
+    )
+
+
+def test_concurrent_retries_are_coalesced(client, mock_post_request):
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        responses = list(
+            executor.map(
+                lambda _: register(client, "idempotent_concurrent@gmail.com", "key-5"),
+                range(4),
+            )
+        )
+
+    assert [response.status_code for response in responses] == [200] * 4
+    assert len({response.json()["id"] for response in responses}) == 1
+    assert sum("Idempotent-Replayed" in response.headers for response in responses) == 3
+    assert (
+        count(
+            "SELECT count(*) FROM email_outbox WHERE email = %s;",
+            ("idempotent_concurrent@gmail.com",),
+        )
+        == 1
+    )
+
+
+def test_failed_request_does_not_keep_the_key(client, mock_post_request, monkeypatch):
+    original_hash = password_hasher.hash
+
+    async def busy_hash(password):
+        raise HTTPException(status_code=503, detail="busy")
+
+    monkeypatch.setattr(password_hasher, "hash", busy_hash)
+    assert register(client, "idempotent_busy@gmail.com", "key-6").status_code == 503
+
+    monkeypatch.setattr(password_hasher, "hash", original_hash)
+    response = register(client, "idempotent_busy@gmail.com", "key-6")
+    assert response.status_code == 200
+    assert "Idempotent-Replayed" not in response.headers
@@ -0,0 +1,20 @@
+def test_metrics_record_the_stages_of_register(client):
+    user_data = {"email": "metrics_1@gmail.com", "password": "testtest"}
+    assert client.post("api/v1/users/register", json=user_data).status_code == 200
+
+    response = client.get("api/v1/monitoring/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    metrics = response.text
+    assert (
+        'user_management_stage_duration_seconds_count{operation="password",stage="hash"}'
+        in metrics
+    )
+    assert (
+        'user_management_stage_duration_seconds_count{operation="register",stage="insert"}'
+        in metrics
+    )
+    assert (
+        'user_management_http_request_duration_seconds_count{handler="register_user",method="POST",status="200"}'
+        in metrics
+    )
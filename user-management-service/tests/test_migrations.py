@@ -0,0 +1,54 @@
+import asyncio
+
+import psycopg
+import pytest
+from app.migrate import check_schema_version, latest_version, migrate
+from psycopg.rows import dict_row
+
+from .conftest import mock_postgres
+
+
+def get_schema_versions():
+    with psycopg.connect(mock_postgres.database_url) as connection:
+        rows = connection.execute(
+            "SELECT version FROM schema_migrations ORDER BY version;"
+        ).fetchall()
+    return [row[0] for row in rows]
+
+
+def test_migrations_are_applied_once():
+    versions = get_schema_versions()
+    assert versions == list(range(1, latest_version() + 1))
+
+    assert migrate(mock_postgres.database_url) == []
+    assert get_schema_versions() == versions
+
+
+def test_activation_codes_are_indexed():
+    with psycopg.connect(mock_postgres.database_url) as connection:
+        rows = connection.execute(
+            "SELECT indexname FROM pg_indexes WHERE tablename = 'activation_codes';"
+        ).fetchall()
+    indexes = {row[0] for row in rows}
+    assert "activation_codes_user_id_code_idx" in indexes
+    assert "activation_codes_expires_at_idx" in indexes
+
+
+def test_schema_check_fails_when_migrations_are_pending():
+    async def check():
+        async with await psycopg.AsyncConnection.connect(
+            mock_postgres.database_url, row_factory=dict_row
+        ) as connection:
+            await check_schema_version(connection)
+
+    asyncio.run(check())
+
+    with psycopg.connect(mock_postgres.database_url) as connection:
+        connection.execute(
+            "DELETE FROM schema_migrations WHERE version = %s;", (latest_version(),)
+        )
+    try:
+        with pytest.raises(RuntimeError):
+            asyncio.run(check())
+    finally:
+        migrate(mock_postgres.database_url)
@@ -0,0 +1,130 @@
+import asyncio
+
+import psycopg
+import pytest
+from app.users import utils
+from app.users.utils import PasswordHasher, calibrate_rounds, password_hasher
+from fastapi import HTTPException
+
+from .conftest import mock_postgres
+
+
+def test_password_hasher_hashes_and_verifies_in_worker_processes():
+    async def scenario():
+        hasher = PasswordHasher(workers=1, queue_size=1)
+        await hasher.start()
+        try:
+            password_hash = await hasher.hash("testtest")
+            return (
+                await hasher.verify("testtest", password_hash),
+                await hasher.verify("wrong", password_hash),
+                hasher.stats(),
+            )
+        finally:
+            hasher.shutdown()
+
+    valid, invalid, stats = asyncio.run(scenario())
+    assert valid is True
+    assert invalid is False
+    assert stats["completed"] == 3
+    assert stats["pending"] == 0
+
+
+def test_password_hasher_rejects_when_saturated():
+    async def scenario():
+        hasher = PasswordHasher(workers=1, queue_size=1)
+        await hasher.start()
+        try:
+            tasks = [asyncio.create_task(hasher.hash("testtest")) for _ in range(3)]
+            return await asyncio.gather(*tasks, return_exceptions=True), hasher.stats()
+        finally:
+            hasher.shutdown()
+
+    results, stats = asyncio.run(scenario())
+    rejected = [result for result in results if isinstance(result, HTTPException)]
+    assert len(rejected) == 1
+    assert rejected[0].status_code == 503
+    assert rejected[0].headers["Retry-After"] == "1"
+    assert stats["rejected"] == 1
+
+
+def test_password_hasher_refuses_to_hash_on_the_event_loop():
+    hasher = PasswordHasher(workers=1, queue_size=1, rounds=4)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(hasher.hash("testtest"))
+
+
+@pytest.mark.parametrize(
+    "target_seconds, growth, expected_rounds",
+    [
+        (0.25, 2, 8),
+        (100, 2, 12),
+        (0.001, 2, 4),
+        # Slower than extrapolated from the floor, stepped down after measuring.
+        (0.25, 3, 6),
+    ],
+)
+def test_calibration_picks_the_highest_cost_within_the_target(
+    monkeypatch, target_seconds, growth, expected_rounds
+):
+    monkeypatch.setattr(
+        utils,
+        "measure_hash_seconds",
+        lambda rounds, samples=2: 0.01 * growth ** (rounds - 4),
+    )
+
+    rounds, timings = calibrate_rounds(target_seconds, min_rounds=4, max_rounds=12)
+
+    assert rounds == expected_rounds
+    assert rounds in timings
+
+
+def test_password_hasher_calibrates_on_a_worker():
+    async def scenario():
+        hasher = PasswordHasher(
+            workers=1, queue_size=1, target_seconds=0, min_rounds=4, max_rounds=6
+        )
+        await hasher.start()
+        try:
+            return await hasher.hash("testtest"), hasher.stats()
+        finally:
+            hasher.shutdown()
+
+    password_hash, stats = asyncio.run(scenario())
+    assert password_hash.startswith("$2b$04$")
+    assert stats["rounds"] == 4
+    assert stats["calibrated"] is True
+    assert stats["hash_seconds"][4] > 0
+
+
+def test_activation_rehashes_the_password_with_the_current_cost(
+    client, mock_post_request, monkeypatch
+):
+    monkeypatch.setattr(password_hasher, "rounds", 5)
+    credentials = ("rehash@gmail.com", "testtest")
+    response = client.post(
+        "api/v1/users/register",
+        json={"email": credentials[0], "password": credentials[1]},
+    )
+    user_id = response.json()["id"]
+
+    def stored_hash():
+        with psycopg.connect(mock_postgres.database_url) as connection:
+            return connection.execute(
+                "SELECT password_hash FROM users WHERE id = %s;", (user_id,)
+            ).fetchone()[0]
+
+    assert stored_hash().startswith("$2b$05$")
+
+    monkeypatch.setattr(password_hasher, "rounds", 4)
+    with psycopg.connect(mock_postgres.database_url) as connection:
+        code = connection.execute(
+            "SELECT code FROM email_outbox WHERE email = %s;", (credentials[0],)
+        ).fetchone()[0]
+    response = client.post(
+        "api/v1/users/activate", json={"code": code}, auth=credentials
+    )
+
+    assert response.status_code == 200
+    assert stored_hash().startswith("$2b$04$")
@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+from app.config import postgres_settings
+from app.postgres import Postgres
+from fastapi import HTTPException
+from psycopg.pq import TransactionStatus
+
+from .conftest import mock_postgres
+
+
+def run_with_pool(scenario, max_size=2, timeout=0.1):
+    async def main():
+        database = Postgres()
+        database.database_url = mock_postgres.database_url
+        await database.open_pool()
+        await database.pool.resize(min(database.pool.min_size, max_size), max_size)
+        database.pool.timeout = timeout
+        try:
+            return await scenario(database)
+        finally:
+            await database.close_pool()
+
+    return asyncio.run(main())
+
+
+def test_pool_reuses_connections():
+    async def scenario(database):
+        for _ in range(3):
+            async for connection in database.get_db():
+                async with connection.cursor() as cursor:
+                    await cursor.execute("SELECT 1 AS one;")
+                    assert (await cursor.fetchone())["one"] == 1
+        return database.stats()
+
+    stats = run_with_pool(scenario)
+    assert stats["requests_num"] == 3
+    assert stats["pool_size"] == postgres_settings.POSTGRES_POOL_MIN_SIZE
+
+
+def test_pool_exhaustion_returns_service_unavailable():
+    async def scenario(database):
+        first = await database.pool.getconn()
+        second = await database.pool.getconn()
+        try:
+            with pytest.raises(HTTPException) as error:
+                async for _ in database.get_db():
+                    pass
+        finally:
+            await database.pool.putconn(first)
+            await database.pool.putconn(second)
+        return error.value, database.stats()
+
+    error, stats = run_with_pool(scenario)
+    assert error.status_code == 503
+    assert stats["requests_errors"] == 1
+
+
+def test_pool_rolls_back_returned_connections():
+    async def scenario(database):
+        async for connection in database.get_db():
+            async with connection.cursor() as cursor:
+                await cursor.execute("SELECT 1;")
+            assert connection.info.transaction_status == TransactionStatus.INTRANS
+        async with database.pool.connection() as connection:
+            return connection.info.transaction_status
+
+    assert run_with_pool(scenario, max_size=1) == TransactionStatus.IDLE
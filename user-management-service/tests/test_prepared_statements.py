@@ -0,0 +1,75 @@
+import asyncio
+
+import psycopg
+from app.prepared import PreparedStatements, prepared_statements
+from app.users import repository
+from psycopg.rows import dict_row
+
+from .conftest import mock_postgres
+
+
+async def server_prepared_statements(db) -> list:
+    cursor = await db.execute(
+        "SELECT statement FROM pg_prepared_statements WHERE NOT from_sql;"
+    )
+    return [row["statement"] for row in await cursor.fetchall()]
+
+
+def test_hot_queries_are_prepared_once_per_connection():
+    async def scenario():
+        async with await psycopg.AsyncConnection.connect(
+            mock_postgres.database_url, row_factory=dict_row
+        ) as db:
+            for _ in range(3):
+                await repository.get_user_by_email("prepared@gmail.com", db=db)
+                await repository.email_exists("prepared@gmail.com", db=db)
+            return await server_prepared_statements(db)
+
+    statements = asyncio.run(scenario())
+    assert len(statements) == 2
+    assert any("SELECT id, email, is_active FROM users" in s for s in statements)
+    assert any("SELECT 1 FROM users" in s for s in statements)
+
+
+def test_disabled_prepared_statements(monkeypatch):
+    monkeypatch.setattr(prepared_statements, "enabled", False)
+
+    async def scenario():
+        async with await psycopg.AsyncConnection.connect(
+            mock_postgres.database_url, row_factory=dict_row
+        ) as db:
+            await repository.get_user_by_email("prepared@gmail.com", db=db)
+            return await server_prepared_statements(db)
+
+    assert asyncio.run(scenario()) == []
+
+
+def test_stale_statement_is_prepared_again_after_a_schema_change():
+    statements = PreparedStatements(enabled=True)
+
+    async def lookup(db):
+        async with db.cursor() as cursor:
+            await statements.execute(
+                cursor, repository.SELECT_USER_WITH_PASSWORD, ("stale@gmail.com",)
+            )
+            await db.commit()
+            return [column.name for column in cursor.description]
+
+    async def scenario():
+        async with await psycopg.AsyncConnection.connect(
+            mock_postgres.database_url, row_factory=dict_row
+        ) as db:
+            await lookup(db)
+            # `SELECT *` returns another row type once a column is added.
+            async with await psycopg.AsyncConnection.connect(
+                mock_postgres.database_url, autocommit=True
+            ) as ddl:
+                await ddl.execute("ALTER TABLE users ADD COLUMN stale_test TEXT;")
+                try:
+                    return await lookup(db)
+                finally:
+                    await ddl.execute("ALTER TABLE users DROP COLUMN stale_test;")
+
+    columns = asyncio.run(scenario())
+    assert "stale_test" in columns
+    assert statements.stats()["stale_retries"] == 1
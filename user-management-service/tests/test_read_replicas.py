@@ -0,0 +1,187 @@
+import asyncio
+import os
+
+import psycopg
+import pytest
+from app.config import postgres_settings
+from app.main import app
+from app.postgres import Postgres, Replica, postgres
+from app.users.admission import activate_admission, register_admission
+from app.users.repository import get_user_by_email
+from fastapi.testclient import TestClient
+from psycopg.rows import dict_row
+from psycopg_pool import PoolTimeout
+
+from .conftest import mock_postgres, no_admission
+
+# A streaming replica of the test database, e.g. started with
+# `pg_basebackup -R` from the primary and listening on another port.
+REPLICA_URL = os.environ.get("POSTGRES_TEST_REPLICA_URL")
+requires_replica = pytest.mark.skipif(
+    not REPLICA_URL, reason="POSTGRES_TEST_REPLICA_URL is not set"
+)
+
+
+def run_with_replicas(scenario, replica_urls):
+    async def main():
+        database = Postgres()
+        database.database_url = mock_postgres.database_url
+        database.replicas = [Replica(url) for url in replica_urls]
+        await database.open_pool()
+        try:
+            return await scenario(database)
+        finally:
+            await database.close_pool()
+
+    return asyncio.run(main())
+
+
+@requires_replica
+def test_reads_are_routed_to_the_replica():
+    async def scenario(database):
+        async for read_db in database.get_read_db():
+            cursor = await read_db.execute("SELECT pg_is_in_recovery() AS replica;")
+            return database.replicas[0].healthy, (await cursor.fetchone())["replica"]
+
+    healthy, is_replica = run_with_replicas(scenario, [REPLICA_URL])
+    assert healthy
+    assert is_replica
+
+
+@requires_replica
+def test_lookup_falls_back_to_the_primary_when_the_replica_misses():
+    stats = postgres.replica_stats()
+
+    async def scenario(database):
+        async for read_db in database.get_read_db():
+            async with database.pool.connection() as db:
+                # Not committed, so only visible from the primary connection.
+                await db.execute(
+                    "INSERT INTO users (email, password_hash) VALUES (%s, %s);",
+                    ("replica-miss@gmail.com", "hash"),
+                )
+                user = await get_user_by_email(
+                    "replica-miss@gmail.com", db=db, read_db=read_db
+                )
+                await db.rollback()
+                return user
+
+    user = run_with_replicas(scenario, [REPLICA_URL])
+    assert user.email == "replica-miss@gmail.com"
+    assert postgres.replica_stats()["misses"] == stats["misses"] + 1
+    assert postgres.replica_stats()["fallbacks"] == stats["fallbacks"]
+
+
+@requires_replica
+def test_unknown_email_is_not_counted_as_a_replica_miss():
+    stats = postgres.replica_stats()
+
+    async def scenario(database):
+        async for read_db in database.get_read_db():
+            async with database.pool.connection() as db:
+                return await get_user_by_email(
+                    "replica-unknown@gmail.com", db=db, read_db=read_db
+                )
+
+    assert run_with_replicas(scenario, [REPLICA_URL]) is None
+    assert postgres.replica_stats()["misses"] == stats["misses"]
+    assert postgres.replica_stats()["fallbacks"] == stats["fallbacks"]
+
+
+class FailingReplica:
+    def __init__(self, error):
+        self.error = error
+
+    def cursor(self):
+        raise self.error
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        psycopg.OperationalError("server closed the connection unexpectedly"),
+        psycopg.errors.QueryCanceled(
+            "canceling statement due to conflict with recovery"
+        ),
+        psycopg.errors.SerializationFailure(
+            "canceling statement due to conflict with recovery"
+        ),
+        PoolTimeout("couldn't get a connection after 1.00 sec"),
+    ],
+)
+def test_lookup_falls_back_to_the_primary_when_the_replica_fails(error):
+    stats = postgres.replica_stats()
+
+    async def scenario():
+        async with await psycopg.AsyncConnection.connect(
+            mock_postgres.database_url, row_factory=dict_row
+        ) as db:
+            await db.execute(
+                "INSERT INTO users (email, password_hash) VALUES (%s, %s);",
+                ("replica-failure@gmail.com", "hash"),
+            )
+            user = await get_user_by_email(
+                "replica-failure@gmail.com", db=db, read_db=FailingReplica(error)
+            )
+            await db.rollback()
+            return user
+
+    user = asyncio.run(scenario())
+    assert user.email == "replica-failure@gmail.com"
+    assert postgres.replica_stats()["fallbacks"] == stats["fallbacks"] + 1
+    assert postgres.replica_stats()["misses"] == stats["misses"]
+
+
+def test_down_replica_is_not_used():
+    async def scenario(database):
+        async for read_db in database.get_read_db():
+            return database.replicas[0].healthy, read_db
+
+    healthy, read_db = run_with_replicas(
+        scenario, ["postgresql://dailymotion@127.0.0.1:1/dailymotion_test"]
+    )
+    assert healthy is False
+    assert read_db is None
+
+
+def test_lagging_replica_is_not_used(monkeypatch):
+    monkeypatch.setattr(postgres_settings, "POSTGRES_REPLICA_MAX_LAG", -1.0)
+
+    async def scenario(database):
+        async for read_db in database.get_read_db():
+            return database.replicas[0].lag, read_db
+
+    # The primary reports no lag, still over the negative threshold.
+    lag, read_db = run_with_replicas(scenario, [mock_postgres.database_url])
+    assert lag == 0
+    assert read_db is None
+
+
+@requires_replica
+def test_activate_right_after_register_with_a_replica(monkeypatch, mock_post_request):
+    monkeypatch.setattr(postgres, "replicas", [Replica(REPLICA_URL)])
+    app.dependency_overrides[postgres.get_db] = mock_postgres.get_db
+    app.dependency_overrides[register_admission] = no_admission
+    app.dependency_overrides[activate_admission] = no_admission
+    user_data = {"email": "replica@gmail.com", "password": "testtest"}
+    try:
+        with TestClient(app) as client:
+            response = client.post("api/v1/users/register", json=user_data)
+            assert response.status_code == 200
+            with psycopg.connect(
+                mock_postgres.database_url, row_factory=dict_row
+            ) as connection:
+                code = connection.execute(
+                    "SELECT code FROM activation_codes WHERE user_id = %s;",
+                    (response.json()["id"],),
+                ).fetchone()["code"]
+            response = client.post(
+                "api/v1/users/activate",
+                json={"code": code},
+                auth=(user_data["email"], user_data["password"]),
+            )
+            assert response.status_code == 200
+            assert response.json()["is_active"] is True
+            assert postgres.replica_stats()["replicas"][0]["healthy"]
+    finally:
+        app.dependency_overrides = {}
@@ -0,0 +1,179 @@
+import asyncio
+from datetime import timedelta
+
+import psycopg
+from app.users import repository
+from app.users.activation_codes import MemoryActivationCodeStore
+from app.users.coalescing import RequestCoalescer
+from app.users.schemas import ResendResult
+from psycopg.rows import dict_row
+
+from .conftest import mock_postgres
+
+
+def register(client, email: str) -> int:
+    response = client.post(
+        "api/v1/users/register", json={"email": email, "password": "testtest"}
+    )
+    assert response.status_code == 200
+    return response.json()["id"]
+
+
+def sent_codes(email: str) -> list:
+    with psycopg.connect(mock_postgres.database_url) as connection:
+        rows = connection.execute(
+            "SELECT code FROM email_outbox WHERE email = %s ORDER BY id;", (email,)
+        ).fetchall()
+    return [row[0] for row in rows]
+
+
+def end_cooldown(email: str):
+    with psycopg.connect(mock_postgres.database_url) as connection:
+        connection.execute(
+            "UPDATE email_outbox SET created_at = created_at - interval '1 hour' WHERE email = %s;",
+            (email,),
+        )
+
+
+def test_resend_is_refused_during_the_cooldown(client, mock_post_request):
+    email = "resend_cooldown@gmail.com"
+    register(client, email)
+    response = client.post(
+        "api/v1/users/resend-activation-code", auth=(email, "testtest")
+    )
+    assert response.status_code == 429
+    assert 0 < int(response.headers["Retry-After"]) <= 30
+    assert len(sent_codes(email)) == 1
+
+
+def test_resend_reuses_the_valid_code(client, mock_post_request):
+    email = "resend_reuse@gmail.com"
+    user_id = register(client, email)
+    end_cooldown(email)
+    response = client.post(
+        "api/v1/users/resend-activation-code", auth=(email, "testtest")
+    )
+    assert response.status_code == 200
+    first, second = sent_codes(email)
+    assert first == second
+    with psycopg.connect(mock_postgres.database_url) as connection:
+        codes = connection.execute(
+            "SELECT count(*) FROM activation_codes WHERE user_id = %s;", (user_id,)
+        ).fetchone()[0]
+    assert codes == 1
+
+
+def test_resend_sends_a_new_code_once_expired(client, mock_post_request):
+    email = "resend_expired@gmail.com"
+    user_id = register(client, email)
+    end_cooldown(email)
+    with psycopg.connect(mock_postgres.database_url) as connection:
+        connection.execute(
+            "UPDATE activation_codes SET expires_at = now() - interval '1 second' WHERE user_id = %s;",
+            (user_id,),
+        )
+    response = client.post(
+        "api/v1/users/resend-activation-code", auth=(email, "testtest")
+    )
+    assert response.status_code == 200
+    code = sent_codes(email)[-1]
+    response = client.post(
+        "api/v1/users/activate", json={"code": code}, auth=(email, "testtest")
+    )
+    assert response.status_code == 200
+    assert response.json()["is_active"] is True
+
+    response = client.post(
+        "api/v1/users/resend-activation-code", auth=(email, "testtest")
+    )
+    assert response.status_code == 400
+
+
+def test_resend_checks_the_credentials(client, mock_post_request):
+    email = "resend_credentials@gmail.com"
+    register(client, email)
+    end_cooldown(email)
+    response = client.post(
+        "api/v1/users/resend-activation-code", auth=(email, "wrongpassword")
+    )
+    assert response.status_code == 401
+    response = client.post(
+        "api/v1/users/resend-activation-code", auth=("nobody@gmail.com", "testtest")
+    )
+    assert response.status_code == 404
+    assert len(sent_codes(email)) == 1
+
+
+def test_resend_with_a_store(client, mock_post_request, monkeypatch):
+    store = MemoryActivationCodeStore(ttl=60, expired_grace=3600)
+    monkeypatch.setattr(repository, "activation_code_store", store)
+    email = "resend_store@gmail.com"
+    user_id = register(client, email)
+    end_cooldown(email)
+    client.post("api/v1/users/resend-activation-code", auth=(email, "testtest"))
+    first, second = sent_codes(email)
+    assert first == second
+
+    monkeypatch.setattr(repository, "REUSE_MIN_VALIDITY", timedelta(seconds=61))
+    end_cooldown(email)
+    client.post("api/v1/users/resend-activation-code", auth=(email, "testtest"))
+    code = sent_codes(email)[-1]
+    assert asyncio.run(store.check(user_id, code)) is True
+
+
+def test_concurrent_resends_from_several_workers_send_one_email(
+    client, mock_post_request
+):
+    email = "resend_workers@gmail.com"
+    user_id = register(client, email)
+    end_cooldown(email)
+
+    async def resend():
+        async with await psycopg.AsyncConnection.connect(
+            mock_postgres.database_url, row_factory=dict_row
+        ) as db:
+            return await repository.resend_activation_code(user_id, db)
+
+    async def scenario():
+        return await asyncio.gather(*(resend() for _ in range(4)))
+
+    results = sorted(result for result, _ in asyncio.run(scenario()))
+    assert results == [ResendResult.COOLDOWN] * 3 + [ResendResult.REUSED]
+    assert len(sent_codes(email)) == 2
+
+
+def test_coalescer_runs_the_operation_once():
+    coalescer = RequestCoalescer()
+    runs = []
+
+    async def operation():
+        runs.append(1)
+        await asyncio.sleep(0.01)
+        return len(runs)
+
+    async def scenario():
+        return await asyncio.gather(*(coalescer.run(1, operation) for _ in range(5)))
+
+    assert asyncio.run(scenario()) == [1] * 5
+    assert coalescer.stats() == {"in_flight": 0, "runs": 1, "coalesced": 4}
+
+
+def test_coalescer_hands_over_when_the_running_call_is_cancelled():
+    coalescer = RequestCoalescer()
+    runs = []
+
+    async def operation():
+        runs.append(1)
+        await asyncio.sleep(0.05)
+        return len(runs)
+
+    async def scenario():
+        leader = asyncio.create_task(coalescer.run(1, operation))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(coalescer.run(1, operation))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await follower
+
+    assert asyncio.run(scenario()) == 2
+    assert coalescer.stats()["runs"] == 2
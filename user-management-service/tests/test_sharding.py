@@ -0,0 +1,263 @@
+import asyncio
+import os
+
+import psycopg
+import pytest
+from app.config import activation_code_settings
+from app.main import app
+from app.migrate import migrate
+from app.postgres import postgres
+from app.reshard import Resharder
+from app.sharding import HashRing, parse_shard_map
+from app.users.admission import activate_admission, register_admission
+from fastapi.testclient import TestClient
+from psycopg import sql
+from psycopg.conninfo import conninfo_to_dict, make_conninfo
+
+from .conftest import mock_postgres, no_admission
+
+
+# Two databases of existing Postgres instances, e.g.
+# `shard-a=postgresql://...:5434/shard,shard-b=postgresql://...:5435/shard`.
+# Defaults to two databases created next to the test database.
+SHARD_URLS = os.environ.get("POSTGRES_TEST_SHARD_URLS")
+
+
+def create_shard_databases() -> dict:
+    urls = {}
+    test_database = conninfo_to_dict(mock_postgres.database_url)["dbname"]
+    with psycopg.connect(mock_postgres.database_url, autocommit=True) as connection:
+        for name in ("shard-a", "shard-b"):
+            database = f"{test_database}_{name.replace('-', '_')}"
+            exists = connection.execute(
+                "SELECT 1 FROM pg_database WHERE datname = %s;", (database,)
+            ).fetchone()
+            if not exists:
+                connection.execute(
+                    sql.SQL(
+                        "CREATE DATABASE {} ENCODING 'UTF8' TEMPLATE template0;"
+                    ).format(sql.Identifier(database))
+                )
+            urls[name] = make_conninfo(mock_postgres.database_url, dbname=database)
+    return urls
+
+
+@pytest.fixture
+def shards():
+    """
+    Two empty shard databases.
+    """
+    urls = parse_shard_map(SHARD_URLS) if SHARD_URLS else create_shard_databases()
+    assert len(urls) == 2, "POSTGRES_TEST_SHARD_URLS needs two shards"
+    for url in urls.values():
+        with psycopg.connect(url) as connection:
+            connection.execute(
+                "DROP TABLE IF EXISTS schema_migrations, idempotency_keys, email_outbox, activation_codes, users;"
+            )
+        migrate(url)
+    return urls
+
+
+def emails(url: str) -> set:
+    with psycopg.connect(url) as connection:
+        return {
+            row[0] for row in connection.execute("SELECT email FROM users;").fetchall()
+        }
+
+
+def test_hash_ring_is_stable_and_moves_few_emails():
+    addresses = [f"user{i}@gmail.com" for i in range(5000)]
+    ring = HashRing(["shard-0", "shard-1", "shard-2"])
+    before = {email: ring.shard_for(email) for email in addresses}
+    assert before == {
+        email: HashRing(["shard-2", "shard-0", "shard-1"]).shard_for(email)
+        for email in addresses
+    }
+    assert ring.shard_for("User0@Gmail.com ") == before["user0@gmail.com"]
+    for name in ("shard-0", "shard-1", "shard-2"):
+        assert 1000 < list(before.values()).count(name) < 2300
+
+    grown = HashRing(["shard-0", "shard-1", "shard-2", "shard-3"])
+    moved = [email for email in addresses if grown.shard_for(email) != before[email]]
+    # Only the emails taken by the new shard move, about a quarter of them.
+    assert all(grown.shard_for(email) == "shard-3" for email in moved)
+    assert 0.15 < len(moved) / len(addresses) < 0.35
+
+
+def test_parse_shard_map():
+    assert parse_shard_map("") == {}
+    assert parse_shard_map("a=postgresql://h/db?x=1, b=postgresql://h2/db") == {
+        "a": "postgresql://h/db?x=1",
+        "b": "postgresql://h2/db",
+    }
+    with pytest.raises(ValueError):
+        parse_shard_map("postgresql://h/db")
+    with pytest.raises(ValueError):
+        parse_shard_map("a=postgresql://h/db,a=postgresql://h2/db")
+
+
+def test_sharding_needs_the_postgres_activation_code_store(shards, monkeypatch):
+    monkeypatch.setattr(postgres, "shard_urls", shards)
+    monkeypatch.setattr(postgres, "ring", HashRing(shards))
+    monkeypatch.setattr(activation_code_settings, "ACTIVATION_CODE_STORE", "redis")
+    with pytest.raises(RuntimeError, match="activation code store"):
+        asyncio.run(postgres.open_pool())
+
+
+def test_register_and_activate_on_the_shard_of_the_email(
+    shards, monkeypatch, mock_post_request
+):
+    monkeypatch.setattr(postgres, "shard_urls", shards)
+    monkeypatch.setattr(postgres, "ring", HashRing(shards))
+    app.dependency_overrides[register_admission] = no_admission
+    app.dependency_overrides[activate_admission] = no_admission
+    registered = {}
+    try:
+        with TestClient(app) as client:
+            for i in range(6):
+                email = f"sharded{i}@gmail.com"
+                response = client.post(
+                    "api/v1/users/register",
+                    json={"email": email, "password": "testtest"},
+                )
+                assert response.status_code == 200
+                registered[email] = response.json()["id"]
+
+            email = "sharded0@gmail.com"
+            with psycopg.connect(shards[postgres.ring.shard_for(email)]) as connection:
+                code = connection.execute(
+                    "SELECT code FROM activation_codes WHERE user_id = %s;",
+                    (registered[email],),
+                ).fetchone()[0]
+            response = client.post(
+                "api/v1/users/activate",
+                json={"code": code},
+                auth=(email, "testtest"),
+            )
+            assert response.status_code == 200
+            assert response.json()["is_active"] is True
+            assert set(
+                client.get("api/v1/monitoring/stats").json()["postgres_pool"]
+            ) == set(shards)
+    finally:
+        app.dependency_overrides = {}
+
+    for name, url in shards.items():
+        assert emails(url) == {
+            email for email in registered if postgres.ring.shard_for(email) == name
+        }
+
+
+def test_reshard_moves_users_to_their_new_shard(shards):
+    first, second = shards
+    source = {first: shards[first]}
+    with psycopg.connect(shards[first]) as connection:
+        connection.execute(
+            """
+            WITH new_users AS (
+                INSERT INTO users (email, password_hash)
+                SELECT 'reshard' || i || '@gmail.com', 'hash'
+                FROM generate_series(1, 200) AS i
+                RETURNING id, email
+            ), codes AS (
+                INSERT INTO activation_codes (user_id, code, expires_at)
+                SELECT id, '1234', now() + interval '1 minute' FROM new_users
+            )
+            INSERT INTO email_outbox (email, code) SELECT email, '1234' FROM new_users;
+            """
+        )
+    ring = HashRing(shards)
+    to_move = {
+        email for email in emails(shards[first]) if ring.shard_for(email) == second
+    }
+    assert 50 < len(to_move) < 150
+
+    resharder = Resharder(source, shards, batch_size=64)
+    assert resharder.plan() == {f"{first} -> {second}": len(to_move)}
+    summary = resharder.run()
+    assert summary["scanned"] == 200
+    assert summary["moved"] == len(to_move)
+    assert summary["conflicts"] == 0
+    assert emails(shards[second]) == to_move
+    assert len(emails(shards[first])) == 200 - len(to_move)
+    with psycopg.connect(shards[second]) as connection:
+        assert (
+            connection.execute(
+                """
+            SELECT count(*) FROM users
+            JOIN activation_codes ON user_id = users.id
+            JOIN email_outbox USING (email);
+            """
+            ).fetchone()[0]
+            == len(to_move)
+        )
+
+    # Nothing left to move when run again.
+    assert Resharder(source, shards).plan() == {}
+    assert Resharder(source, shards).run()["moved"] == 0
+
+
+def test_reshard_keeps_users_registered_again_on_their_new_shard(shards):
+    first, second = shards
+    ring = HashRing(shards)
+    addresses = [f"reshard_conflict{i}@gmail.com" for i in range(40)]
+    to_move = [email for email in addresses if ring.shard_for(email) == second][:2]
+    copied, registered_again = to_move
+    with psycopg.connect(shards[first]) as connection:
+        for email in to_move:
+            connection.execute(
+                "INSERT INTO users (email, password_hash) VALUES (%s, 'hash');",
+                (email,),
+            )
+            connection.execute(
+                "INSERT INTO email_outbox (email, code, status, sent_at) VALUES (%s, '1234', 'sent', now());",
+                (email,),
+            )
+        created_at = connection.execute(
+            "SELECT created_at FROM users WHERE email = %s;", (copied,)
+        ).fetchone()[0]
+    with psycopg.connect(shards[second]) as connection:
+        # Copied by an interrupted run, and registered on the new shard since.
+        connection.execute(
+            "INSERT INTO users (email, password_hash, created_at) VALUES (%s, 'hash', %s);",
+            (copied, created_at),
+        )
+        connection.execute(
+            "INSERT INTO users (email, password_hash) VALUES (%s, 'other');",
+            (registered_again,),
+        )
+
+    summary = Resharder({first: shards[first]}, shards).run()
+    assert summary["moved"] == 0
+    assert summary["already_moved"] == 1
+    assert summary["conflicts"] == 1
+    assert emails(shards[first]) == {registered_again}
+    with psycopg.connect(shards[first]) as connection:
+        assert connection.execute("SELECT email FROM email_outbox;").fetchall() == [
+            (registered_again,)
+        ]
+
+
+def test_reshard_moves_the_sent_outbox_entries(shards):
+    first, second = shards
+    ring = HashRing(shards)
+    email = next(
+        email
+        for email in (f"reshard_sent{i}@gmail.com" for i in range(40))
+        if ring.shard_for(email) == second
+    )
+    with psycopg.connect(shards[first]) as connection:
+        connection.execute(
+            "INSERT INTO users (email, password_hash) VALUES (%s, 'hash');", (email,)
+        )
+        connection.execute(
+            "INSERT INTO email_outbox (email, code, status, sent_at) VALUES (%s, '1234', 'sent', now());",
+            (email,),
+        )
+
+    assert Resharder({first: shards[first]}, shards).run()["moved"] == 1
+    with psycopg.connect(shards[second]) as connection:
+        assert connection.execute(
+            "SELECT status, sent_at IS NOT NULL FROM email_outbox WHERE email = %s;",
+            (email,),
+        ).fetchall() == [("sent", True)]
@@ -0,0 +1,138 @@
+import asyncio
+
+import psycopg
+from app.sweeper import Sweeper
+from psycopg.rows import dict_row
+
+from .conftest import mock_postgres
+
+
+def sweep(batch_size=2):
+    async def scenario():
+        sweeper = Sweeper(
+            interval=0,
+            batch_size=batch_size,
+            expired_code_grace=0,
+            unactivated_user_retention=3600,
+            sent_email_retention=3600,
+        )
+        connection = await psycopg.AsyncConnection.connect(
+            mock_postgres.database_url, row_factory=dict_row
+        )
+        try:
+            purged = await sweeper.sweep(connection)
+        finally:
+            await connection.close()
+        return purged, sweeper.stats()
+
+    return asyncio.run(scenario())
+
+
+def insert_user(email, is_active=False, age="0 seconds", code_expires_in=None):
+    with psycopg.connect(mock_postgres.database_url) as connection:
+        user_id = connection.execute(
+            "INSERT INTO users (email, password_hash, is_active, created_at) VALUES (%s, 'hash', %s, now() - %s::interval) RETURNING id;",
+            (email, is_active, age),
+        ).fetchone()[0]
+        if code_expires_in is not None:
+            connection.execute(
+                "INSERT INTO activation_codes (user_id, code, expires_at) VALUES (%s, '1234', now() + %s::interval);",
+                (user_id, code_expires_in),
+            )
+    return user_id
+
+
+def count(query, params=()):
+    with psycopg.connect(mock_postgres.database_url) as connection:
+        return connection.execute(query, params).fetchone()[0]
+
+
+def test_sweeper_purges_expired_codes_in_batches():
+    mock_postgres.init_database()
+    expired = [
+        insert_user(f"sweeper_expired_{i}@gmail.com", code_expires_in="-1 minute")
+        for i in range(5)
+    ]
+    valid = insert_user("sweeper_valid@gmail.com", code_expires_in="1 minute")
+
+    purged, stats = sweep(batch_size=2)
+
+    assert purged == {
+        "expired_codes": 5,
+        "stale_users": 0,
+        "idempotency_keys": 0,
+        "sent_emails": 0,
+    }
+    assert stats["expired_codes_purged"] == 5
+    assert stats["runs"] == 1
+    assert (
+        count(
+            "SELECT count(*) FROM activation_codes WHERE user_id = ANY(%s);", (expired,)
+        )
+        == 0
+    )
+    assert (
+        count("SELECT count(*) FROM activation_codes WHERE user_id = %s;", (valid,))
+        == 1
+    )
+
+
+def test_sweeper_purges_stale_unactivated_users():
+    mock_postgres.init_database()
+    stale = insert_user(
+        "sweeper_stale@gmail.com", age="2 hours", code_expires_in="1 minute"
+    )
+    active = insert_user("sweeper_active@gmail.com", is_active=True, age="2 hours")
+    recent = insert_user("sweeper_recent@gmail.com")
+
+    purged, stats = sweep()
+
+    assert purged["stale_users"] == 1
+    assert stats["stale_users_purged"] == 1
+    assert count("SELECT count(*) FROM users WHERE id = %s;", (stale,)) == 0
+    assert (
+        count("SELECT count(*) FROM activation_codes WHERE user_id = %s;", (stale,))
+        == 0
+    )
+    assert (
+        count("SELECT count(*) FROM users WHERE id = ANY(%s);", ([active, recent],))
+        == 2
+    )
+
+
+def test_sweeper_purges_expired_idempotency_keys():
+    mock_postgres.init_database()
+    with psycopg.connect(mock_postgres.database_url) as connection:
+        connection.execute(
+            "INSERT INTO idempotency_keys (key, fingerprint, status_code, response, expires_at) VALUES ('expired', '', 200, '{}', now() - interval '1 second'), ('valid', '', 200, '{}', now() + interval '1 hour');"
+        )
+
+    purged, stats = sweep()
+
+    assert purged["idempotency_keys"] == 1
+    assert stats["idempotency_keys_purged"] == 1
+    assert count("SELECT array_agg(key) FROM idempotency_keys;") == ["valid"]
+
+
+def test_sweeper_purges_old_sent_emails():
+    mock_postgres.init_database()
+    with psycopg.connect(mock_postgres.database_url) as connection:
+        connection.execute(
+            """
+            INSERT INTO email_outbox (email, code, status, sent_at) VALUES
+                ('old@gmail.com', '1234', 'sent', now() - interval '2 hours'),
+                ('recent@gmail.com', '1234', 'sent', now()),
+                ('dead@gmail.com', '1234', 'dead', NULL),
+                ('pending@gmail.com', '1234', 'pending', NULL);
+            """
+        )
+
+    purged, stats = sweep()
+
+    assert purged["sent_emails"] == 1
+    assert stats["sent_emails_purged"] == 1
+    assert count("SELECT array_agg(email ORDER BY email) FROM email_outbox;") == [
+        "dead@gmail.com",
+        "pending@gmail.com",
+        "recent@gmail.com",
+    ]